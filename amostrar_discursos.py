@@ -2,14 +2,33 @@
 # -*- coding: utf-8 -*-
 
 """
-Amostragem estratificada (1%) por partido, com piso de 1 quando N<100,
-a partir de data/Discursos.sqlite → data/Amostra_1.sqlite.
+Amostragem estratificada a partir de data/Discursos.sqlite → Amostra_1.sqlite.
 Adiciona NomeParlamentar (join em data/Senadores.sqlite pela chave CodigoParlamentar).
 
-Critério de inclusão: TextoIntegral com mais de 200 palavras (aprox. por contagem de espaços em SQL).
+Desenho padrão: 1% por partido, com piso de 1 por estrato (tabela DiscursosAmostra).
+Outros desenhos podem ser gerados na mesma execução com --desenho, no formato
+nome:estratos:fração, onde estratos combina partido, ano e orador com "+":
+
+    python amostrar_discursos.py --seed 42 --desenho ano_partido:ano+partido:0.02
+
+Cada desenho vira a tabela DiscursosAmostra_{nome} (o padrão mantém o nome
+DiscursosAmostra).
+
+Critério de inclusão: TextoIntegral com mais de 200 palavras. A contagem exata
+fica na tabela lateral ContagensDiscursos (src/contagens.py), atualizada de
+forma incremental no início de cada execução; a seleção dos elegíveis é uma
+varredura do índice por n_palavras.
+
+Execução (qualquer número de desenhos):
+1) uma consulta agregada (sem ler textos) dá o N de cada estrato -> tamanho k;
+2) uma única passada pelos elegíveis faz reservoir sampling (k por estrato,
+   para todos os desenhos ao mesmo tempo);
+3) os ids escolhidos vão para uma tabela temporária e cada amostra é copiada
+   com um único INSERT ... SELECT ... JOIN.
 
 Uso:
     python amostrar_discursos.py --seed 42
+    python amostrar_discursos.py --seed 42 --recontar   # textos alterados
 """
 
 from __future__ import annotations
@@ -19,7 +38,9 @@ import math
 import random
 import sqlite3
 from pathlib import Path
-from typing import Dict, List, Tuple
+from typing import Any, Dict, List, Tuple
+
+from src.contagens import TBL_CONTAGENS, atualizar_contagens
 
 SRC_DISCURSOS = Path("data/Discursos.sqlite")
 SRC_SENADORES = Path("data/Senadores.sqlite")
@@ -27,138 +48,189 @@ DEST_DB = Path("Amostra_1.sqlite")
 
 TBL_DISCURSOS = "Discursos"
 TBL_SAIDA = "DiscursosAmostra"
-BATCH_SIZE = 800  # tamanho do IN (...) por batch
-
-
-SQL_WORDS_FILTER = f"""
--- Aproximação de contagem de palavras: (nº de espaços + 1) em texto "normalizado"
-WITH base AS (
-  SELECT
-    CodigoPronunciamento,
-    SiglaPartidoParlamentarNaData,
-    CodigoParlamentar,
-    TRIM(
-      REPLACE(
-        REPLACE(
-          REPLACE(
-            REPLACE(COALESCE(TextoIntegral, ''), CHAR(10), ' '),  -- \n
-          CHAR(13), ' '),                                         -- \r
-        CHAR(9), ' '),                                            -- \t
-      '  ', ' ')                                                  -- *redução parcial; ainda pode sobrar duplo espaço
-    ) AS T
-  FROM {TBL_DISCURSOS}
-)
-SELECT
-  CodigoPronunciamento,
-  COALESCE(SiglaPartidoParlamentarNaData, 'SEM_PARTIDO') AS SiglaPartidoParlamentarNaData,
-  CodigoParlamentar
-FROM base
-WHERE
-  -- conta de palavras ≈ espaços + 1
-  (LENGTH(T) - LENGTH(REPLACE(T, ' ', ''))) + 1 > 200;
+MIN_PALAVRAS = 200
+
+# Estratos disponíveis -> expressão SQL sobre Discursos (alias d)
+ESTRATOS = {
+    "partido": "COALESCE(d.SiglaPartidoParlamentarNaData, 'SEM_PARTIDO')",
+    "ano": "substr(d.DataPronunciamento, 1, 4)",
+    "orador": "d.CodigoParlamentar",
+}
+DESENHO_PADRAO = {"nome": "padrao", "estratos": ("partido",), "fracao": 0.01, "tabela": TBL_SAIDA}
+
+SQL_ELEGIVEIS = f"""
+FROM {TBL_CONTAGENS} c
+JOIN {TBL_DISCURSOS} d ON d.CodigoPronunciamento = c.CodigoPronunciamento
+WHERE c.n_palavras > ?
 """
 
 
-def tamanho_amostra_por_partido(n: int) -> int:
-    if n >= 100:
-        return max(1, math.ceil(0.01 * n))
-    return 1 if n > 0 else 0
+def tamanho_amostra(n: int, fracao: float = 0.01) -> int:
+    """ceil(fração·N), com piso de 1 para estratos não vazios."""
+    return max(1, math.ceil(fracao * n)) if n > 0 else 0
 
 
-def coletar_elegiveis(conn_disc: sqlite3.Connection) -> Dict[str, List[Tuple[int, int | None]]]:
+def parse_desenho(spec: str) -> Dict[str, Any]:
+    """'nome:estrato1+estrato2:fração' -> desenho."""
+    try:
+        nome, estratos, fracao = spec.split(":")
+        estratos_t = tuple(e.strip() for e in estratos.split("+") if e.strip())
+        fracao_f = float(fracao)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Desenho inválido: {spec!r} (esperado nome:estratos:fração)")
+    invalidos = [e for e in estratos_t if e not in ESTRATOS]
+    if invalidos or not estratos_t:
+        raise argparse.ArgumentTypeError(f"Estratos inválidos em {spec!r}; use {', '.join(ESTRATOS)}")
+    if not 0 < fracao_f <= 1:
+        raise argparse.ArgumentTypeError(f"Fração fora de (0, 1] em {spec!r}")
+    if not nome.isidentifier():
+        raise argparse.ArgumentTypeError(f"Nome de desenho inválido: {nome!r}")
+    return {"nome": nome, "estratos": estratos_t, "fracao": fracao_f, "tabela": f"{TBL_SAIDA}_{nome}"}
+
+
+def _colunas(desenhos: List[Dict[str, Any]]) -> List[str]:
+    """União dos estratos usados, em ordem estável."""
+    return [e for e in ESTRATOS if any(e in d["estratos"] for d in desenhos)]
+
+
+def contar_estratos(
+    conn_disc: sqlite3.Connection,
+    desenhos: List[Dict[str, Any]],
+    min_palavras: int = MIN_PALAVRAS,
+) -> Dict[str, Dict[Tuple, int]]:
     """
-    Retorna {partido: [(CodigoPronunciamento, CodigoParlamentar), ...]} apenas dos discursos >200 palavras.
+    N por estrato de cada desenho, a partir de um único GROUP BY na
+    combinação mais fina dos estratos usados (só metadados, sem TextoIntegral).
     """
-    partidos: Dict[str, List[Tuple[int, int | None]]] = {}
-    cur = conn_disc.execute(SQL_WORDS_FILTER)
+    colunas = _colunas(desenhos)
+    exprs = ", ".join(ESTRATOS[c] for c in colunas)
+    cur = conn_disc.execute(f"SELECT {exprs}, COUNT(*) {SQL_ELEGIVEIS} GROUP BY {exprs}", (min_palavras,))
+    contagens: Dict[str, Dict[Tuple, int]] = {d["nome"]: {} for d in desenhos}
     total = 0
-    for cod, partido, cod_parl in cur:
-        partidos.setdefault(partido, []).append((cod, cod_parl))
-        total += 1
-    print(f"[INFO] Discursos elegíveis (>200 palavras): {total:,}")
-    print(f"[INFO] Partidos com pelo menos 1 elegível: {len(partidos)}")
-    return partidos
-
-
-def amostrar_por_partido(
-    elegiveis: Dict[str, List[Tuple[int, int | None]]],
+    for *valores, n in cur:
+        linha = dict(zip(colunas, valores))
+        total += n
+        for d in desenhos:
+            chave = tuple(linha[e] for e in d["estratos"])
+            contagens[d["nome"]][chave] = contagens[d["nome"]].get(chave, 0) + n
+    print(f"[INFO] Discursos elegíveis (>{min_palavras} palavras): {total:,}")
+    for d in desenhos:
+        print(f"[INFO] Desenho '{d['nome']}': {len(contagens[d['nome']])} estratos com pelo menos 1 elegível")
+    return contagens
+
+
+def amostrar(
+    conn_disc: sqlite3.Connection,
+    desenhos: List[Dict[str, Any]],
+    min_palavras: int = MIN_PALAVRAS,
     *,
     seed: int | None = None,
-) -> List[int]:
-    if seed is not None:
-        random.seed(seed)
-    amostra_ids: List[int] = []
-    for partido, linhas in elegiveis.items():
-        n = len(linhas)
-        k = tamanho_amostra_por_partido(n)
-        if k == 0:
-            continue
-        escolhidos = random.sample(linhas, min(k, n))
-        amostra_ids.extend([cod for cod, _ in escolhidos])
-    print(f"[INFO] Total de discursos na amostra: {len(amostra_ids):,}")
-    return amostra_ids
-
-
-def preparar_destino(conn_dest: sqlite3.Connection):
-    conn_dest.execute(f"DROP TABLE IF EXISTS {TBL_SAIDA};")
-    conn_dest.commit()
-
-
-def copiar_amostra_com_join(
+) -> Dict[str, List[int]]:
+    """
+    Uma passada pelos elegíveis com reservoir sampling (algoritmo R) por
+    estrato, para todos os desenhos. Retorna {nome do desenho: [CodigoPronunciamento, ...]}.
+    """
+    contagens = contar_estratos(conn_disc, desenhos, min_palavras)
+    # um gerador por desenho: o resultado de cada um não depende dos outros
+    rngs = {d["nome"]: random.Random(f"{seed}-{d['nome']}") if seed is not None else random.Random() for d in desenhos}
+    k = {
+        d["nome"]: {chave: tamanho_amostra(n, d["fracao"]) for chave, n in contagens[d["nome"]].items()}
+        for d in desenhos
+    }
+    vistos: Dict[str, Dict[Tuple, int]] = {d["nome"]: {} for d in desenhos}
+    reservas: Dict[str, Dict[Tuple, List[int]]] = {d["nome"]: {} for d in desenhos}
+
+    colunas = _colunas(desenhos)
+    exprs = ", ".join(ESTRATOS[c] for c in colunas)
+    cur = conn_disc.execute(
+        f"SELECT d.CodigoPronunciamento, {exprs} {SQL_ELEGIVEIS} ORDER BY d.CodigoPronunciamento",
+        (min_palavras,),
+    )
+    for cod, *valores in cur:
+        linha = dict(zip(colunas, valores))
+        for d in desenhos:
+            nome = d["nome"]
+            chave = tuple(linha[e] for e in d["estratos"])
+            n = vistos[nome][chave] = vistos[nome].get(chave, 0) + 1
+            reserva = reservas[nome].setdefault(chave, [])
+            if n <= k[nome][chave]:
+                reserva.append(cod)
+            else:
+                j = rngs[nome].randrange(n)
+                if j < k[nome][chave]:
+                    reserva[j] = cod
+
+    amostras = {}
+    for d in desenhos:
+        ids = [cod for reserva in reservas[d["nome"]].values() for cod in reserva]
+        amostras[d["nome"]] = sorted(ids)
+        print(f"[INFO] Desenho '{d['nome']}': {len(ids):,} discursos na amostra")
+    return amostras
+
+
+def copiar_amostras(
     conn_disc: sqlite3.Connection,
-    conn_sen: sqlite3.Connection,
-    conn_dest: sqlite3.Connection,
-    ids: List[int],
+    desenhos: List[Dict[str, Any]],
+    amostras: Dict[str, List[int]],
 ):
     """
-    Cria {TBL_SAIDA} no destino com todas as colunas de Discursos + NomeParlamentar (LEFT JOIN Senadores).
-    Faz em batches para não estourar o IN (...).
+    Coloca os ids escolhidos numa tabela temporária e cria, para cada desenho,
+    a tabela de saída no destino com todas as colunas de Discursos +
+    NomeParlamentar (LEFT JOIN Senadores), num único CREATE TABLE ... AS SELECT.
     """
-    preparar_destino(conn_dest)
-
-    # Cria tabela destino com o mesmo schema de Discursos + NomeParlamentar.
-    # Como schemas podem variar, criaremos via SELECT INTO (CTAS) no primeiro batch e depois INSERT nos demais.
-    primeiro_batch = True
-    for i in range(0, len(ids), BATCH_SIZE):
-        lote = ids[i : i + BATCH_SIZE]
-        placeholders = ",".join("?" for _ in lote)
-        # Usamos ATTACH para ler de duas origens no mesmo execute.
-        conn_disc.execute("ATTACH DATABASE ? AS sen_db;", (str(SRC_SENADORES),))
-        conn_disc.execute("ATTACH DATABASE ? AS dest_db;", (str(DEST_DB),))
-
-        sql_select_join = f"""
-            SELECT d.*, s.NomeParlamentar
-            FROM {TBL_DISCURSOS} d
-            LEFT JOIN sen_db.Senadores s
-              ON s.CodigoParlamentar = d.CodigoParlamentar
-            WHERE d.CodigoPronunciamento IN ({placeholders})
-        """
-
-        if primeiro_batch:
-            # CTAS
-            ct_sql = f"""
-                CREATE TABLE dest_db.{TBL_SAIDA} AS
-                {sql_select_join}
-            """
-            conn_disc.execute(ct_sql, lote)
-            primeiro_batch = False
-        else:
-            ins_sql = f"""
-                INSERT INTO dest_db.{TBL_SAIDA}
-                {sql_select_join}
-            """
-            conn_disc.execute(ins_sql, lote)
-
+    conn_disc.execute(
+        "CREATE TEMP TABLE IF NOT EXISTS amostra_ids ("
+        " desenho TEXT NOT NULL, CodigoPronunciamento INTEGER NOT NULL,"
+        " PRIMARY KEY (desenho, CodigoPronunciamento))"
+    )
+    conn_disc.execute("DELETE FROM temp.amostra_ids")
+    for d in desenhos:
+        conn_disc.executemany(
+            "INSERT INTO temp.amostra_ids VALUES (?, ?)",
+            ((d["nome"], cod) for cod in amostras.get(d["nome"], [])),
+        )
+    conn_disc.commit()  # ATTACH não pode ocorrer dentro de uma transação
+
+    conn_disc.execute("ATTACH DATABASE ? AS sen_db;", (str(SRC_SENADORES),))
+    conn_disc.execute("ATTACH DATABASE ? AS dest_db;", (str(DEST_DB),))
+    try:
+        for d in desenhos:
+            if not amostras.get(d["nome"]):
+                print(f"[AVISO] Desenho '{d['nome']}' sem discursos; tabela não criada.")
+                continue
+            conn_disc.execute(f"DROP TABLE IF EXISTS dest_db.{d['tabela']}")
+            conn_disc.execute(
+                f"""
+                CREATE TABLE dest_db.{d['tabela']} AS
+                SELECT d.*, s.NomeParlamentar
+                FROM temp.amostra_ids a
+                JOIN {TBL_DISCURSOS} d ON d.CodigoPronunciamento = a.CodigoPronunciamento
+                LEFT JOIN sen_db.Senadores s ON s.CodigoParlamentar = d.CodigoParlamentar
+                WHERE a.desenho = ?
+                ORDER BY a.CodigoPronunciamento
+                """,
+                (d["nome"],),
+            )
+            print(f"[OK] Tabela '{d['tabela']}' criada em {DEST_DB} (com NomeParlamentar).")
+        conn_disc.commit()
+    finally:
         conn_disc.execute("DETACH DATABASE sen_db;")
         conn_disc.execute("DETACH DATABASE dest_db;")
-        conn_disc.commit()
-
-    print(f"[OK] Tabela '{TBL_SAIDA}' criada em {DEST_DB} (com NomeParlamentar).")
 
 
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument("--seed", type=int, default=None, help="Seed para reprodutibilidade")
+    parser.add_argument("--min-palavras", type=int, default=MIN_PALAVRAS, help="Mínimo de palavras (exclusivo)")
+    parser.add_argument("--recontar", action="store_true", help="Recalcula as contagens de todos os discursos")
+    parser.add_argument(
+        "--desenho",
+        type=parse_desenho,
+        action="append",
+        default=[],
+        help="Desenho extra nome:estratos:fração (estratos: partido, ano, orador, combinados com +); repetível",
+    )
+    parser.add_argument("--sem-padrao", action="store_true", help="Não gera o desenho padrão (1%% por partido)")
     args = parser.parse_args()
 
     if not SRC_DISCURSOS.exists():
@@ -166,28 +238,29 @@ def main():
     if not SRC_SENADORES.exists():
         raise FileNotFoundError(f"Não encontrei {SRC_SENADORES.resolve()}")
 
+    desenhos = ([] if args.sem_padrao else [DESENHO_PADRAO]) + args.desenho
+    if not desenhos:
+        parser.error("nenhum desenho de amostragem")
+    if len({d["nome"] for d in desenhos}) != len(desenhos):
+        parser.error("nomes de desenho repetidos")
+
     DEST_DB.parent.mkdir(parents=True, exist_ok=True)
     if DEST_DB.exists():
         DEST_DB.unlink()
 
-    # Conexões
     conn_disc = sqlite3.connect(str(SRC_DISCURSOS))
-    conn_sen = sqlite3.connect(str(SRC_SENADORES))
-    conn_dest = sqlite3.connect(str(DEST_DB))
-
     try:
-        elegiveis = coletar_elegiveis(conn_disc)
-        ids = amostrar_por_partido(elegiveis, seed=args.seed)
+        # a amostragem só precisa das palavras; tokens: python -m src.contagens
+        atualizar_contagens(conn_disc, TBL_DISCURSOS, recontar=args.recontar, com_tokens=False)
+        amostras = amostrar(conn_disc, desenhos, args.min_palavras, seed=args.seed)
 
-        if not ids:
+        if not any(amostras.values()):
             print("[AVISO] Nenhum discurso elegível encontrado para amostrar.")
             return
 
-        copiar_amostra_com_join(conn_disc, conn_sen, conn_dest, ids)
+        copiar_amostras(conn_disc, desenhos, amostras)
     finally:
         conn_disc.close()
-        conn_sen.close()
-        conn_dest.close()
 
 
 if __name__ == "__main__":
@@ -1,11 +1,20 @@
-import datetime as dt
+import math
+import shutil
 from pathlib import Path
 
 import pandas as pd
 import plotly.express as px
 import streamlit as st
 
-from utils import load_spans, load_meta, apply_filters, to_density, highlight_spans
+from utils import (
+    EXPORT_DIR,
+    EXPORT_FORMATS,
+    EXPORT_MAX_DOWNLOAD_BYTES,
+    export_rows,
+    filter_speech_spans,
+    get_backend,
+    render_speech,
+)
 
 st.set_page_config(page_title="Figuras de Linguagem — Senado", layout="wide")
 
@@ -22,29 +31,24 @@ st.markdown(
     mark.label-analogia {background-color:#06B6D4; color:white;}
     mark.label-eufemismo {background-color:#EAB308; color:white;}
     mark.label-metonimia {background-color:#6366F1; color:white;}
+    mark.overlap {outline:2px dashed rgba(0,0,0,0.6); outline-offset:-1px;}
     </style>
     """,
     unsafe_allow_html=True,
 )
 
 # Load data ---------------------------------------------------------------
-spans = load_spans()
-meta = load_meta()
-if not meta.empty:
-    spans = spans.merge(meta, on="CodigoPronunciamento", how="left")
-if "Data" in spans:
-    spans["Data"] = pd.to_datetime(spans["Data"])
-    spans["ano_mes"] = spans["Data"].dt.to_period("M").astype(str)
-if "tamanho_discurso_palavras" not in spans:
-    spans["tamanho_discurso_palavras"] = 1
-spans = to_density(spans)
+# All filtering and aggregation goes through the backend (utils.get_backend):
+# in-memory frames + filter index + density cube by default, or DuckDB over
+# Parquet with FIGURAS_BACKEND=duckdb. Speech texts are not part of the span
+# table; the Discurso page fetches one at a time with load_texto().
+backend = get_backend()
 
 # Query params -----------------------------------------------------------
 params = st.experimental_get_query_params()
 
 # defaults
-min_date = spans["Data"].min() if "Data" in spans else dt.date.today()
-max_date = spans["Data"].max() if "Data" in spans else dt.date.today()
+min_date, max_date = backend.date_bounds()
 
 filters = {
     "labels": params.get("labels", []),
@@ -55,6 +59,7 @@ filters = {
     "conf_min": float(params.get("conf_min", [0])[0]) if params.get("conf_min") else 0.0,
     "normalizado": params.get("normalizado", ["0"])[0] == "1",
     "q": params.get("q", [""])[0],
+    "q_em": params.get("q_em", ["spans"])[0],
     "page": params.get("page", ["Panorama"])[0],
 }
 
@@ -64,15 +69,15 @@ with st.sidebar:
     page = st.radio("Página", ["Panorama", "Explorar", "Discurso"], index=["Panorama", "Explorar", "Discurso"].index(filters["page"]))
 
     st.markdown("**Filtros**")
-    labels = st.multiselect("Tipo de figura", sorted(spans["label"].dropna().unique()), default=filters["labels"])
+    labels = st.multiselect("Tipo de figura", backend.options("label"), default=filters["labels"])
     oradores = st.multiselect(
         "Orador",
-        sorted(spans.get("NomeParlamentar", pd.Series(dtype=str)).dropna().unique()),
+        backend.options("NomeParlamentar"),
         default=filters["oradores"],
     )
     partidos = st.multiselect(
         "Partido",
-        sorted(spans.get("SiglaPartidoParlamentarNaData", pd.Series(dtype=str)).dropna().unique()),
+        backend.options("SiglaPartidoParlamentarNaData"),
         default=filters["partidos"],
     )
     data_ini, data_fim = st.date_input(
@@ -81,7 +86,18 @@ with st.sidebar:
     )
     conf_min = st.slider("Confiança mínima", 0.0, 1.0, filters["conf_min"], step=0.05)
     normalizado = st.checkbox("Mostrar valores por 1000 palavras", value=filters["normalizado"])
-    q = st.text_input("Busca textual", value=filters["q"])
+    q = st.text_input(
+        "Busca textual",
+        value=filters["q"],
+        help='Sem acento/caixa. "frase exata", prefixo*, termo1 OR termo2.',
+    )
+    escopos = {"spans": "Trechos (texto, justificativa, pistas)", "discursos": "Texto integral do discurso"}
+    q_em = st.radio(
+        "Buscar em",
+        list(escopos),
+        index=list(escopos).index(filters["q_em"]) if filters["q_em"] in escopos else 0,
+        format_func=escopos.get,
+    )
 
     btn1, btn2 = st.columns(2)
     with btn1:
@@ -95,6 +111,7 @@ with st.sidebar:
                 "conf_min": conf_min,
                 "normalizado": "1" if normalizado else "0",
                 "q": q,
+                "q_em": q_em,
                 "page": page,
             }
             params = st.query_params
@@ -114,14 +131,15 @@ filter_dict = {
     "data_fim": pd.to_datetime(data_fim),
     "conf_min": conf_min,
     "q": q,
+    "q_em": q_em,
 }
 
-df_filt = apply_filters(spans, filter_dict)
+resumo_filtro = backend.summary(filter_dict)
+
+
+def agg(dims):
+    return backend.rollup(dims, filter_dict, normalizado)
 
-if normalizado:
-    df_plot = df_filt.copy()
-else:
-    df_plot = df_filt.assign(peso=1)
 
 # Glossary --------------------------------------------------------------
 
@@ -157,35 +175,32 @@ with st.sidebar.expander("Glossário"):
 if page == "Panorama":
     st.subheader("Panorama")
     col1, col2, col3, col4 = st.columns(4)
-    col1.metric("# discursos", int(df_filt["CodigoPronunciamento"].nunique()))
-    col2.metric("# spans", int(len(df_filt)))
-    col3.metric("# oradores", int(df_filt.get("NomeParlamentar", pd.Series()).nunique()))
-    col4.metric("# partidos", int(df_filt.get("SiglaPartidoParlamentarNaData", pd.Series()).nunique()))
-
-    if not df_plot.empty and "ano_mes" in df_plot:
-        serie = (
-            df_plot.groupby(["ano_mes", "label"], as_index=False)["peso"].sum()
-        )
+    col1.metric("# discursos", resumo_filtro["discursos"])
+    col2.metric("# spans", resumo_filtro["spans"])
+    col3.metric("# oradores", resumo_filtro["oradores"])
+    col4.metric("# partidos", resumo_filtro["partidos"])
+
+    serie = agg(["ano_mes", "label"]) if resumo_filtro["spans"] else pd.DataFrame()
+    if not serie.empty:
         fig = px.area(serie, x="ano_mes", y="peso", color="label")
         fig.update_layout(xaxis_title="Mês", yaxis_title="Spans" if not normalizado else "Spans/1000 palavras")
         st.plotly_chart(fig, use_container_width=True)
 
-    if not df_plot.empty and "SiglaPartidoParlamentarNaData" in df_plot:
-        heat = (
-            df_plot.groupby(["SiglaPartidoParlamentarNaData", "label"], as_index=False)["peso"].sum()
-        )
+    heat = agg(["SiglaPartidoParlamentarNaData", "label"]) if resumo_filtro["spans"] else pd.DataFrame()
+    if not heat.empty:
         pivot = heat.pivot(index="label", columns="SiglaPartidoParlamentarNaData", values="peso").fillna(0)
         fig2 = px.imshow(pivot, aspect="auto", color_continuous_scale="Blues")
         st.plotly_chart(fig2, use_container_width=True)
 
-    if not df_plot.empty and "NomeParlamentar" in df_plot:
-        top = (
-            df_plot.groupby("NomeParlamentar", as_index=False)["peso"].sum().sort_values("peso", ascending=False).head(10)
-        )
+    top = agg(["NomeParlamentar"]) if resumo_filtro["spans"] else pd.DataFrame()
+    if not top.empty:
+        top = top.sort_values("peso", ascending=False).head(10)
         fig3 = px.bar(top, x="peso", y="NomeParlamentar", orientation="h")
         st.plotly_chart(fig3, use_container_width=True)
 
-    exemplos = df_filt.head(6)
+    exemplos = backend.rows(
+        filter_dict, ["NomeParlamentar", "SiglaPartidoParlamentarNaData", "Data", "label", "text"], limit=6
+    )
     for _, row in exemplos.iterrows():
         st.markdown(
             f"**{row.get('NomeParlamentar', '')} ({row.get('SiglaPartidoParlamentarNaData', '')}) — {row.get('Data', '')}**"
@@ -196,23 +211,24 @@ if page == "Panorama":
 elif page == "Explorar":
     st.subheader("Explorar")
     cols = [
-        c
-        for c in [
-            "Data",
-            "NomeParlamentar",
-            "SiglaPartidoParlamentarNaData",
-            "label",
-            "text",
-            "confidence",
-            "CodigoPronunciamento",
-        ]
-        if c in df_filt.columns
+        "Data",
+        "NomeParlamentar",
+        "SiglaPartidoParlamentarNaData",
+        "label",
+        "text",
+        "confidence",
+        "CodigoPronunciamento",
     ]
-    df_display = df_filt[cols].copy()
+    # only the visible page is fetched from the backend
+    total = resumo_filtro["spans"]
+    pcol1, pcol2, pcol3 = st.columns([1, 1, 2])
+    tamanho_pagina = pcol1.selectbox("Linhas por página", [50, 100, 250, 500], index=1)
+    n_paginas = max(1, math.ceil(total / tamanho_pagina))
+    pagina = int(pcol2.number_input("Página", min_value=1, max_value=n_paginas, value=1, step=1))
+    pcol3.caption(f"{total} spans — página {pagina} de {n_paginas}")
+    df_display = backend.rows(filter_dict, cols, limit=tamanho_pagina, offset=(pagina - 1) * tamanho_pagina).copy()
     if "CodigoPronunciamento" in df_display:
-        df_display["Discurso"] = df_display["CodigoPronunciamento"].apply(
-            lambda x: f"?page=Discurso&codigo={x}"
-        )
+        df_display["Discurso"] = "?page=Discurso&codigo=" + df_display["CodigoPronunciamento"].astype(str)
         show_cols = [c for c in df_display.columns if c != "CodigoPronunciamento"]
         try:
             st.dataframe(
@@ -226,34 +242,51 @@ elif page == "Explorar":
             )
         except Exception:
             df_tmp = df_display[show_cols].copy()
-            df_tmp["Discurso"] = df_tmp["Discurso"].apply(
-                lambda url: f"<a href='{url}'>ver</a>"
-            )
+            df_tmp["Discurso"] = "<a href='" + df_tmp["Discurso"] + "'>ver</a>"
             st.markdown(df_tmp.to_html(escape=False, index=False), unsafe_allow_html=True)
     else:
         st.dataframe(df_display, use_container_width=True)
-    csv = df_filt[cols].to_csv(index=False).encode("utf-8")
-    st.download_button("Exportar CSV", csv, "spans.csv", "text/csv")
+    # export: generated only on request, streamed to a temp file in batches.
+    # The browser download loads the file into memory (see
+    # EXPORT_MAX_DOWNLOAD_BYTES); larger exports are moved to EXPORT_DIR and
+    # only their path is shown.
+    ecol1, ecol2 = st.columns([1, 3])
+    formato = ecol1.selectbox("Formato", list(EXPORT_FORMATS))
+    chave_export = (repr(sorted(filter_dict.items())), formato)
+    if ecol2.button("Preparar exportação"):
+        anterior = st.session_state.pop("export", None)
+        if anterior and anterior[1].parent != EXPORT_DIR:
+            anterior[1].unlink(missing_ok=True)
+        with st.spinner("Gerando arquivo..."):
+            caminho = export_rows(backend, filter_dict, cols, formato)
+        if caminho.stat().st_size > EXPORT_MAX_DOWNLOAD_BYTES:
+            EXPORT_DIR.mkdir(parents=True, exist_ok=True)
+            caminho = Path(shutil.move(str(caminho), str(EXPORT_DIR / caminho.name)))
+        st.session_state["export"] = (chave_export, caminho)
+    export = st.session_state.get("export")
+    if export and export[0] == chave_export and export[1].exists():
+        mime, sufixo = EXPORT_FORMATS[formato]
+        if export[1].parent == EXPORT_DIR:
+            tamanho_mb = export[1].stat().st_size / 1e6
+            st.info(f"Arquivo de {tamanho_mb:,.0f} MB, grande demais para baixar pelo navegador: {export[1].resolve()}")
+        else:
+            with export[1].open("rb") as fh:
+                st.download_button(f"Baixar {formato}", fh, f"spans{sufixo}", mime)
 
     # Mini charts
-    if not df_plot.empty:
-        treemap = df_plot.groupby("label", as_index=False)["peso"].sum()
+    if resumo_filtro["spans"]:
+        treemap = agg(["label"])
         figt = px.treemap(treemap, path=["label"], values="peso")
         st.plotly_chart(figt, use_container_width=True)
 
-        ranking = (
-            df_plot.groupby(["ano_mes", "label"], as_index=False)["peso"].sum()
-            .sort_values(["ano_mes", "peso"], ascending=[True, False])
-        )
-        ranking["rank"] = ranking.groupby("ano_mes")["peso"].rank("dense", ascending=False)
+        ranking = agg(["ano_mes", "label"]).sort_values(["ano_mes", "peso"], ascending=[True, False])
+        ranking["rank"] = ranking.groupby("ano_mes", observed=True)["peso"].rank("dense", ascending=False)
         figb = px.line(ranking, x="ano_mes", y="rank", color="label")
         figb.update_yaxes(autorange="reversed")
         st.plotly_chart(figb, use_container_width=True)
 
-        if "SiglaPartidoParlamentarNaData" in df_plot:
-            dens = (
-                df_plot.groupby(["SiglaPartidoParlamentarNaData"], as_index=False)["peso"].sum()
-            )
+        dens = agg(["SiglaPartidoParlamentarNaData"])
+        if not dens.empty:
             figd = px.scatter(dens, x="peso", y="SiglaPartidoParlamentarNaData")
             st.plotly_chart(figd, use_container_width=True)
 
@@ -268,16 +301,19 @@ elif page == "Discurso":
     if codigo is None:
         st.info("Selecione um discurso na página Explorar.")
     else:
-        meta_row = meta[meta["CodigoPronunciamento"] == codigo]
-        spans_disc = spans[spans["CodigoPronunciamento"] == codigo]
+        meta_row, spans_disc = backend.speech(codigo)
         if meta_row.empty:
             st.warning("Discurso não encontrado nos metadados.")
         else:
             rec = meta_row.iloc[0]
             st.markdown(f"### {rec['NomeParlamentar']} ({rec['SiglaPartidoParlamentarNaData']})")
             st.caption(str(rec['Data']))
-            st.markdown(highlight_spans(rec.get("TextoIntegral", ""), spans_disc), unsafe_allow_html=True)
+            # highlighted HTML is cached per speech and label/confidence filters
+            chave_labels = tuple(sorted(labels))
+            st.markdown(render_speech(codigo, chave_labels, float(conf_min)), unsafe_allow_html=True)
+
+            spans_disc = filter_speech_spans(spans_disc, chave_labels, float(conf_min))
 
-            resumo = spans_disc.groupby("label").agg(spans=("label", "count"))
+            resumo = spans_disc.groupby("label", observed=True).agg(spans=("label", "count"))
             resumo["densidade"] = resumo["spans"] * (1000 / rec.get("tamanho_discurso_palavras", 1))
             st.table(resumo)
@@ -14,25 +14,103 @@ Fluxo:
 3) Cria o batch (/v1/batches) e acompanha status
 4) Baixa output.jsonl e parseia para Parquet (uma linha por span)
 
+Modo sharding (--shard): o fluxo de requisições é dividido em vários JSONL
+limitados por nº de requisições, bytes e tokens estimados; cada shard vira um
+batch próprio (rodam em paralelo na OpenAI) e todos ficam registrados sob um
+mesmo run id em data/batch_figuras/run_<run_id>/run.json. Os batches do run
+são acompanhados ao mesmo tempo (asyncio, backoff com jitter) e cada um é
+baixado em blocos e convertido para Parquet assim que termina.
+
+Empacotamento (--empacotar): em vez da estimativa chars/4 e do corte
+sequencial, os tokens de cada requisição são contados com o tiktoken
+(prompt + schema + discurso + saída prevista, --tokens-saida) e as requisições
+são distribuídas entre os shards com totais de tokens equilibrados, abaixo da
+cota (src/empacotamento.py); o custo previsto de cada shard vai para o run.json.
+Com --calibracao (src/calibracao.py, ajustado com o `usage` e os timestamps de
+batches anteriores, gravados em {batch_id}_batch.json no download), a saída
+prevista depende do tamanho de cada discurso e o tempo de cada shard é estimado.
+
+Retomada: o manifesto em data/batch_figuras/manifesto.sqlite (src/manifesto.py)
+guarda o status de cada discurso por modelo e hash do schema; só entram no
+JSONL os discursos ausentes ou que falharam (--ignorar-manifesto desliga).
+Na partida, batches que ainda têm discursos "enviado" (queda depois da
+submissão, batch expirado sem acompanhamento) são consultados: os finalizados
+são baixados e convertidos ({batch_id}_spans.parquet) e os discursos sem
+resposta passam a "falhou" e voltam para a fila.
+
+Cache: requisições cuja resposta já está no cache local (src/cache_respostas.py)
+não são enviadas; a resposta guardada vai para *_cache_output.jsonl, no mesmo
+formato do output do batch, e é ingerida junto. Os resultados dos batches
+alimentam o cache (--sem-cache desliga).
+
+Janelas (--janela-chars): discursos longos são divididos em janelas
+sobrepostas em fronteiras de frase/parágrafo (src/janelas.py), uma requisição
+por janela (custom_id disc-{codigo}-j{i}-o{offset}-n{total}); na ingestão os
+offsets voltam para o discurso inteiro e os spans repetidos na sobreposição
+são descartados (arquivo *_spans.parquet consolidado do run). As janelas de um
+discurso vão sempre no mesmo shard, e o manifesto só o dá por concluído
+quando todas foram respondidas.
+
+Alinhamento: na consolidação, cada span é localizado pelo seu texto no
+TextoIntegral (src/alinhamento.py), corrigindo start_char/end_char e gravando
+align_score/align_method (--sem-alinhamento desliga). Em seguida é construído o
+índice de busca textual (src/busca.py) e o cubo de densidade dos gráficos
+(src/cubo.py) ao lado do Parquet consolidado.
+
+Deduplicação (--dedup): discursos quase idênticos (MinHash + LSH,
+src/duplicatas.py) formam grupos; quando o representante está na fila do run,
+só ele é enviado e, na consolidação, os spans dele são copiados para os demais
+membros da fila, realinhados ao texto de cada um, e esses membros ficam
+"concluido" no manifesto. Membros cujo representante não está na fila são
+enviados normalmente.
+
+Pré-detector lexical (--pre-detector): anáfora, aliteração, assonância e
+pergunta retórica são detectadas localmente (src/detector_lexical.py, regex e
+numpy num pool de processos), essas labels saem do enum do schema enviado ao
+modelo e os spans locais entram na consolidação. No manifesto, esses discursos
+ficam sob o hash do schema restrito (schema_hash_do_run), separados dos
+enviados com o schema completo. Com --pular-sem-achados, os discursos sem
+nenhum achado local não são enviados.
+
+Modo tempo real (--realtime): para lotes pequenos e urgentes, chama o
+/v1/responses diretamente com várias requisições em paralelo, sob limites de
+RPM/TPM (src/analise_async.py), e converte o resultado com o mesmo parser.
+
 Requisitos:
-  pip install openai pandas pyarrow
+  pip install openai pyarrow
 """
 
 from __future__ import annotations
 
 import os
+import asyncio
+import random
 import json
 import time
 import argparse
+import uuid
 import sqlite3
 from pathlib import Path
-from typing import Iterable, Dict, Any, List
+from typing import Iterable, Dict, Any, List, Set
 
+import openai
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
 
 # Usa tua infra
-from src.login_openai import login     # deve retornar um client compatível com OpenAI Python SDK
+from src.login_openai import login, login_async     # deve retornar um client compatível com OpenAI Python SDK
 from src.structured_outputs import schema  # teu schema JSON para Structured Outputs
+from src.requisicao import LABELS, build_request_body, schema_com_labels
+from src import manifesto as mf
+from src import cache_respostas as cr
+from src import analise_async
+from src import janelas as jn
+from src import alinhamento as al
+from src import busca
+from src import cubo
+from src import duplicatas as dup
+from src import detector_lexical as dl
 
 # Caminhos
 SRC_DB = Path("Amostra_1.sqlite")
@@ -40,25 +118,55 @@ SRC_TABLE = "DiscursosAmostra"
 OUT_DIR = Path("data/batch_figuras")
 OUT_DIR.mkdir(parents=True, exist_ok=True)
 
+# Limites por batch (/v1/batches): 50.000 requisições e 200 MB por arquivo.
+# O limite de tokens enfileirados depende do tier da conta; ajuste via CLI.
+SHARD_MAX_REQUESTS = 50_000
+SHARD_MAX_BYTES = 190 * 1024 * 1024  # margem abaixo dos 200 MB
+SHARD_MAX_TOKENS = 5_000_000
+CHARS_POR_TOKEN = 4  # aproximação grosseira para português
+
+SCHEMA_HASH = mf.schema_hash(schema)
+
 
-def iter_discursos(limit: int | None = None, seed: int | None = None, min_chars: int = 1) -> Iterable[Dict[str, Any]]:
+COLUNAS_DISCURSO = "CodigoPronunciamento, NomeParlamentar, SiglaPartidoParlamentarNaData, DataPronunciamento, TextoIntegral"
+LOTE_CODIGOS = 500
+
+
+def iter_discursos(
+    limit: int | None = None,
+    seed: int | None = None,
+    min_chars: int = 1,
+    codigos: List[int] | None = None,
+) -> Iterable[Dict[str, Any]]:
     """
     Itera pelos discursos da tabela DiscursosAmostra.
     Embaralha com ORDER BY random() quando seed é fornecida (SQLite).
+    Com `codigos` (ex.: a fila de selecionar_fila), lê só esses discursos, em
+    lotes e na ordem dada; limit e seed são ignorados.
     """
     if not SRC_DB.exists():
         raise FileNotFoundError(f"Não encontrei {SRC_DB.resolve()}")
 
     conn = sqlite3.connect(str(SRC_DB))
     try:
+        if codigos is not None:
+            for i in range(0, len(codigos), LOTE_CODIGOS):
+                parte = codigos[i : i + LOTE_CODIGOS]
+                cur = conn.execute(
+                    f"SELECT {COLUNAS_DISCURSO} FROM {SRC_TABLE} WHERE CodigoPronunciamento IN ({','.join('?' * len(parte))})",
+                    parte,
+                )
+                cols = [c[0] for c in cur.description]
+                por_codigo = {row[0]: dict(zip(cols, row)) for row in cur}
+                for codigo in parte:
+                    rec = por_codigo.get(codigo)
+                    if rec is not None and len(rec.get("TextoIntegral") or "") >= min_chars:
+                        yield rec
+            return
+
         order_clause = " ORDER BY random() " if seed is not None else ""
         sql = f"""
-        SELECT
-            CodigoPronunciamento,
-            NomeParlamentar,
-            SiglaPartidoParlamentarNaData,
-            DataPronunciamento,
-            TextoIntegral
+        SELECT {COLUNAS_DISCURSO}
         FROM {SRC_TABLE}
         {order_clause}
         """
@@ -76,72 +184,386 @@ def iter_discursos(limit: int | None = None, seed: int | None = None, min_chars:
         conn.close()
 
 
-def build_request_body(model: str, discurso: str) -> Dict[str, Any]:
+def selecionar_fila(
+    limit: int | None,
+    seed: int | None,
+    pular: Set[int] | None = None,
+    min_chars: int = 1,
+) -> List[int]:
     """
-    Monta o 'body' da requisição para /v1/responses exatamente como na tua função analisar_figuras().
+    Códigos que um run vai enfileirar, na ordem da fila: a mesma seleção de
+    iter_discursos (limit/seed), só com os ids, menos os de `pular`. Fixar a
+    fila antes de gerar as requisições deixa a deduplicação e o pré-detector
+    trabalharem sobre exatamente os discursos do run (o ORDER BY random() não
+    se repete entre duas leituras).
     """
-    return {
-        "model": model,
-        "input": [
-            {
-                "role": "developer",
-                "content": [
-                    {
-                        "type": "input_text",
-                        "text": "Você é um linguista que analisa figuras de linguagem em discursos no Senado."
-                    }
-                ]
-            },
-            {
-                "role": "user",
-                "content": [
-                    {
-                        "type": "input_text",
-                        "text": f"Analise a seguinte fala:\n\n{discurso}"
-                    }
-                ]
-            }
-        ],
-        "text": {
-            "format": schema,
-            "verbosity": "medium"
-        },
-        "reasoning": {
-            "effort": "medium"
-        },
-        "tools": [],
-        "store": True
-    }
+    if not SRC_DB.exists():
+        raise FileNotFoundError(f"Não encontrei {SRC_DB.resolve()}")
+    conn = sqlite3.connect(str(SRC_DB))
+    try:
+        sql = f"SELECT CodigoPronunciamento FROM {SRC_TABLE} WHERE coalesce(length(TextoIntegral), 0) >= ?"
+        if seed is not None:
+            sql += " ORDER BY random()"
+        if limit is not None:
+            sql += f" LIMIT {int(limit)}"
+        return [c for (c,) in conn.execute(sql, (min_chars,)) if not (pular and c in pular)]
+    finally:
+        conn.close()
 
 
-def create_jsonl(jsonl_path: Path, model: str, limit: int | None, seed: int | None, max_chars: int | None) -> int:
+def iter_request_lines(
+    model: str,
+    limit: int | None,
+    seed: int | None,
+    max_chars: int | None,
+    pular: Set[int] | None = None,
+    cache: sqlite3.Connection | None = None,
+    janela_chars: int | None = None,
+    sobreposicao_chars: int = jn.SOBREPOSICAO_CHARS,
+    labels: List[str] | None = None,
+    codigos: List[int] | None = None,
+) -> Iterable[Dict[str, Any]]:
     """
-    Cria o arquivo JSONL com uma linha por discurso no formato de batch.
+    Gera as linhas do batch (uma por discurso), já serializadas.
     custom_id = disc-{CodigoPronunciamento}
     url = "/v1/responses"
+    Discursos em `pular` (ex.: já concluídos no manifesto) são ignorados.
+    Com `janela_chars`, discursos maiores viram uma linha por janela
+    (custom_id = disc-{codigo}-j{indice}-o{offset}-n{total}).
+    Com `labels`, o enum de labels do schema enviado fica restrito a elas.
+    Com `codigos` (selecionar_fila), só esses discursos, na ordem dada.
+
+    Cada item: {"custom_id", "line" (str terminada em quebra de linha), "n_bytes", "est_tokens", "texto"}.
+    Se a resposta estiver no `cache`, o item traz apenas {"custom_id", "cached_line"},
+    com uma linha sintética no formato do output do batch.
     """
-    n = 0
-    with jsonl_path.open("w", encoding="utf-8") as f:
-        for rec in iter_discursos(limit=limit, seed=seed, min_chars=1):
-            codigo = rec["CodigoPronunciamento"]
-            texto = rec.get("TextoIntegral") or ""
+    for rec in iter_discursos(limit=limit, seed=seed, min_chars=1, codigos=codigos):
+        codigo = rec["CodigoPronunciamento"]
+        if pular and codigo in pular:
+            continue
+        texto = rec.get("TextoIntegral") or ""
+
+        if max_chars is not None and len(texto) > max_chars:
+            texto = texto[:max_chars]
 
-            if max_chars is not None and len(texto) > max_chars:
-                texto = texto[:max_chars]
+        if janela_chars:
+            partes = jn.dividir_em_janelas(texto, janela_chars, sobreposicao_chars)
+        else:
+            partes = [(0, texto)]
 
-            body = build_request_body(model=model, discurso=texto)
+        for indice, (offset, trecho) in enumerate(partes):
+            custom_id = jn.custom_id_janela(codigo, indice, offset, len(partes))
+            body = build_request_body(model=model, discurso=trecho, labels=labels)
+
+            if cache is not None:
+                resposta = cr.obter(cache, cr.chave_requisicao(body))
+                if resposta is not None:
+                    yield {"custom_id": custom_id, "cached_line": cached_output_line(custom_id, resposta)}
+                    continue
 
             line = {
-                "custom_id": f"disc-{codigo}",
+                "custom_id": custom_id,
                 "method": "POST",
                 "url": "/v1/responses",
                 "body": body,
             }
-            f.write(json.dumps(line, ensure_ascii=False) + "\n")
+            raw = json.dumps(line, ensure_ascii=False) + "\n"
+            yield {
+                "custom_id": custom_id,
+                "line": raw,
+                "n_bytes": len(raw.encode("utf-8")),
+                "est_tokens": estimate_tokens(raw),
+                "texto": trecho,
+            }
+
+
+def cached_output_line(custom_id: str, resposta: str) -> str:
+    """Linha no formato do output do /v1/batches para uma resposta vinda do cache."""
+    obj = {
+        "custom_id": custom_id,
+        "response": {
+            "status_code": 200,
+            "body": {
+                "status": "completed",
+                "output": [{"type": "message", "content": [{"type": "output_text", "text": resposta}]}],
+            },
+        },
+        "error": None,
+        "cached": True,
+    }
+    return json.dumps(obj, ensure_ascii=False) + "\n"
+
+
+def cached_output_path(jsonl_path: Path) -> Path:
+    return jsonl_path.with_name(f"{jsonl_path.stem}_cache_output.jsonl")
+
+
+def estimate_tokens(raw_line: str) -> int:
+    """Estimativa barata de tokens enfileirados de uma linha (chars / CHARS_POR_TOKEN)."""
+    return len(raw_line) // CHARS_POR_TOKEN + 1
+
+
+def create_jsonl(
+    jsonl_path: Path,
+    model: str,
+    limit: int | None,
+    seed: int | None,
+    max_chars: int | None,
+    pular: Set[int] | None = None,
+    cache: sqlite3.Connection | None = None,
+    janela_chars: int | None = None,
+    sobreposicao_chars: int = jn.SOBREPOSICAO_CHARS,
+    labels: List[str] | None = None,
+    codigos: List[int] | None = None,
+) -> int:
+    """
+    Cria o arquivo JSONL com uma linha por discurso no formato de batch.
+    custom_id = disc-{CodigoPronunciamento}
+    url = "/v1/responses"
+    Acertos de cache vão para cached_output_path(jsonl_path) e não contam em n.
+    """
+    n = n_cache = 0
+    with jsonl_path.open("w", encoding="utf-8") as f, cached_output_path(jsonl_path).open("w", encoding="utf-8") as fc:
+        for item in iter_request_lines(
+            model=model, limit=limit, seed=seed, max_chars=max_chars, pular=pular, cache=cache,
+            janela_chars=janela_chars, sobreposicao_chars=sobreposicao_chars, labels=labels,
+            codigos=codigos,
+        ):
+            if "cached_line" in item:
+                fc.write(item["cached_line"])
+                n_cache += 1
+                continue
+            f.write(item["line"])
             n += 1
+    if n_cache:
+        print(f"[OK] {n_cache} respostas reaproveitadas do cache")
     return n
 
 
+def create_shards(
+    run_dir: Path,
+    model: str,
+    limit: int | None,
+    seed: int | None,
+    max_chars: int | None,
+    max_requests: int = SHARD_MAX_REQUESTS,
+    max_bytes: int = SHARD_MAX_BYTES,
+    max_tokens: int = SHARD_MAX_TOKENS,
+    pular: Set[int] | None = None,
+    cache: sqlite3.Connection | None = None,
+    janela_chars: int | None = None,
+    sobreposicao_chars: int = jn.SOBREPOSICAO_CHARS,
+    labels: List[str] | None = None,
+    codigos: List[int] | None = None,
+) -> List[Dict[str, Any]]:
+    """
+    Divide o fluxo de requisições em vários JSONL (shards), abrindo um novo
+    shard sempre que o próximo discurso estouraria algum dos limites
+    (nº de requisições, bytes do arquivo ou tokens estimados). As janelas de
+    um discurso ficam sempre no mesmo shard.
+
+    Retorna a lista de shards: {"path", "n_requests", "n_bytes", "est_tokens"}.
+    Acertos de cache vão para run_dir/requests_{model}_cache_output.jsonl.
+    """
+    run_dir.mkdir(parents=True, exist_ok=True)
+    shards: List[Dict[str, Any]] = []
+    f = None
+    atual: Dict[str, Any] = {}
+
+    def _abrir_shard():
+        nonlocal f, atual
+        if f is not None:
+            f.close()
+        path = run_dir / f"requests_{model}_{len(shards):04d}.jsonl"
+        atual = {"path": str(path), "n_requests": 0, "n_bytes": 0, "est_tokens": 0}
+        shards.append(atual)
+        f = path.open("w", encoding="utf-8")
+
+    def _gravar_discurso(itens: List[Dict[str, Any]]):
+        n_bytes = sum(item["n_bytes"] for item in itens)
+        est_tokens = sum(item["est_tokens"] for item in itens)
+        if len(itens) > max_requests or n_bytes > max_bytes or est_tokens > max_tokens:
+            print(f"[AVISO] {itens[0]['custom_id']} excede sozinho os limites do shard; ignorado.")
+            return
+        if (
+            f is None
+            or atual["n_requests"] + len(itens) > max_requests
+            or atual["n_bytes"] + n_bytes > max_bytes
+            or atual["est_tokens"] + est_tokens > max_tokens
+        ):
+            _abrir_shard()
+        for item in itens:
+            f.write(item["line"])
+        atual["n_requests"] += len(itens)
+        atual["n_bytes"] += n_bytes
+        atual["est_tokens"] += est_tokens
+
+    fc = cached_output_path(run_dir / f"requests_{model}.jsonl").open("w", encoding="utf-8")
+    try:
+        # as janelas de um discurso chegam em sequência: agrupa pelo código
+        itens: List[Dict[str, Any]] = []
+        for item in iter_request_lines(
+            model=model, limit=limit, seed=seed, max_chars=max_chars, pular=pular, cache=cache,
+            janela_chars=janela_chars, sobreposicao_chars=sobreposicao_chars, labels=labels,
+            codigos=codigos,
+        ):
+            if "cached_line" in item:
+                fc.write(item["cached_line"])
+                continue
+            if itens and mf.codigo_de_custom_id(item["custom_id"]) != mf.codigo_de_custom_id(itens[0]["custom_id"]):
+                _gravar_discurso(itens)
+                itens = []
+            itens.append(item)
+        if itens:
+            _gravar_discurso(itens)
+    finally:
+        fc.close()
+        if f is not None:
+            f.close()
+
+    return shards
+
+
+def create_shards_empacotados(
+    run_dir: Path,
+    model: str,
+    limit: int | None,
+    seed: int | None,
+    max_chars: int | None,
+    max_requests: int = SHARD_MAX_REQUESTS,
+    max_bytes: int = SHARD_MAX_BYTES,
+    max_tokens: int = SHARD_MAX_TOKENS,
+    pular: Set[int] | None = None,
+    cache: sqlite3.Connection | None = None,
+    janela_chars: int | None = None,
+    sobreposicao_chars: int = jn.SOBREPOSICAO_CHARS,
+    tokens_saida: int = analise_async.TOKENS_SAIDA_ESTIMADOS,
+    calibracao: Dict[str, Any] | None = None,
+    labels: List[str] | None = None,
+    codigos: List[int] | None = None,
+) -> List[Dict[str, Any]]:
+    """
+    Como create_shards, mas com tokens contados pelo tiktoken e os discursos
+    (com todas as suas janelas) distribuídos entre os shards por orçamento de
+    tokens (src/empacotamento.py), com totais equilibrados e abaixo dos limites.
+
+    1ª passada: grava todas as linhas num arquivo de trabalho, guardando só
+    offset, bytes e tokens de cada uma; 2ª passada: copia as linhas de cada
+    shard. Os shards trazem também est_tokens_saida e custo_previsto_usd.
+    Com `calibracao` (src/calibracao.py), a saída de cada requisição é a
+    prevista para o tamanho da sua entrada (em vez de `tokens_saida`) e cada
+    shard ganha tempo_previsto_s.
+    """
+    # tiktoken só é necessário no empacotamento
+    from src import empacotamento as emp
+    from src.orcamento import TOKEN_CHUNK
+
+    run_dir.mkdir(parents=True, exist_ok=True)
+    todas = run_dir / f"requests_{model}_todas.jsonl"
+    fixos = emp.tokens_fixos(model, labels=labels)
+    custom_ids: List[str] = []
+    offsets: List[int] = []
+    n_bytes: List[int] = []
+    tok_entrada: List[int] = []
+    textos: List[str] = []
+    pos = 0
+
+    with todas.open("wb") as f, cached_output_path(run_dir / f"requests_{model}.jsonl").open("w", encoding="utf-8") as fc:
+        for item in iter_request_lines(
+            model=model, limit=limit, seed=seed, max_chars=max_chars, pular=pular, cache=cache,
+            janela_chars=janela_chars, sobreposicao_chars=sobreposicao_chars, labels=labels,
+            codigos=codigos,
+        ):
+            if "cached_line" in item:
+                fc.write(item["cached_line"])
+                continue
+            raw = item["line"].encode("utf-8")
+            f.write(raw)
+            custom_ids.append(item["custom_id"])
+            offsets.append(pos)
+            n_bytes.append(len(raw))
+            pos += len(raw)
+            textos.append(item["texto"])
+            if len(textos) >= TOKEN_CHUNK:
+                tok_entrada.extend(emp.tokens_entrada(textos, model, fixos))
+                textos = []
+        tok_entrada.extend(emp.tokens_entrada(textos, model, fixos))
+
+    # as janelas de um discurso (consecutivas) formam um item indivisível
+    grupos: List[List[int]] = []
+    for i, cid in enumerate(custom_ids):
+        if grupos and mf.codigo_de_custom_id(cid) == mf.codigo_de_custom_id(custom_ids[grupos[-1][0]]):
+            grupos[-1].append(i)
+        else:
+            grupos.append([i])
+    validos = []
+    for g in grupos:
+        if len(g) > max_requests or sum(n_bytes[i] for i in g) > max_bytes or sum(tok_entrada[i] for i in g) > max_tokens:
+            print(f"[AVISO] {custom_ids[g[0]]} excede sozinho os limites do shard; ignorado.")
+        else:
+            validos.append(g)
+    if calibracao is not None:
+        from src import calibracao as cb
+
+        tok_saida = cb.prever_saida(calibracao, tok_entrada).tolist()
+    else:
+        tok_saida = [tokens_saida] * len(custom_ids)
+    lotes = emp.empacotar(
+        [sum(tok_entrada[i] for i in g) for g in validos],
+        [sum(tok_saida[i] for i in g) for g in validos],
+        [sum(n_bytes[i] for i in g) for g in validos],
+        max_tokens=max_tokens,
+        max_requests=max_requests,
+        max_bytes=max_bytes,
+        n_requests=[len(g) for g in validos],
+    )
+
+    shards: List[Dict[str, Any]] = []
+    with todas.open("rb") as f:
+        for j, lote in enumerate(lotes):
+            path = run_dir / f"requests_{model}_{j:04d}.jsonl"
+            idx = [i for p in lote for i in validos[p]]
+            with path.open("wb") as out:
+                for i in idx:
+                    f.seek(offsets[i])
+                    out.write(f.read(n_bytes[i]))
+            entrada = sum(tok_entrada[i] for i in idx)
+            saida = sum(tok_saida[i] for i in idx)
+            shards.append({
+                "path": str(path),
+                "n_requests": len(idx),
+                "n_bytes": sum(n_bytes[i] for i in idx),
+                "est_tokens": entrada,
+                "est_tokens_saida": saida,
+                "custo_previsto_usd": emp.custo_previsto(entrada, saida, model),
+            })
+            if calibracao is not None:
+                shards[-1]["tempo_previsto_s"] = cb.prever_duracao(calibracao, saida)
+    todas.unlink()
+    emp.relatorio(shards)
+    return shards
+
+
+def new_run_id(model: str) -> str:
+    return f"{time.strftime('%Y%m%d-%H%M%S')}_{uuid.uuid4().hex[:6]}_{model}"
+
+
+def save_run(run_dir: Path, run: Dict[str, Any]) -> Path:
+    """Grava (ou atualiza) o registro do run em run_dir/run.json."""
+    path = run_dir / "run.json"
+    tmp = path.with_suffix(".json.tmp")
+    tmp.write_text(json.dumps(run, ensure_ascii=False, indent=2), encoding="utf-8")
+    tmp.replace(path)
+    return path
+
+
+def load_run(run_id: str) -> Dict[str, Any]:
+    path = OUT_DIR / f"run_{run_id}" / "run.json"
+    if not path.exists():
+        raise FileNotFoundError(f"Não encontrei {path.resolve()}")
+    return json.loads(path.read_text(encoding="utf-8"))
+
+
 def create_and_run_batch(client, jsonl_path: Path, completion_window: str = "24h"):
     """
     Sobe o arquivo (purpose=batch) e cria o batch para /v1/responses.
@@ -157,79 +579,758 @@ def create_and_run_batch(client, jsonl_path: Path, completion_window: str = "24h
     return batch
 
 
-def wait_and_download(client, batch_id: str, out_dir: Path) -> Path | None:
+def submit_shards(
+    client,
+    run: Dict[str, Any],
+    run_dir: Path,
+    completion_window: str = "24h",
+    manifesto: sqlite3.Connection | None = None,
+    shash: str = SCHEMA_HASH,
+) -> Dict[str, Any]:
     """
-    Espera o batch finalizar e baixa o output.jsonl (se existir).
+    Cria um batch por shard ainda não submetido. Os batches rodam em paralelo
+    do lado da OpenAI; o run.json é regravado a cada submissão para que uma
+    falha no meio não perca os ids já criados.
+    """
+    for shard in run["shards"]:
+        if shard.get("batch_id"):
+            continue
+        batch = create_and_run_batch(client, Path(shard["path"]), completion_window=completion_window)
+        shard["batch_id"] = batch.id
+        save_run(run_dir, run)
+        if manifesto is not None:
+            mf.marcar_enviados(manifesto, Path(shard["path"]), run["model"], shash, batch.id)
+    return run
+
+
+BATCH_TERMINAL = ("completed", "failed", "expired", "cancelled")
+MAX_ERROS_CONSULTA = 10  # falhas transitórias seguidas antes de desistir de um batch
+DOWNLOAD_CHUNK = 1 << 20  # 1 MiB
+
+
+def download_file(client, file_id: str, dest: Path, chunk_size: int = DOWNLOAD_CHUNK) -> Path:
+    """
+    Baixa um arquivo da OpenAI direto para o disco, em blocos, sem carregar o
+    conteúdo inteiro na memória. Escreve num .part e renomeia ao final.
+    """
+    tmp = dest.with_name(dest.name + ".part")
+    with client.files.with_streaming_response.content(file_id) as resp, tmp.open("wb") as f:
+        for chunk in resp.iter_bytes(chunk_size):
+            f.write(chunk)
+    tmp.replace(dest)
+    return dest
+
+
+def save_batch_meta(b, out_dir: Path) -> Path:
+    """Grava o objeto do batch (status, timestamps, contagens) para a calibração (src/calibracao.py)."""
+    path = out_dir / f"{b.id}_batch.json"
+    dados = b.model_dump() if hasattr(b, "model_dump") else dict(vars(b))
+    path.write_text(json.dumps(dados, ensure_ascii=False, default=str), encoding="utf-8")
+    return path
+
+
+def download_results(client, b, out_dir: Path) -> tuple[Path | None, Path | None]:
+    """Baixa o output e o arquivo de erros (se houver) de um batch finalizado."""
+    out_path = err_path = None
+    save_batch_meta(b, out_dir)
+    if getattr(b, "output_file_id", None):
+        out_path = download_file(client, b.output_file_id, out_dir / f"{b.id}_output.jsonl")
+        print(f"[OK] Output salvo em: {out_path}")
+    if getattr(b, "error_file_id", None):
+        err_path = download_file(client, b.error_file_id, out_dir / f"{b.id}_errors.jsonl")
+        print(f"[AVISO] Erros salvos em: {err_path}")
+    return out_path, err_path
+
+
+def wait_and_download(
+    client,
+    batch_id: str,
+    out_dir: Path,
+    manifesto: sqlite3.Connection | None = None,
+    model: str | None = None,
+    shash: str = SCHEMA_HASH,
+) -> Path | None:
+    """
+    Espera o batch finalizar e baixa o output.jsonl (se existir) e o arquivo
+    de erros. Com `manifesto`, registra o status de cada discurso do batch.
     """
     print(f"[INFO] Aguardando batch {batch_id} terminar...")
     while True:
         b = client.batches.retrieve(batch_id)
         print(f"  - status: {b.status}")
-        if b.status in ("completed", "failed", "expired", "cancelled", "cancelling", "finalizing"):
+        if b.status in BATCH_TERMINAL:
             break
         time.sleep(5)
 
-    if getattr(b, "output_file_id", None):
-        file_out = client.files.retrieve(b.output_file_id)
-        content = client.files.content(file_out.id).read()
-        out_path = out_dir / f"{batch_id}_output.jsonl"
-        out_path.write_bytes(content)
-        print(f"[OK] Output salvo em: {out_path}")
+    out_path, err_path = download_results(client, b, out_dir)
+
+    if manifesto is not None:
+        stats = mf.atualizar_com_resultados(
+            manifesto, batch_id, model or getattr(b, "model", ""), shash, out_path, err_path
+        )
+        print(f"[OK] Manifesto atualizado: {stats}")
+
+    if out_path is None:
+        print("[AVISO] Sem arquivo de saída para baixar.")
+    return out_path
+
+
+async def _watch_batch(
+    client,
+    batch_id: str,
+    out_dir: Path,
+    model: str,
+    manifesto_path: Path | None,
+    poll_min: float,
+    poll_max: float,
+    requests_path: Path | None = None,
+    cache_path: Path | None = None,
+    shash: str = SCHEMA_HASH,
+) -> Dict[str, Any]:
+    """
+    Acompanha um batch com backoff exponencial + jitter e, assim que ele
+    termina, baixa os arquivos, atualiza o manifesto e converte para Parquet
+    (tudo em thread, para não travar o acompanhamento dos demais).
+    Falhas transitórias da API na consulta são repetidas com o mesmo backoff;
+    um erro definitivo (ou na finalização) vira um resultado com status
+    "erro" e não interrompe o acompanhamento dos outros batches.
+    """
+    delay = poll_min
+    last_status = None
+    erros = 0
+    while True:
+        try:
+            b = await asyncio.to_thread(client.batches.retrieve, batch_id)
+        except Exception as e:
+            erros += 1
+            if not _erro_transitorio(e) or erros >= MAX_ERROS_CONSULTA:
+                print(f"[AVISO] {batch_id}: acompanhamento interrompido ({e})")
+                return _resultado_erro(batch_id, e)
+            print(f"[AVISO] {batch_id}: falha ao consultar ({e}); nova tentativa")
+            await asyncio.sleep(delay * random.uniform(0.5, 1.0))
+            delay = min(poll_max, delay * 2)
+            continue
+        erros = 0
+        if b.status != last_status:
+            print(f"  - {batch_id}: {b.status}")
+            last_status = b.status
+            delay = poll_min
+        if b.status in BATCH_TERMINAL:
+            break
+        await asyncio.sleep(delay * random.uniform(0.5, 1.0))
+        delay = min(poll_max, delay * 2)
+
+    try:
+        return await asyncio.to_thread(
+            finalizar_batch, client, b, out_dir, model, manifesto_path, requests_path, cache_path, shash
+        )
+    except Exception as e:
+        print(f"[AVISO] {batch_id}: falha ao baixar/converter o resultado ({e})")
+        return _resultado_erro(batch_id, e)
+
+
+def _erro_transitorio(exc: Exception) -> bool:
+    """Falhas de rede/timeout e status repetíveis (429, 5xx...) da API."""
+    if isinstance(exc, (openai.APIConnectionError, openai.APITimeoutError)):
+        return True
+    return isinstance(exc, openai.APIStatusError) and exc.status_code in analise_async.RETRY_STATUS
+
+
+def _resultado_erro(batch_id: str, exc: Exception) -> Dict[str, Any]:
+    """Resultado de um batch cujo acompanhamento falhou; o run pode ser retomado com --run-id."""
+    return {"batch_id": batch_id, "status": "erro", "output_path": None, "parquet_path": None, "erro": str(exc)}
+
+
+def finalizar_batch(
+    client,
+    b,
+    out_dir: Path,
+    model: str,
+    manifesto_path: Path | None = None,
+    requests_path: Path | None = None,
+    cache_path: Path | None = None,
+    shash: str = SCHEMA_HASH,
+) -> Dict[str, Any]:
+    """
+    Baixa os arquivos de um batch finalizado, atualiza o manifesto, alimenta o
+    cache (se houver o JSONL enviado) e converte o output para Parquet.
+    """
+    out_path, err_path = download_results(client, b, out_dir)
+    if manifesto_path is not None:
+        conn = mf.abrir_manifesto(manifesto_path)
+        try:
+            stats = mf.atualizar_com_resultados(conn, b.id, model, shash, out_path, err_path)
+            print(f"[OK] Manifesto atualizado ({b.id}): {stats}")
+        finally:
+            conn.close()
+    if cache_path is not None and requests_path is not None and out_path is not None:
+        conn = cr.abrir_cache(cache_path)
+        try:
+            cache_batch_results(conn, requests_path, out_path)
+        finally:
+            conn.close()
+    parquet_path = None
+    if out_path is not None:
+        parquet_path = out_dir / f"{b.id}_spans.parquet"
+        parse_output_to_parquet(out_path, parquet_path)
+    return {
+        "batch_id": b.id, "status": b.status, "output_path": out_path, "error_path": err_path, "parquet_path": parquet_path,
+    }
+
+
+def reconciliar_manifesto(
+    client,
+    manifesto: sqlite3.Connection,
+    model: str,
+    out_dir: Path = OUT_DIR,
+    shash: str = SCHEMA_HASH,
+) -> List[Dict[str, Any]]:
+    """
+    Consulta os batches que ainda têm discursos "enviado" no manifesto (queda
+    depois da submissão, batch expirado sem acompanhamento). Os finalizados
+    são baixados e convertidos para Parquet em `out_dir`, e o manifesto passa
+    a "concluido"/"falhou"; os que ainda rodam ficam como estão.
+    """
+    resultados = []
+    for batch_id in mf.batches_em_aberto(manifesto, model, shash):
+        try:
+            b = client.batches.retrieve(batch_id)
+        except Exception as e:
+            print(f"[AVISO] Não consegui consultar o batch {batch_id}: {e}")
+            continue
+        if b.status not in BATCH_TERMINAL:
+            print(f"[INFO] Batch {batch_id} ainda em andamento ({b.status}); discursos continuam em voo")
+            continue
+        print(f"[INFO] Batch {batch_id} finalizado ({b.status}) sem registro; atualizando o manifesto")
+        res = finalizar_batch(client, b, out_dir, model)
+        stats = mf.atualizar_com_resultados(manifesto, batch_id, model, shash, res["output_path"], res["error_path"])
+        print(f"[OK] Manifesto atualizado ({batch_id}): {stats}")
+        resultados.append(res)
+    return resultados
+
+
+async def monitor_batches(
+    client,
+    batch_ids: List[str],
+    out_dir: Path,
+    model: str,
+    manifesto_path: Path | None = None,
+    on_done=None,
+    poll_min: float = 5.0,
+    poll_max: float = 300.0,
+    requests_paths: Dict[str, Path] | None = None,
+    cache_path: Path | None = None,
+    shash: str = SCHEMA_HASH,
+) -> List[Dict[str, Any]]:
+    """
+    Acompanha vários batches ao mesmo tempo. Cada batch é baixado e
+    convertido assim que termina, sem esperar os outros; `on_done(resultado)`
+    é chamado (no loop principal) a cada batch concluído.
+    Com `requests_paths` ({batch_id: JSONL enviado}) e `cache_path`, as
+    respostas alimentam o cache local.
+    """
+    print(f"[INFO] Acompanhando {len(batch_ids)} batches...")
+    requests_paths = requests_paths or {}
+    tasks = [
+        asyncio.create_task(_watch_batch(
+            client, bid, out_dir, model, manifesto_path, poll_min, poll_max,
+            requests_path=requests_paths.get(bid), cache_path=cache_path, shash=shash,
+        ))
+        for bid in batch_ids
+    ]
+    resultados = []
+    for fut in asyncio.as_completed(tasks):
+        res = await fut
+        resultados.append(res)
+        if on_done is not None:
+            on_done(res)
+    return resultados
+
+
+SPANS_SCHEMA = pa.schema([
+    ("custom_id", pa.string()),
+    ("CodigoPronunciamento", pa.int64()),
+    ("label", pa.dictionary(pa.int32(), pa.string())),
+    ("start_char", pa.int32()),
+    ("end_char", pa.int32()),
+    ("text", pa.string()),
+    ("rationale", pa.string()),
+    ("cues", pa.list_(pa.string())),
+    ("confidence", pa.float32()),
+    ("chunk_offset", pa.int32()),
+    ("parse_error", pa.string()),
+    ("raw_response", pa.string()),
+])
+
+ROW_GROUP_SIZE = 50_000
+
+
+def extract_output_text(obj: Dict[str, Any]) -> str:
+    """
+    Extrai o JSON estruturado (como texto) de uma linha do output do batch.
+    Aceita o formato do /v1/batches (response.body.output[*] com uma mensagem
+    output_text contendo o JSON estruturado) e o formato antigo com output_json.
+    Levanta exceção se a linha não contiver um payload reconhecível.
+    """
+    resp = obj.get("response") or {}
+    body = resp.get("body", resp) or {}
+    for item in body.get("output") or []:
+        for content in item.get("content") or []:
+            ctype = content.get("type")
+            if ctype == "output_json":
+                return json.dumps(content["json"], ensure_ascii=False)
+            if ctype == "output_text":
+                return content.get("text", "")
+    raise ValueError(f"sem conteúdo estruturado (erro: {obj.get('error') or body.get('error')})")
+
+
+def extract_spans(obj: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Extrai a lista de spans de uma linha do output do batch."""
+    return json.loads(extract_output_text(obj))["spans"]
+
+
+def consolidate_spans(
+    parquet_paths: List[Path],
+    out_path: Path,
+    alinhar: bool = True,
+    duplicatas: Dict[int, int] | None = None,
+) -> Path:
+    """
+    Junta os Parquets de spans de um run num só, alinha os offsets ao
+    TextoIntegral (src/alinhamento.py) e remove os spans repetidos nas
+    sobreposições de janelas (src/janelas.deduplicar_spans).
+    Com `duplicatas` ({membro: representante}, src/duplicatas.py), os spans
+    de cada representante são copiados para os membros do grupo antes do
+    alinhamento. As cópias são sempre alinhadas ao texto do membro (mesmo com
+    alinhar=False, que só vale para os spans próprios) e as que não se
+    localizam nele (align_score < al.SCORE_MINIMO) são descartadas.
+    """
+    tabelas = [pq.read_table(str(p)) for p in parquet_paths if Path(p).exists()]
+    if not tabelas:
         return out_path
+    df = pa.concat_tables(tabelas, promote_options="permissive").to_pandas()
+    if duplicatas:
+        df = dup.expandir_spans(df, duplicatas)
+    antes = len(df)
+    copias = df["representante"].notna() if "representante" in df else pd.Series(False, index=df.index)
+    if SRC_DB.exists() and (alinhar or copias.any()):
+        alvo = df if alinhar else df.loc[copias]
+        codigos = sorted(int(c) for c in alvo["CodigoPronunciamento"].dropna().unique())
+        alinhado = al.alinhar_spans(alvo, al.iter_textos(SRC_DB, SRC_TABLE, codigos))
+        df = alinhado if alinhar else pd.concat([df.loc[~copias], alinhado], ignore_index=True)
+    elif copias.any():
+        print("[AVISO] Sem o SQLite dos discursos não há como realinhar as cópias de spans; descartadas")
+        df = df.loc[~copias]
+    if "representante" in df and "align_score" in df:
+        df = df.loc[df["representante"].isna() | (df["align_score"] >= al.SCORE_MINIMO)]
+    df = jn.deduplicar_spans(df)
+    df.to_parquet(out_path, index=False)
+    print(f"[OK] Spans consolidados em: {out_path} | linhas: {len(df)} ({antes - len(df)} duplicados removidos)")
+    textos = None
+    if SRC_DB.exists():
+        codigos = sorted(int(c) for c in df["CodigoPronunciamento"].dropna().unique())
+        textos = al.iter_textos(SRC_DB, SRC_TABLE, codigos)
+    busca.construir_indice(out_path, textos)
+    if SRC_DB.exists():
+        meta = cubo.metadados_sqlite(SRC_DB, SRC_TABLE, codigos)
+        cubo.gravar_cubo(cubo.construir_cubo(df.merge(meta, on="CodigoPronunciamento", how="left")), out_path)
+    return out_path
+
+
+def cache_batch_results(cache: sqlite3.Connection, requests_path: Path, output_path: Path) -> int:
+    """
+    Alimenta o cache com as respostas bem-sucedidas de um batch. A chave é
+    recalculada a partir do body de cada requisição do JSONL enviado.
+    """
+    chaves: Dict[str, tuple] = {}
+    with Path(requests_path).open("r", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                req = json.loads(line)
+                chaves[req["custom_id"]] = (cr.chave_requisicao(req["body"]), req["body"].get("model"))
+
+    n = 0
+    with Path(output_path).open("r", encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            obj = json.loads(line)
+            resp = obj.get("response") or {}
+            if obj.get("error") or resp.get("status_code") != 200 or obj["custom_id"] not in chaves:
+                continue
+            if (resp.get("body") or {}).get("status", "completed") != "completed":
+                continue
+            try:
+                texto = extract_output_text(obj)
+            except Exception:
+                continue
+            chave, model = chaves[obj["custom_id"]]
+            cr.gravar(cache, chave, texto, model=model, commit=False)
+            n += 1
+    cache.commit()
+    cr.despejar(cache)
+    return n
+
+
+def ingest_cached(
+    cached_path: Path,
+    manifesto: sqlite3.Connection | None,
+    model: str,
+    shash: str = SCHEMA_HASH,
+) -> Path | None:
+    """Converte para Parquet (e registra no manifesto) as respostas vindas do cache."""
+    if not cached_path.exists() or cached_path.stat().st_size == 0:
+        return None
+    parquet_path = cached_path.with_name(f"{cached_path.stem}_spans.parquet")
+    parse_output_to_parquet(cached_path, parquet_path)
+    if manifesto is not None:
+        mf.atualizar_com_resultados(manifesto, "cache", model, shash, cached_path)
+    return parquet_path
 
-    print("[AVISO] Sem arquivo de saída para baixar.")
-    return None
+
+def _linha_span(sp: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Converte um span do modelo para os tipos de SPANS_SCHEMA. Valores de tipo
+    errado levantam exceção aqui (e a resposta vira linha de erro), em vez de
+    derrubar o arquivo inteiro no RecordBatch.from_pydict.
+    """
+    def _int(v):
+        return None if v is None else int(v)
+
+    def _str(v):
+        return None if v is None else str(v)
+
+    cues = sp.get("cues")
+    if cues is not None and not isinstance(cues, list):
+        raise TypeError(f"cues deveria ser lista, veio {type(cues).__name__}")
+    return {
+        "label": _str(sp.get("label")),
+        "start_char": _int(sp.get("start_char")),
+        "end_char": _int(sp.get("end_char")),
+        "text": _str(sp.get("text")),
+        "rationale": _str(sp.get("rationale")),
+        "cues": None if cues is None else [str(c) for c in cues],
+        "confidence": None if sp.get("confidence") is None else float(sp["confidence"]),
+    }
 
 
-def parse_output_to_parquet(output_jsonl: Path, parquet_path: Path):
+def parse_output_to_parquet(output_jsonl: Path, parquet_path: Path, row_group_size: int = ROW_GROUP_SIZE):
     """
     Lê o output JSONL do batch e transforma em um Parquet COM UMA LINHA POR SPAN.
-    - Se a resposta vier como JSON estruturado (output_json), explode os 'spans'.
-    - Se vier como texto, guarda o texto bruto (coluna 'text').
+
+    Conversão em streaming: decodifica linha a linha e descarrega lotes de
+    `row_group_size` spans como record batches Arrow num ParquetWriter com
+    schema fixo (SPANS_SCHEMA), de modo que a memória fica limitada ao lote
+    corrente qualquer que seja o tamanho do output.
+    Linhas que não puderem ser parseadas viram uma linha com parse_error e a
+    linha original em raw_response.
+    Spans de janelas (custom_id com offset) têm start/end remapeados para o
+    discurso inteiro quando vierem posicionados (end_char > start_char); o
+    offset da janela fica em chunk_offset.
     """
-    linhas: List[Dict[str, Any]] = []
+    nomes = SPANS_SCHEMA.names
+    buf: Dict[str, List[Any]] = {c: [] for c in nomes}
+    n_linhas = 0
+
+    def _append(row: Dict[str, Any]):
+        for c in nomes:
+            buf[c].append(row.get(c))
+
+    def _flush(writer: pq.ParquetWriter):
+        if not buf["custom_id"]:
+            return
+        batch = pa.RecordBatch.from_pydict(buf, schema=SPANS_SCHEMA)
+        writer.write_batch(batch)
+        for c in nomes:
+            buf[c].clear()
 
-    with output_jsonl.open("r", encoding="utf-8") as f:
+    with output_jsonl.open("r", encoding="utf-8") as f, pq.ParquetWriter(str(parquet_path), SPANS_SCHEMA) as writer:
         for line in f:
+            if not line.strip():
+                continue
             obj = json.loads(line)
             custom_id = obj.get("custom_id")
-            resp = obj.get("response", {}) or {}
+            codigo, _, offset = jn.parse_custom_id(custom_id)
 
             try:
-                output = resp["output"][0]["content"][0]  # bloco único esperado
-                ctype = output.get("type")
-
-                if ctype == "output_json":
-                    payload = output["json"]  # deve ter {"spans":[...]}
-                    spans = payload.get("spans", [])
-                    # explode: 1 linha por span
-                    for sp in spans:
-                        linhas.append({
-                            "custom_id": custom_id,
-                            **sp
-                        })
-                elif ctype == "output_text":
-                    linhas.append({
-                        "custom_id": custom_id,
-                        "text": output.get("text", "")
-                    })
-                else:
-                    # tipo inesperado; guarda bruto
-                    linhas.append({
-                        "custom_id": custom_id,
-                        "raw": output
-                    })
-
+                # monta todas as linhas antes de gravar: uma falha no meio não
+                # deixa a resposta metade como spans, metade como erro
+                linhas = []
+                for sp in extract_spans(obj):  # explode: 1 linha por span
+                    row = _linha_span(sp)
+                    row.update(custom_id=custom_id, CodigoPronunciamento=codigo, chunk_offset=offset)
+                    if offset and (row["end_char"] or 0) > (row["start_char"] or 0):
+                        row["start_char"] += offset
+                        row["end_char"] += offset
+                    linhas.append(row)
             except Exception as e:
-                linhas.append({
+                linhas = [{
                     "custom_id": custom_id,
+                    "CodigoPronunciamento": codigo,
+                    "chunk_offset": offset,
                     "parse_error": str(e),
-                    "raw_response": obj
-                })
+                    "raw_response": line.rstrip("\n"),
+                }]
+            for row in linhas:
+                _append(row)
+            n_linhas += len(linhas)
+
+            if len(buf["custom_id"]) >= row_group_size:
+                _flush(writer)
+        _flush(writer)
+
+    print(f"[OK] Parquet salvo em: {parquet_path} | linhas: {n_linhas}")
 
-    df = pd.DataFrame(linhas)
-    df.to_parquet(parquet_path, index=False)
-    print(f"[OK] Parquet salvo em: {parquet_path} | linhas: {len(df)}")
+
+def carregar_duplicatas(ativo: bool, fila: List[int], recalcular: bool = False) -> Dict[int, int]:
+    """
+    {membro: representante} dos discursos quase idênticos (--dedup) que podem
+    ficar fora do envio: só os membros da fila cujo representante também está
+    nela, pois só então os spans dele chegam à consolidação deste run. Os
+    demais membros são enviados normalmente. Vazio se desligado. O mapa é
+    recalculado se o corpus mudou ou com recalcular=True (--recalcular).
+    """
+    if not ativo or not SRC_DB.exists():
+        return {}
+    na_fila = set(fila)
+    mapa = dup.carregar_ou_calcular(SRC_DB, SRC_TABLE, recalcular=recalcular)
+    duplicatas = {m: r for m, r in mapa.items() if m in na_fila and r in na_fila}
+    print(f"[INFO] Deduplicação: {len(duplicatas)} discursos cobertos por representantes na fila")
+    return duplicatas
+
+
+def marcar_duplicatas_concluidas(
+    manifesto: sqlite3.Connection | None,
+    duplicatas: Dict[int, int],
+    spans_path: Path,
+    model: str,
+    shash: str = SCHEMA_HASH,
+) -> int:
+    """
+    Depois da consolidação, marca "concluido" no manifesto os membros cujo
+    representante foi concluído: os que receberam cópias de spans e os de
+    representantes sem nenhum span. Um membro cujas cópias foram todas
+    descartadas no realinhamento continua pendente e é enviado no próximo run.
+    """
+    if manifesto is None or not duplicatas:
+        return 0
+    concluidos = mf.codigos_concluidos(manifesto, model, shash)
+    com_spans: Set[int] = set()
+    com_copias: Set[int] = set()
+    if spans_path.exists():
+        df = pd.read_parquet(spans_path)
+        if "representante" in df:
+            copias = df["representante"].notna()
+            com_copias = set(int(c) for c in df.loc[copias, "CodigoPronunciamento"].unique())
+            df = df.loc[~copias]
+        com_spans = set(int(c) for c in df["CodigoPronunciamento"].dropna().unique())
+    membros = [
+        m for m, r in duplicatas.items() if r in concluidos and (m in com_copias or r not in com_spans)
+    ]
+    n = mf.marcar(manifesto, membros, model, shash, mf.STATUS_CONCLUIDO, batch_id="dedup")
+    print(f"[OK] Manifesto: {n} discursos duplicados concluídos pelos spans dos representantes")
+    return n
+
+
+def pre_detectar(codigos: List[int], destino: Path) -> Set[int]:
+    """
+    Roda o detector lexical (src/detector_lexical.py) sobre os discursos da
+    fila do run (`codigos`) e grava os spans locais em `destino`, no schema
+    dos Parquets de spans. Retorna os códigos com algum achado local.
+    """
+    df = dl.detectar_corpus(SRC_DB, SRC_TABLE, codigos=codigos)
+    destino.parent.mkdir(parents=True, exist_ok=True)
+    pq.write_table(pa.Table.from_pandas(df, schema=SPANS_SCHEMA, preserve_index=False), str(destino))
+    com_achados = set(int(c) for c in df["CodigoPronunciamento"].unique())
+    print(f"[OK] Detector lexical: {len(df)} spans em {len(com_achados)} discursos -> {destino}")
+    return com_achados
+
+
+def preparar_pre_detector(args, fila: List[int], destino: Path):
+    """
+    --pre-detector: grava os spans locais dos discursos da fila e devolve
+    (labels restantes para o modelo, fila atualizada). Com
+    --pular-sem-achados, os discursos sem achado local saem da fila.
+    Sem --pre-detector: (None, fila).
+    """
+    if not args.pre_detector:
+        return None, fila
+    com_achados = pre_detectar(fila, destino)
+    if args.pular_sem_achados:
+        sem_achados = [c for c in fila if c not in com_achados]
+        print(f"[INFO] {len(sem_achados)} discursos sem achados locais não serão enviados")
+        fila = [c for c in fila if c in com_achados]
+    return labels_do_run(args), fila
+
+
+def labels_do_run(args) -> List[str] | None:
+    """Labels do enum enviado ao modelo: sem as do detector local com --pre-detector; None = schema completo."""
+    if not args.pre_detector:
+        return None
+    return [l for l in LABELS if l not in dl.LABELS_LOCAIS]
+
+
+def schema_hash_do_run(labels: List[str] | None) -> str:
+    """
+    Hash do schema efetivamente enviado, usado no manifesto: com o enum
+    restrito, os discursos ficam registrados sob o hash desse schema, e um run
+    sem --pre-detector (schema completo) não os considera resolvidos.
+    """
+    return SCHEMA_HASH if labels is None else mf.schema_hash(schema_com_labels(labels))
+
+
+def reconciliar_se_preciso(args, manifesto: sqlite3.Connection | None, client=None, shash: str = SCHEMA_HASH):
+    """Reconcilia o manifesto (batches órfãos) antes de montar a fila; devolve o client, se criado."""
+    if manifesto is not None and mf.batches_em_aberto(manifesto, args.model, shash):
+        client = client or login()
+        reconciliar_manifesto(client, manifesto, args.model, shash=shash)
+    return client
+
+
+def run_sharded(args, client=None):
+    """Executa (ou retoma, com --run-id) um run em vários batches paralelos."""
+    manifesto = None if args.ignorar_manifesto else mf.abrir_manifesto()
+    cache = None if args.sem_cache else cr.abrir_cache()
+    if args.run_id:
+        run_id = args.run_id
+        run = load_run(run_id)
+        duplicatas = {int(m): int(r) for m, r in run.get("duplicatas", {}).items()}
+        if "duplicatas" not in run and run.get("dedup") and SRC_DB.exists():
+            # runs antigos pulavam todos os membros do mapa
+            duplicatas = dup.carregar_ou_calcular(SRC_DB, SRC_TABLE)
+        shash = run.get("schema_hash") or schema_hash_do_run(run.get("labels"))
+    else:
+        shash = schema_hash_do_run(labels_do_run(args))
+        client = reconciliar_se_preciso(args, manifesto, client, shash=shash)
+        pular = mf.codigos_resolvidos(manifesto, args.model, shash) if manifesto is not None else None
+        fila = selecionar_fila(args.limit, args.seed, pular)
+        duplicatas = carregar_duplicatas(args.dedup, fila, recalcular=args.recalcular)
+        fila = [c for c in fila if c not in duplicatas]
+        run_id = new_run_id(args.model)
+        run_dir = OUT_DIR / f"run_{run_id}"
+        lexical_parquet = run_dir / "lexical_spans.parquet"
+        labels, fila = preparar_pre_detector(args, fila, lexical_parquet)
+        criar = create_shards_empacotados if args.empacotar else create_shards
+        extras = {}
+        if args.empacotar:
+            extras["tokens_saida"] = args.tokens_saida
+            if args.calibracao:
+                from src import calibracao as cb
+
+                extras["calibracao"] = cb.carregar(args.calibracao)
+        shards = criar(
+            run_dir,
+            model=args.model,
+            limit=args.limit,
+            seed=args.seed,
+            max_chars=args.max_chars,
+            max_requests=args.shard_max_requests,
+            max_bytes=args.shard_max_bytes,
+            max_tokens=args.shard_max_tokens,
+            pular=pular,
+            cache=cache,
+            janela_chars=args.janela_chars,
+            sobreposicao_chars=args.sobreposicao_chars,
+            labels=labels,
+            codigos=fila,
+            **extras,
+        )
+        cached_path = cached_output_path(run_dir / f"requests_{args.model}.jsonl")
+        cached_parquet = ingest_cached(cached_path, manifesto, args.model, shash=shash)
+        if not shards:
+            print("[AVISO] Nenhuma requisição gerada. Nenhum batch a enviar.")
+            parquets = [p for p in (cached_parquet, lexical_parquet if labels is not None else None) if p]
+            if parquets:
+                consolidate_spans(
+                    parquets, run_dir / "spans.parquet", alinhar=not args.sem_alinhamento, duplicatas=duplicatas,
+                )
+            marcar_duplicatas_concluidas(manifesto, duplicatas, run_dir / "spans.parquet", args.model, shash=shash)
+            return
+        run = {"run_id": run_id, "model": args.model, "schema_hash": shash, "shards": shards}
+        if duplicatas:
+            run["duplicatas"] = {str(m): r for m, r in duplicatas.items()}
+        if cached_parquet is not None:
+            run["cache_parquet_path"] = str(cached_parquet)
+        if labels is not None:
+            run["labels"] = labels
+            run["lexical_parquet_path"] = str(lexical_parquet)
+        save_run(run_dir, run)
+        total = sum(s["n_requests"] for s in shards)
+        print(f"[OK] Run {run_id}: {total} requisições em {len(shards)} shards")
+
+    run_dir = OUT_DIR / f"run_{run_id}"
+    client = client or login()
+    submit_shards(client, run, run_dir, completion_window=args.completion_window, manifesto=manifesto, shash=shash)
+
+    por_batch = {shard["batch_id"]: shard for shard in run["shards"]}
+
+    def _registrar(res: Dict[str, Any]):
+        shard = por_batch[res["batch_id"]]
+        shard["status"] = res["status"]
+        if res.get("erro"):
+            shard["erro"] = res["erro"]
+        else:
+            shard.pop("erro", None)
+        if res["output_path"] is not None:
+            shard["output_path"] = str(res["output_path"])
+            shard["parquet_path"] = str(res["parquet_path"])
+        save_run(run_dir, run)
+
+    pendentes = [bid for bid, shard in por_batch.items() if not shard.get("output_path")]
+    asyncio.run(monitor_batches(
+        client,
+        pendentes,
+        run_dir,
+        model=run["model"],
+        manifesto_path=None if manifesto is None else mf.PATH_MANIFESTO,
+        on_done=_registrar,
+        requests_paths={bid: Path(shard["path"]) for bid, shard in por_batch.items()},
+        cache_path=None if cache is None else cr.PATH_CACHE,
+        shash=shash,
+    ))
+    falhos = [bid for bid, shard in por_batch.items() if shard.get("status") == "erro"]
+    if falhos:
+        print(f"[AVISO] {len(falhos)} batches sem resultado por erro no acompanhamento; retome com --run-id {run_id}")
+
+    parquets = [run[k] for k in ("cache_parquet_path", "lexical_parquet_path") if run.get(k)]
+    parquets += [shard["parquet_path"] for shard in run["shards"] if shard.get("parquet_path")]
+    spans_path = consolidate_spans(
+        parquets, run_dir / "spans.parquet", alinhar=not args.sem_alinhamento, duplicatas=duplicatas,
+    )
+    marcar_duplicatas_concluidas(manifesto, duplicatas, spans_path, run["model"], shash=shash)
+
+
+def run_realtime(args, client=None):
+    """Analisa os discursos pendentes direto no /v1/responses, em paralelo."""
+    manifesto = None if args.ignorar_manifesto else mf.abrir_manifesto()
+    pular = mf.codigos_resolvidos(manifesto, args.model, SCHEMA_HASH) if manifesto is not None else None
+    cache = None if args.sem_cache else cr.abrir_cache()
+
+    def _discursos():
+        for rec in iter_discursos(limit=args.limit, seed=args.seed, min_chars=1):
+            codigo = rec["CodigoPronunciamento"]
+            if pular and codigo in pular:
+                continue
+            texto = rec.get("TextoIntegral") or ""
+            if args.max_chars is not None:
+                texto = texto[: args.max_chars]
+            yield codigo, texto
+
+    out_jsonl = OUT_DIR / f"realtime_{new_run_id(args.model)}_output.jsonl"
+    client = client or login_async(base_url=args.base_url)
+    asyncio.run(analise_async.analisar_lote(
+        client,
+        _discursos(),
+        out_jsonl,
+        model=args.model,
+        rpm=args.rpm,
+        tpm=args.tpm,
+        concorrencia=args.concorrencia,
+        cache=cache,
+    ))
+    if manifesto is not None:
+        mf.atualizar_com_resultados(manifesto, out_jsonl.stem, args.model, SCHEMA_HASH, out_jsonl)
+    parse_output_to_parquet(out_jsonl, out_jsonl.with_name(out_jsonl.stem.replace("_output", "_spans") + ".parquet"))
 
 
 def main():
@@ -239,24 +1340,89 @@ def main():
     ap.add_argument("--seed", type=int, default=None, help="Seed p/ embaralhar no SELECT")
     ap.add_argument("--max-chars", type=int, default=None, help="Truncar TextoIntegral a N chars (opcional)")
     ap.add_argument("--completion-window", default="24h", help="Janela do batch (ex.: 24h)")
+    ap.add_argument("--shard", action="store_true", help="Divide em vários batches paralelos sob um run id")
+    ap.add_argument("--run-id", default=None, help="Retoma um run já criado (implica --shard)")
+    ap.add_argument("--shard-max-requests", type=int, default=SHARD_MAX_REQUESTS, help="Máx. de requisições por shard")
+    ap.add_argument("--shard-max-bytes", type=int, default=SHARD_MAX_BYTES, help="Máx. de bytes por arquivo de shard")
+    ap.add_argument("--shard-max-tokens", type=int, default=SHARD_MAX_TOKENS, help="Máx. de tokens estimados por shard")
+    ap.add_argument("--empacotar", action="store_true",
+                    help="Conta tokens (tiktoken) e equilibra os shards por tokens (implica --shard)")
+    ap.add_argument("--tokens-saida", type=int, default=analise_async.TOKENS_SAIDA_ESTIMADOS,
+                    help="Empacotamento: tokens de saída previstos por requisição")
+    ap.add_argument("--calibracao", default=None,
+                    help="Empacotamento: JSON de src/calibracao.py (saída por tamanho de entrada e tempo previsto)")
+    ap.add_argument("--ignorar-manifesto", action="store_true", help="Reenvia tudo, sem consultar/atualizar o manifesto")
+    ap.add_argument("--sem-cache", action="store_true", help="Não consulta nem alimenta o cache de respostas")
+    ap.add_argument("--janela-chars", type=int, default=None, help="Divide discursos maiores em janelas de N chars")
+    ap.add_argument("--sobreposicao-chars", type=int, default=jn.SOBREPOSICAO_CHARS, help="Sobreposição entre janelas")
+    ap.add_argument("--dedup", action="store_true",
+                    help="Envia um representante por grupo de discursos quase idênticos e copia os spans aos demais")
+    ap.add_argument("--recalcular", action="store_true",
+                    help="Com --dedup: recalcula o mapa de duplicatas mesmo que o corpus não tenha mudado")
+    ap.add_argument("--pre-detector", action="store_true",
+                    help="Detecta localmente anáfora, aliteração, assonância e pergunta retórica e tira essas labels do schema")
+    ap.add_argument("--pular-sem-achados", action="store_true",
+                    help="Com --pre-detector: não envia discursos sem nenhum achado local")
+    ap.add_argument("--sem-alinhamento", action="store_true", help="Não alinha os spans ao TextoIntegral")
+    ap.add_argument("--realtime", action="store_true", help="Chama a API diretamente, em paralelo (lotes pequenos)")
+    ap.add_argument("--rpm", type=int, default=500, help="Tempo real: máx. de requisições por minuto")
+    ap.add_argument("--tpm", type=int, default=500_000, help="Tempo real: máx. de tokens por minuto")
+    ap.add_argument("--concorrencia", type=int, default=32, help="Tempo real: requisições simultâneas")
+    ap.add_argument("--base-url", default=None, help="Tempo real: base URL alternativa (ex.: servidor local de testes)")
     args = ap.parse_args()
 
+    if args.realtime:
+        run_realtime(args)
+        return
+
+    if args.shard or args.run_id or args.empacotar:
+        run_sharded(args)
+        return
+
+    manifesto = None if args.ignorar_manifesto else mf.abrir_manifesto()
+    shash = schema_hash_do_run(labels_do_run(args))
+    client = reconciliar_se_preciso(args, manifesto, shash=shash)
+    pular = mf.codigos_resolvidos(manifesto, args.model, shash) if manifesto is not None else None
+    fila = selecionar_fila(args.limit, args.seed, pular)
+    duplicatas = carregar_duplicatas(args.dedup, fila, recalcular=args.recalcular)
+    fila = [c for c in fila if c not in duplicatas]
+    lexical_parquet = OUT_DIR / f"requests_{args.model}_lexical_spans.parquet"
+    labels, fila = preparar_pre_detector(args, fila, lexical_parquet)
+    cache = None if args.sem_cache else cr.abrir_cache()
+
     jsonl_path = OUT_DIR / f"requests_{args.model}.jsonl"
-    n = create_jsonl(jsonl_path, model=args.model, limit=args.limit, seed=args.seed, max_chars=args.max_chars)
+    n = create_jsonl(
+        jsonl_path, model=args.model, limit=args.limit, seed=args.seed, max_chars=args.max_chars,
+        pular=pular, cache=cache, janela_chars=args.janela_chars, sobreposicao_chars=args.sobreposicao_chars,
+        labels=labels, codigos=fila,
+    )
+    cached_parquet = ingest_cached(cached_output_path(jsonl_path), manifesto, args.model, shash=shash)
+    parquets = [p for p in (cached_parquet, lexical_parquet if labels is not None else None) if p]
+    spans_path = jsonl_path.with_name(f"{jsonl_path.stem}_spans.parquet")
     if n == 0:
-        print("[AVISO] JSONL vazio. Nada a fazer.")
-        return
-    print(f"[OK] JSONL criado: {jsonl_path} ({n} requisições)")
+        # tudo veio do cache/detector local (ou nada a fazer): ainda consolida
+        # esses spans e as cópias para as duplicatas
+        print("[AVISO] JSONL vazio. Nenhuma requisição a enviar.")
+    else:
+        print(f"[OK] JSONL criado: {jsonl_path} ({n} requisições)")
 
-    client = login()  # teu client já autenticado
+        client = client or login()  # teu client já autenticado
 
-    batch = create_and_run_batch(client, jsonl_path, completion_window=args.completion_window)
-    out_jsonl = wait_and_download(client, batch.id, OUT_DIR)
+        batch = create_and_run_batch(client, jsonl_path, completion_window=args.completion_window)
+        if manifesto is not None:
+            mf.marcar_enviados(manifesto, jsonl_path, args.model, shash, batch.id)
+        out_jsonl = wait_and_download(client, batch.id, OUT_DIR, manifesto=manifesto, model=args.model, shash=shash)
 
-    if out_jsonl:
-        parquet_path = OUT_DIR / f"{batch.id}_spans.parquet"
-        parse_output_to_parquet(out_jsonl, parquet_path)
+        if out_jsonl:
+            if cache is not None:
+                cache_batch_results(cache, jsonl_path, out_jsonl)
+            spans_path = OUT_DIR / f"{batch.id}_spans.parquet"
+            parse_output_to_parquet(out_jsonl, spans_path)
+            parquets.append(spans_path)
 
+    if parquets:
+        consolidate_spans(parquets, spans_path, alinhar=not args.sem_alinhamento, duplicatas=duplicatas)
+    marcar_duplicatas_concluidas(manifesto, duplicatas, spans_path, args.model, shash=shash)
 
 if __name__ == "__main__":
     main()
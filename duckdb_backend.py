@@ -0,0 +1,286 @@
+"""Optional DuckDB query backend for the dashboard.
+
+Instead of loading spans and metadata into pandas, every filter and
+aggregation is sent as SQL to an embedded DuckDB connection reading the
+Parquet data directly, so only the columns a query names are read
+(projection pushdown) and row groups / year partitions outside the filters
+are skipped (predicate pushdown). Only aggregates and the rows actually
+displayed reach Python.
+
+Data layout (preferred, see :func:`partition_by_year`)::
+
+    data/spans_long/ano=YYYY/*.parquet       spans + year of their speech
+    data/discursos_meta/ano=YYYY/*.parquet   speech metadata (and text)
+
+If the partitioned directories are missing, the single files
+``data/spans_long.parquet`` / ``data/discursos_meta.parquet`` are queried
+instead (still with pushdown, but without partition pruning).
+
+Enable it with ``FIGURAS_BACKEND=duckdb streamlit run app.py``. Build the
+partitions with ``python duckdb_backend.py``.
+"""
+
+import argparse
+import shutil
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+try:
+    import duckdb
+except ImportError as e:
+    raise ImportError("Instale duckdb: pip install duckdb") from e
+
+SPANS_PARQUET = Path("data/spans_long.parquet")
+META_PARQUET = Path("data/discursos_meta.parquet")
+SAMPLE_SQLITE = Path("Amostra_1.sqlite")
+SPANS_DATASET = Path("data/spans_long")
+META_DATASET = Path("data/discursos_meta")
+
+# Filter keys -> (table alias, column); same keys as utils.apply_filters
+CATEGORY_FILTERS = {
+    "labels": "s.label",
+    "oradores": "m.NomeParlamentar",
+    "partidos": "m.SiglaPartidoParlamentarNaData",
+}
+# Dashboard column / dimension -> SQL expression
+COLUMNS = {
+    "CodigoPronunciamento": "s.CodigoPronunciamento",
+    "label": "s.label",
+    "text": "s.text",
+    "confidence": "s.confidence",
+    "start_char": "s.start_char",
+    "end_char": "s.end_char",
+    "Data": "m.Data",
+    "NomeParlamentar": "m.NomeParlamentar",
+    "SiglaPartidoParlamentarNaData": "m.SiglaPartidoParlamentarNaData",
+    "tamanho_discurso_palavras": "m.tamanho_discurso_palavras",
+    "ano_mes": "strftime(m.Data, '%Y-%m')",
+}
+
+
+def _source(dataset: Path, single: Path) -> Tuple[str, bool]:
+    """``read_parquet`` call for a partitioned dataset or a single file."""
+    if dataset.is_dir() and any(dataset.glob("ano=*")):
+        return f"read_parquet('{dataset.as_posix()}/*/*.parquet', hive_partitioning = true)", True
+    return f"read_parquet('{single.as_posix()}')", False
+
+
+class DuckDBBackend:
+    """Dashboard queries answered by DuckDB over Parquet.
+
+    Exposes the same methods as :class:`utils.PandasBackend`.
+    """
+
+    def __init__(self):
+        spans_sql, spans_part = _source(SPANS_DATASET, SPANS_PARQUET)
+        meta_sql, meta_part = _source(META_DATASET, META_PARQUET)
+        self.partitioned = spans_part and meta_part
+        self.con = duckdb.connect()
+        self.con.execute(f"CREATE VIEW spans AS SELECT * FROM {spans_sql}")
+        # Data may be stored as text in the single-file layout
+        self.con.execute(f"CREATE VIEW meta AS SELECT * REPLACE (CAST(Data AS TIMESTAMP) AS Data) FROM {meta_sql}")
+        self.meta_columns = {r[0] for r in self.con.execute("DESCRIBE meta").fetchall()}
+        self.lock = threading.Lock()
+        self._options: Dict[str, List[Any]] = {}
+
+    # -- SQL building ---------------------------------------------------------
+
+    def _from(self) -> str:
+        on = "s.CodigoPronunciamento = m.CodigoPronunciamento"
+        if self.partitioned:
+            on += " AND s.ano = m.ano"  # lets the join prune partitions too
+        return f"spans s LEFT JOIN meta m ON {on}"
+
+    def _where(self, f: Dict[str, Any]) -> Tuple[str, List[Any]]:
+        clauses, params = [], []
+        for key, col in CATEGORY_FILTERS.items():
+            if f.get(key):
+                clauses.append(f"{col} IN ({', '.join('?' for _ in f[key])})")
+                params.extend(str(v) for v in f[key])
+        if f.get("conf_min") is not None:
+            clauses.append("s.confidence >= ?")
+            params.append(float(f["conf_min"]))
+        if f.get("data_ini") and f.get("data_fim"):
+            ini, fim = pd.Timestamp(f["data_ini"]), pd.Timestamp(f["data_fim"])
+            clauses.append("m.Data BETWEEN ? AND ?")
+            params.extend([ini.to_pydatetime(), fim.to_pydatetime()])
+            if self.partitioned:
+                clauses.append("s.ano BETWEEN ? AND ?")
+                params.extend([ini.year, fim.year])
+        if f.get("q"):
+            pattern = f"%{f['q']}%"
+            if f.get("q_em") == "discursos" and "TextoIntegral" in self.meta_columns:
+                clauses.append("strip_accents(m.TextoIntegral) ILIKE strip_accents(?)")
+            else:
+                clauses.append("strip_accents(s.text) ILIKE strip_accents(?)")
+            params.append(pattern)
+        return (" WHERE " + " AND ".join(clauses)) if clauses else "", params
+
+    def _query(self, sql: str, params: List[Any]) -> pd.DataFrame:
+        # one cursor per query: the connection is shared by all sessions
+        with self.lock:
+            cur = self.con.cursor()
+        try:
+            return cur.execute(sql, params).df()
+        finally:
+            cur.close()
+
+    # -- dashboard API --------------------------------------------------------
+
+    def date_bounds(self) -> Tuple[pd.Timestamp, pd.Timestamp]:
+        lo, hi = self._query("SELECT min(Data), max(Data) FROM meta", []).iloc[0]
+        return pd.Timestamp(lo), pd.Timestamp(hi)
+
+    def options(self, col: str) -> List[Any]:
+        if col not in self._options:
+            expr = COLUMNS[col].split(".", 1)[1]
+            table = "spans" if COLUMNS[col].startswith("s.") else "meta"
+            df = self._query(f"SELECT DISTINCT {expr} AS v FROM {table} WHERE {expr} IS NOT NULL ORDER BY v", [])
+            self._options[col] = df["v"].tolist()
+        return self._options[col]
+
+    def summary(self, f: Dict[str, Any]) -> Dict[str, int]:
+        where, params = self._where(f)
+        df = self._query(
+            "SELECT count(DISTINCT s.CodigoPronunciamento) AS discursos, count(*) AS spans,"
+            " count(DISTINCT m.NomeParlamentar) AS oradores,"
+            f" count(DISTINCT m.SiglaPartidoParlamentarNaData) AS partidos FROM {self._from()}{where}",
+            params,
+        )
+        return {k: int(v) for k, v in df.iloc[0].items()}
+
+    def rollup(self, dims: List[str], f: Dict[str, Any], normalizado: bool) -> pd.DataFrame:
+        where, params = self._where(f)
+        select = ", ".join(f"{COLUMNS[d]} AS {d}" for d in dims)
+        peso = "sum(1000.0 / greatest(m.tamanho_discurso_palavras, 1))" if normalizado else "count(*)"
+        not_null = " AND ".join(f"{COLUMNS[d]} IS NOT NULL" for d in dims)
+        where = f"{where} AND {not_null}" if where else f" WHERE {not_null}"
+        order = ", ".join(str(i + 1) for i in range(len(dims)))
+        return self._query(
+            f"SELECT {select}, {peso} AS peso FROM {self._from()}{where} GROUP BY {order} ORDER BY {order}",
+            params,
+        )
+
+    def _rows_sql(self, f: Dict[str, Any], columns: List[str]) -> Tuple[str, List[Any]]:
+        where, params = self._where(f)
+        select = ", ".join(f"{COLUMNS[c]} AS {c}" for c in columns)
+        sql = f"SELECT {select} FROM {self._from()}{where} ORDER BY m.Data, s.CodigoPronunciamento, s.start_char"
+        return sql, params
+
+    def rows(
+        self,
+        f: Dict[str, Any],
+        columns: List[str],
+        limit: Optional[int] = None,
+        offset: int = 0,
+    ) -> pd.DataFrame:
+        sql, params = self._rows_sql(f, columns)
+        if limit is not None:
+            sql += f" LIMIT {int(limit)} OFFSET {int(offset)}"
+        return self._query(sql, params)
+
+    def iter_batches(self, f: Dict[str, Any], columns: List[str], batch_size: int = 50_000) -> Iterator[pa.RecordBatch]:
+        """Filtered rows streamed from DuckDB as Arrow record batches."""
+        sql, params = self._rows_sql(f, columns)
+        with self.lock:
+            cur = self.con.cursor()
+        try:
+            yield from cur.execute(sql, params).fetch_record_batch(batch_size)
+        finally:
+            cur.close()
+
+    def speech(self, codigo: int) -> Tuple[pd.DataFrame, pd.DataFrame]:
+        cols = [c for c in ("CodigoPronunciamento", "Data", "NomeParlamentar",
+                            "SiglaPartidoParlamentarNaData", "tamanho_discurso_palavras") if c in self.meta_columns]
+        meta_row = self._query(f"SELECT {', '.join(cols)} FROM meta WHERE CodigoPronunciamento = ?", [codigo])
+        spans_disc = self._query(
+            "SELECT CodigoPronunciamento, label, text, confidence, start_char, end_char"
+            " FROM spans WHERE CodigoPronunciamento = ?",
+            [codigo],
+        )
+        return meta_row, spans_disc
+
+
+# ---------------------------------------------------------------------------
+# Building the partitioned layout
+# ---------------------------------------------------------------------------
+
+def _iter_meta_chunks(chunk_size: int):
+    """Metadata (with text) in chunks, from the Parquet file or the SQLite sample."""
+    if META_PARQUET.exists():
+        for batch in pq.ParquetFile(META_PARQUET).iter_batches(batch_size=chunk_size):
+            yield batch.to_pandas()
+    elif SAMPLE_SQLITE.exists():
+        con = sqlite3.connect(SAMPLE_SQLITE)
+        query = (
+            "SELECT CodigoPronunciamento, DataPronunciamento as Data,"
+            " NomeParlamentar, SiglaPartidoParlamentarNaData, TextoIntegral"
+            " FROM DiscursosAmostra"
+        )
+        try:
+            yield from pd.read_sql_query(query, con, chunksize=chunk_size)
+        finally:
+            con.close()
+
+
+def partition_by_year(chunk_size: int = 20_000) -> Tuple[Path, Path]:
+    """Write ``data/discursos_meta/ano=YYYY`` and ``data/spans_long/ano=YYYY``.
+
+    Metadata is streamed in chunks (adding ``tamanho_discurso_palavras`` if
+    missing); spans get the year of their speech through a DuckDB join and are
+    written with ``COPY ... PARTITION_BY``. Existing partitions are replaced.
+    """
+    for d in (META_DATASET, SPANS_DATASET):
+        if d.exists():
+            shutil.rmtree(d)
+
+    n = 0
+    for i, chunk in enumerate(_iter_meta_chunks(chunk_size)):
+        chunk["Data"] = pd.to_datetime(chunk["Data"])
+        if "tamanho_discurso_palavras" not in chunk and "TextoIntegral" in chunk:
+            chunk["tamanho_discurso_palavras"] = chunk["TextoIntegral"].fillna("").str.split().str.len()
+        chunk["ano"] = chunk["Data"].dt.year.astype("Int32")
+        pq.write_to_dataset(
+            pa.Table.from_pandas(chunk, preserve_index=False),
+            META_DATASET,
+            partition_cols=["ano"],
+            basename_template=f"part-{i}-{{i}}.parquet",
+        )
+        n += len(chunk)
+    print(f"[OK] Metadados particionados por ano: {n} discursos -> {META_DATASET}")
+
+    # spans without metadata have no year; the dashboard's date filter drops them anyway
+    con = duckdb.connect()
+    con.execute(
+        f"""
+        COPY (
+            SELECT s.*, m.ano
+            FROM read_parquet('{SPANS_PARQUET.as_posix()}') s
+            JOIN read_parquet('{META_DATASET.as_posix()}/*/*.parquet', hive_partitioning = true) m
+            USING (CodigoPronunciamento)
+        ) TO '{SPANS_DATASET.as_posix()}' (FORMAT PARQUET, PARTITION_BY (ano))
+        """
+    )
+    n_spans = con.execute(
+        f"SELECT count(*) FROM read_parquet('{SPANS_DATASET.as_posix()}/*/*.parquet', hive_partitioning = true)"
+    ).fetchone()[0]
+    con.close()
+    print(f"[OK] Spans particionados por ano: {n_spans} -> {SPANS_DATASET}")
+    return META_DATASET, SPANS_DATASET
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Particiona spans e metadados por ano para o backend DuckDB.")
+    ap.add_argument("--chunk-size", type=int, default=20_000, help="Discursos por lote de leitura")
+    args = ap.parse_args()
+    partition_by_year(args.chunk_size)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,248 @@
+# -*- coding: utf-8 -*-
+"""
+Alinhamento dos spans ao TextoIntegral: o modelo costuma devolver
+start_char/end_char = 0 (ver o exemplo em src/parseador.py), então aqui cada
+span é localizado pelo seu `text` dentro do discurso.
+
+Estratégia por span (do mais barato ao mais caro):
+1) offsets do modelo já batem com o texto            -> score 1.0
+2) busca exata do texto normalizado                  -> score 1.0
+3) fragmentos separados por reticências, em ordem    -> score por similaridade
+4) âncoras (primeiras/últimas palavras)              -> score por similaridade
+Sem localização, os offsets originais são mantidos e o score fica 0.
+
+Normalização (preserva o mapa de posições para o texto original): minúsculas,
+aspas/apóstrofos/travessões unificados e espaços em branco colapsados.
+
+Os discursos são distribuídos num pool de processos (um discurso por tarefa).
+"""
+
+from __future__ import annotations
+
+import argparse
+import re
+import sqlite3
+from concurrent.futures import ProcessPoolExecutor
+from difflib import SequenceMatcher
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+TABELA_NORMALIZACAO = str.maketrans({
+    "“": '"', "”": '"', "„": '"', "«": '"', "»": '"',
+    "‘": "'", "’": "'", "‚": "'", "`": "'", "´": "'",
+    "–": "-", "—": "-", "‐": "-", "−": "-",
+    " ": " ", " ": " ", " ": " ",
+})
+RE_RETICENCIAS = re.compile(r"\s*(?:\[\s*\.\.\.\s*\]|\(\s*\.\.\.\s*\)|\.{3,}|…)\s*")
+ESPACOS = np.array([ord(c) for c in " \t\n\r\f\v"], dtype=np.uint32)
+N_ANCORA = 4
+SCORE_MINIMO = 0.6
+
+
+def normalizar(texto: str) -> Tuple[str, np.ndarray]:
+    """
+    Retorna (texto normalizado, mapa) onde mapa[i] é a posição no texto
+    original do i-ésimo caractere normalizado (com uma sentinela no fim).
+    """
+    t = (texto or "").translate(TABELA_NORMALIZACAO)
+    baixo = t.lower()
+    if len(baixo) == len(t):
+        t = baixo
+    cod = np.frombuffer(t.encode("utf-32-le"), dtype=np.uint32).copy()
+    espaco = np.isin(cod, ESPACOS)
+    cod[espaco] = 32
+    manter = ~(espaco & np.concatenate(([True], espaco[:-1])))
+    mapa = np.flatnonzero(manter)
+    norm = cod[manter].tobytes().decode("utf-32-le")
+    return norm, np.append(mapa, len(texto or ""))
+
+
+def _normalizar_curto(texto: str) -> str:
+    return normalizar(texto)[0].strip()
+
+
+def _achar(norm: str, alvo: str, dica: int) -> int:
+    """Primeira ocorrência de `alvo` a partir da dica; se não houver, do início."""
+    if not alvo:
+        return -1
+    pos = norm.find(alvo, max(0, dica))
+    if pos < 0 and dica > 0:
+        pos = norm.find(alvo)
+    return pos
+
+
+def _similaridade(a: str, b: str) -> float:
+    return SequenceMatcher(None, a, b, autojunk=False).ratio()
+
+
+def alinhar_span(
+    texto: str,
+    norm: str,
+    mapa: np.ndarray,
+    span_texto: str,
+    start: Optional[int],
+    end: Optional[int],
+    dica: int = 0,
+) -> Tuple[int, int, float, str]:
+    """Retorna (start_char, end_char, score, metodo) para um span."""
+    alvo = _normalizar_curto(span_texto)
+    start = int(start) if start is not None and not pd.isna(start) else 0
+    end = int(end) if end is not None and not pd.isna(end) else 0
+    if not alvo:
+        return start, end, 0.0, "vazio"
+
+    if 0 <= start < end <= len(texto) and _normalizar_curto(texto[start:end]) == alvo:
+        return start, end, 1.0, "modelo"
+
+    # posição normalizada aproximada da dica
+    dica_norm = int(np.searchsorted(mapa, max(dica, start), side="left"))
+
+    pos = _achar(norm, alvo, dica_norm)
+    if pos >= 0:
+        return int(mapa[pos]), int(mapa[pos + len(alvo) - 1]) + 1, 1.0, "exato"
+
+    # fragmentos separados por reticências, em ordem
+    fragmentos = [f for f in (_normalizar_curto(x) for x in RE_RETICENCIAS.split(span_texto)) if f]
+    ini = fim = -1
+    if len(fragmentos) > 1:
+        p0 = _achar(norm, fragmentos[0], dica_norm)
+        if p0 >= 0:
+            cursor, ultimo = p0 + len(fragmentos[0]), p0 + len(fragmentos[0])
+            for frag in fragmentos[1:]:
+                p = norm.find(frag, cursor)
+                if p < 0:
+                    continue
+                cursor = ultimo = p + len(frag)
+            ini, fim = p0, ultimo
+            metodo = "fragmentos"
+
+    # âncoras: primeiras e últimas palavras
+    if ini < 0:
+        palavras = alvo.replace("...", " ").split()
+        if len(palavras) >= 2:
+            cabeca = " ".join(palavras[:N_ANCORA])
+            cauda = " ".join(palavras[-N_ANCORA:])
+            p0 = _achar(norm, cabeca, dica_norm)
+            if p0 >= 0:
+                limite = p0 + 3 * len(alvo) + len(cauda)
+                p1 = norm.find(cauda, p0, limite)
+                ini, fim = p0, (p1 + len(cauda) if p1 >= 0 else min(len(norm), p0 + len(alvo)))
+            else:
+                p1 = _achar(norm, cauda, dica_norm)
+                if p1 >= 0:
+                    ini, fim = max(0, p1 + len(cauda) - len(alvo)), p1 + len(cauda)
+            metodo = "ancoras"
+
+    if ini < 0 or fim <= ini:
+        return start, end, 0.0, "nao_encontrado"
+
+    score = _similaridade(RE_RETICENCIAS.sub(" ", alvo), norm[ini:fim])
+    if score < SCORE_MINIMO:
+        return start, end, float(score), "nao_encontrado"
+    return int(mapa[ini]), int(mapa[fim - 1]) + 1, float(score), metodo
+
+
+def alinhar_discurso(
+    args: Tuple[str, Sequence[Tuple[int, str, Optional[int], Optional[int], int]]]
+) -> List[Tuple[int, int, int, float, str]]:
+    """
+    Tarefa do pool: (texto, [(idx, span_texto, start, end, dica), ...]) ->
+    [(idx, start, end, score, metodo), ...].
+    """
+    texto, spans = args
+    texto = texto or ""
+    norm, mapa = normalizar(texto)
+    out = []
+    for idx, span_texto, start, end, dica in spans:
+        s, e, score, metodo = alinhar_span(texto, norm, mapa, span_texto or "", start, end, dica)
+        out.append((idx, s, e, score, metodo))
+    return out
+
+
+def iter_textos(db_path: Path, table: str, codigos: Iterable[int], lote: int = 500) -> Iterable[Tuple[int, str]]:
+    """Busca TextoIntegral por CodigoPronunciamento, em lotes."""
+    codigos = list(codigos)
+    conn = sqlite3.connect(str(db_path))
+    try:
+        for i in range(0, len(codigos), lote):
+            parte = codigos[i : i + lote]
+            ph = ",".join("?" for _ in parte)
+            cur = conn.execute(
+                f"SELECT CodigoPronunciamento, TextoIntegral FROM {table} WHERE CodigoPronunciamento IN ({ph})",
+                parte,
+            )
+            yield from cur
+    finally:
+        conn.close()
+
+
+def alinhar_spans(
+    df: pd.DataFrame,
+    textos: Iterable[Tuple[int, str]],
+    workers: int | None = None,
+    chunksize: int = 16,
+) -> pd.DataFrame:
+    """
+    Corrige start_char/end_char do DataFrame de spans e adiciona as colunas
+    align_score (float32) e align_method. `textos` é um iterável de
+    (CodigoPronunciamento, TextoIntegral).
+    """
+    if df.empty:
+        return df.assign(align_score=pd.Series(dtype="float32"), align_method=pd.Series(dtype="string"))
+
+    df = df.reset_index(drop=True)
+    dica = df["chunk_offset"] if "chunk_offset" in df else pd.Series(0, index=df.index)
+    dica = dica.fillna(0).astype("int64")
+    grupos: Dict[int, list] = {}
+    for idx, codigo, texto, start, end, d in zip(
+        df.index, df["CodigoPronunciamento"], df["text"], df["start_char"], df["end_char"], dica
+    ):
+        if pd.isna(codigo) or not isinstance(texto, str):
+            continue
+        grupos.setdefault(int(codigo), []).append((idx, texto, start, end, int(d)))
+
+    tarefas = ((texto, grupos[codigo]) for codigo, texto in textos if codigo in grupos)
+
+    start_col = df["start_char"].astype("float64").to_numpy(copy=True)
+    end_col = df["end_char"].astype("float64").to_numpy(copy=True)
+    score_col = np.zeros(len(df), dtype=np.float32)
+    metodo_col = np.full(len(df), "sem_texto", dtype=object)
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for resultado in pool.map(alinhar_discurso, tarefas, chunksize=chunksize):
+            for idx, s, e, score, metodo in resultado:
+                start_col[idx], end_col[idx] = s, e
+                score_col[idx] = score
+                metodo_col[idx] = metodo
+
+    df["start_char"] = pd.array(start_col, dtype="Int32")
+    df["end_char"] = pd.array(end_col, dtype="Int32")
+    df["align_score"] = score_col
+    df["align_method"] = pd.Categorical(metodo_col)
+    n_ok = int((score_col > 0).sum())
+    print(f"[OK] Alinhamento: {n_ok}/{len(df)} spans localizados no texto")
+    return df
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Alinha spans ao TextoIntegral e grava offsets corrigidos.")
+    ap.add_argument("--spans", required=True, help="Parquet de spans (entrada)")
+    ap.add_argument("--out", default=None, help="Parquet de saída (padrão: sobrescreve a entrada)")
+    ap.add_argument("--db", default="Amostra_1.sqlite", help="SQLite com os discursos")
+    ap.add_argument("--table", default="DiscursosAmostra", help="Tabela com TextoIntegral")
+    ap.add_argument("--workers", type=int, default=None, help="Processos no pool")
+    args = ap.parse_args()
+
+    df = pd.read_parquet(args.spans)
+    codigos = sorted(int(c) for c in df["CodigoPronunciamento"].dropna().unique())
+    df = alinhar_spans(df, iter_textos(Path(args.db), args.table, codigos), workers=args.workers)
+    out = Path(args.out or args.spans)
+    df.to_parquet(out, index=False)
+    print(f"[OK] Spans alinhados em: {out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,219 @@
+# -*- coding: utf-8 -*-
+"""
+Modo "tempo real" para lotes pequenos e urgentes: dispara várias chamadas ao
+/v1/responses em paralelo (asyncio), com o mesmo body do batch
+(src/requisicao.build_request_body), respeitando limites de requisições por
+minuto (RPM) e tokens por minuto (TPM).
+
+- 429 e 5xx (e falhas de conexão/timeout) são repetidos com backoff
+  exponencial + jitter, respeitando o Retry-After quando vier.
+- Cada resposta é gravada assim que chega num JSONL no mesmo formato do output
+  do /v1/batches, então batch_figuras.parse_output_to_parquet serve para ambos.
+- Respostas bem-sucedidas alimentam o cache local (src/cache_respostas.py).
+
+Para testar contra um servidor local, basta passar `base_url`
+(ex.: http://127.0.0.1:8000/v1) para login_async(); tests/test_analise_async.py
+faz isso com um servidor de teste que responde 200/429/500.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import json
+import random
+import sqlite3
+import time
+from pathlib import Path
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+import openai
+
+from src.requisicao import build_request_body
+from src import cache_respostas as cr
+
+CHARS_POR_TOKEN = 4
+TOKENS_SAIDA_ESTIMADOS = 2_000  # reserva de saída por requisição (inclui reasoning)
+RETRY_STATUS = {408, 409, 429, 500, 502, 503, 504}
+
+
+class LimitadorTaxa:
+    """
+    Dois baldes de fichas (requisições/min e tokens/min) reabastecidos
+    continuamente. `adquirir(n_tokens)` espera até haver saldo nos dois.
+    """
+
+    def __init__(self, rpm: int, tpm: int):
+        self.rpm = float(rpm)
+        self.tpm = float(tpm)
+        self._req = float(rpm)
+        self._tok = float(tpm)
+        self._t = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _reabastecer(self):
+        agora = time.monotonic()
+        dt = agora - self._t
+        self._t = agora
+        self._req = min(self.rpm, self._req + dt * self.rpm / 60.0)
+        self._tok = min(self.tpm, self._tok + dt * self.tpm / 60.0)
+
+    async def adquirir(self, n_tokens: int):
+        # uma requisição maior que o balde inteiro só precisa esperar o balde encher
+        n_tokens = min(float(n_tokens), self.tpm)
+        async with self._lock:
+            while True:
+                self._reabastecer()
+                if self._req >= 1 and self._tok >= n_tokens:
+                    self._req -= 1
+                    self._tok -= n_tokens
+                    return
+                falta_req = max(0.0, 1 - self._req) * 60.0 / self.rpm
+                falta_tok = max(0.0, n_tokens - self._tok) * 60.0 / self.tpm
+                await asyncio.sleep(max(falta_req, falta_tok, 0.01))
+
+    def devolver(self, n_tokens: int):
+        """Devolve tokens reservados a mais (estimativa > uso real)."""
+        if n_tokens > 0:
+            self._tok = min(self.tpm, self._tok + n_tokens)
+
+
+def estimar_tokens(body: Dict[str, Any], tokens_saida: int = TOKENS_SAIDA_ESTIMADOS) -> int:
+    """Estimativa de tokens da requisição (entrada ~ chars/4 + reserva de saída)."""
+    return len(json.dumps(body, ensure_ascii=False)) // CHARS_POR_TOKEN + tokens_saida
+
+
+def _retry_after(exc: Exception) -> Optional[float]:
+    resp = getattr(exc, "response", None)
+    try:
+        return float(resp.headers.get("retry-after"))
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+
+async def _chamar_com_retry(
+    client,
+    body: Dict[str, Any],
+    limitador: LimitadorTaxa,
+    reserva: int,
+    max_tentativas: int,
+    backoff_base: float,
+    backoff_max: float,
+) -> Tuple[Optional[Dict[str, Any]], int, Optional[str]]:
+    """
+    Retorna (resposta como dict, status_code, erro). Cada tentativa, inclusive
+    as repetições depois de 429/5xx, consome uma requisição e `reserva` tokens
+    do limitador, para que o throttling desacelere o ritmo em vez de furar os
+    limites de RPM/TPM.
+    """
+    status, erro = 0, "nenhuma tentativa feita"
+    for tentativa in range(max_tentativas):
+        await limitador.adquirir(reserva)
+        try:
+            resp = await client.responses.create(**body)
+            return resp.model_dump(), 200, None
+        except openai.APIStatusError as e:
+            status, erro = e.status_code, str(e)
+            if status not in RETRY_STATUS:
+                return None, status, erro
+            espera = _retry_after(e)
+        except (openai.APIConnectionError, openai.APITimeoutError) as e:
+            status, erro, espera = 0, str(e), None
+        if tentativa + 1 < max_tentativas:
+            if espera is None:
+                espera = min(backoff_max, backoff_base * 2 ** tentativa) * random.uniform(0.5, 1.0)
+            await asyncio.sleep(espera)
+    return None, status, erro
+
+
+async def analisar_lote(
+    client,
+    discursos: Iterable[Tuple[int, str]],
+    output_path: Path,
+    model: str = "gpt-5",
+    rpm: int = 500,
+    tpm: int = 500_000,
+    concorrencia: int = 32,
+    max_tentativas: int = 6,
+    backoff_base: float = 1.0,
+    backoff_max: float = 60.0,
+    cache: Optional[sqlite3.Connection] = None,
+) -> Dict[str, int]:
+    """
+    Analisa vários discursos (iterável de (CodigoPronunciamento, texto)) em
+    paralelo e grava uma linha por discurso em `output_path` assim que cada
+    resposta chega. Acertos de cache não chamam a API.
+
+    Retorna contagens {"ok", "falhas", "cache"}.
+    """
+    if max_tentativas < 1:
+        raise ValueError("max_tentativas deve ser >= 1")
+    limitador = LimitadorTaxa(rpm, tpm)
+    sem = asyncio.Semaphore(concorrencia)
+    stats = {"ok": 0, "falhas": 0, "cache": 0}
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+
+    with output_path.open("a", encoding="utf-8") as out:
+
+        def _gravar_linha(custom_id: str, status: int, body: Optional[Dict[str, Any]], erro: Optional[str]):
+            obj = {
+                "custom_id": custom_id,
+                "response": {"status_code": status, "body": body} if body is not None else None,
+                "error": None if erro is None else {"message": erro, "status_code": status},
+            }
+            out.write(json.dumps(obj, ensure_ascii=False) + "\n")
+            out.flush()
+
+        async def _um(codigo: int, texto: str):
+            custom_id = f"disc-{codigo}"
+            body = build_request_body(model=model, discurso=texto)
+            chave = cr.chave_requisicao(body)
+            if cache is not None:
+                resposta = cr.obter(cache, chave)
+                if resposta is not None:
+                    corpo = {
+                        "status": "completed",
+                        "output": [{"type": "message", "content": [{"type": "output_text", "text": resposta}]}],
+                    }
+                    _gravar_linha(custom_id, 200, corpo, None)
+                    stats["cache"] += 1
+                    return
+
+            async with sem:
+                reserva = estimar_tokens(body)
+                resp, status, erro = await _chamar_com_retry(
+                    client, body, limitador, reserva, max_tentativas, backoff_base, backoff_max
+                )
+
+            if resp is None:
+                _gravar_linha(custom_id, status, None, erro)
+                stats["falhas"] += 1
+                return
+
+            usados = (resp.get("usage") or {}).get("total_tokens")
+            if usados is not None:
+                limitador.devolver(reserva - int(usados))
+            _gravar_linha(custom_id, status, resp, None)
+            stats["ok"] += 1
+            if cache is not None and resp.get("status") == "completed":
+                texto_saida = "".join(
+                    c.get("text", "")
+                    for item in resp.get("output") or []
+                    for c in item.get("content") or []
+                    if c.get("type") == "output_text"
+                )
+                if texto_saida:
+                    cr.gravar(cache, chave, texto_saida, model=model)
+
+        # janela limitada de tarefas: não materializa o iterável inteiro
+        pendentes = set()
+        for codigo, texto in discursos:
+            pendentes.add(asyncio.create_task(_um(codigo, texto)))
+            if len(pendentes) >= concorrencia * 4:
+                feitas, pendentes = await asyncio.wait(pendentes, return_when=asyncio.FIRST_COMPLETED)
+                for t in feitas:
+                    t.result()  # propaga exceções inesperadas
+        if pendentes:
+            await asyncio.gather(*pendentes)
+
+    print(f"[OK] Tempo real: {stats} | saída em {output_path}")
+    return stats
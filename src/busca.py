@@ -0,0 +1,228 @@
+# -*- coding: utf-8 -*-
+"""
+Índice de busca textual (SQLite FTS5) sobre os spans e os discursos.
+
+- spans_fts: text, rationale e cues de cada span; o rowid é a posição da
+  linha no Parquet de spans (a mesma ordem em que o dashboard o carrega).
+- discursos_fts: TextoIntegral; o rowid é o CodigoPronunciamento.
+
+As duas tabelas são "contentless" (content=''): o texto já está no Parquet e
+no SQLite dos discursos, o índice guarda só os termos. Tokenização unicode61
+com remove_diacritics (busca sem acento e sem caixa: "acao" acha "Ação") e
+índices de prefixo para consultas do tipo "democ*". O custo de uma consulta
+depende do número de ocorrências do termo, não do tamanho do corpus.
+
+O índice fica ao lado do Parquet ({stem}.fts.sqlite) e registra tamanho e
+mtime do Parquet de origem; se ele mudar, o índice é considerado desatualizado.
+
+Uso:
+    python -m src.busca --spans data/spans_long.parquet --db Amostra_1.sqlite
+"""
+
+from __future__ import annotations
+
+import argparse
+import re
+import sqlite3
+from pathlib import Path
+from typing import Iterable, List, Optional, Tuple
+
+import numpy as np
+import pyarrow.parquet as pq
+
+TOKENIZADOR = "unicode61 remove_diacritics 2"
+PREFIXOS = "2 3 4"
+LOTE = 5_000
+RE_CONSULTA = re.compile(r'"([^"]*)"|(\S+)')
+
+
+def caminho_indice(spans_path: Path) -> Path:
+    spans_path = Path(spans_path)
+    return spans_path.with_name(f"{spans_path.stem}.fts.sqlite")
+
+
+def _assinatura(spans_path: Path) -> Tuple[int, int]:
+    st = Path(spans_path).stat()
+    return st.st_size, st.st_mtime_ns
+
+
+def _criar_tabelas(conn: sqlite3.Connection):
+    conn.executescript(
+        f"""
+        DROP TABLE IF EXISTS spans_fts;
+        DROP TABLE IF EXISTS discursos_fts;
+        DROP TABLE IF EXISTS origem;
+        CREATE VIRTUAL TABLE spans_fts USING fts5(
+            text, rationale, cues,
+            content='', tokenize='{TOKENIZADOR}', prefix='{PREFIXOS}'
+        );
+        CREATE VIRTUAL TABLE discursos_fts USING fts5(
+            TextoIntegral,
+            content='', tokenize='{TOKENIZADOR}', prefix='{PREFIXOS}'
+        );
+        CREATE TABLE origem (spans_path TEXT, n_bytes INTEGER, mtime_ns INTEGER, n_spans INTEGER);
+        """
+    )
+
+
+def _cues_como_texto(cues) -> str:
+    if cues is None:
+        return ""
+    if isinstance(cues, str):
+        return cues
+    return " ; ".join(str(c) for c in cues if c)
+
+
+def construir_indice(
+    spans_path: Path,
+    textos: Optional[Iterable[Tuple[int, str]]] = None,
+    destino: Optional[Path] = None,
+) -> Path:
+    """
+    (Re)constrói o índice a partir do Parquet de spans e, se vier, de um
+    iterável de (CodigoPronunciamento, TextoIntegral). Só os discursos que têm
+    spans são indexados. Grava num arquivo temporário e troca no fim.
+    """
+    spans_path = Path(spans_path)
+    destino = Path(destino or caminho_indice(spans_path))
+    tmp = destino.with_name(destino.name + ".tmp")
+    tmp.unlink(missing_ok=True)
+
+    pf = pq.ParquetFile(spans_path)
+    disponiveis = set(pf.schema_arrow.names)
+    colunas = [c for c in ("CodigoPronunciamento", "text", "rationale", "cues") if c in disponiveis]
+
+    conn = sqlite3.connect(str(tmp))
+    codigos = set()
+    try:
+        _criar_tabelas(conn)
+        rowid = 0
+        for batch in pf.iter_batches(batch_size=LOTE, columns=colunas):
+            cols = {c: batch.column(c).to_pylist() for c in colunas}
+            n = batch.num_rows
+            vazio = [None] * n
+            codigos.update(c for c in cols.get("CodigoPronunciamento", vazio) if c is not None)
+            linhas = [
+                (rowid + i, t or "", r or "", _cues_como_texto(c))
+                for i, (t, r, c) in enumerate(
+                    zip(cols.get("text", vazio), cols.get("rationale", vazio), cols.get("cues", vazio))
+                )
+            ]
+            conn.executemany("INSERT INTO spans_fts(rowid, text, rationale, cues) VALUES (?, ?, ?, ?)", linhas)
+            rowid += n
+
+        n_discursos = 0
+        if textos is not None:
+            lote = []
+            for codigo, texto in textos:
+                if codigo is None or int(codigo) not in codigos or not texto:
+                    continue
+                lote.append((int(codigo), texto))
+                if len(lote) >= LOTE // 10:
+                    conn.executemany("INSERT INTO discursos_fts(rowid, TextoIntegral) VALUES (?, ?)", lote)
+                    n_discursos += len(lote)
+                    lote = []
+            if lote:
+                conn.executemany("INSERT INTO discursos_fts(rowid, TextoIntegral) VALUES (?, ?)", lote)
+                n_discursos += len(lote)
+
+        conn.execute("INSERT INTO spans_fts(spans_fts) VALUES ('optimize')")
+        conn.execute("INSERT INTO discursos_fts(discursos_fts) VALUES ('optimize')")
+        conn.execute("INSERT INTO origem VALUES (?, ?, ?, ?)", (str(spans_path), *_assinatura(spans_path), rowid))
+        conn.commit()
+    finally:
+        conn.close()
+    tmp.replace(destino)
+    print(f"[OK] Índice de busca: {rowid} spans, {n_discursos} discursos -> {destino}")
+    return destino
+
+
+def indice_atualizado(spans_path: Path, destino: Optional[Path] = None) -> bool:
+    """True se o índice existe e foi construído a partir do Parquet atual."""
+    spans_path = Path(spans_path)
+    destino = Path(destino or caminho_indice(spans_path))
+    if not destino.exists() or not spans_path.exists():
+        return False
+    try:
+        conn = sqlite3.connect(str(destino))
+        try:
+            row = conn.execute("SELECT n_bytes, mtime_ns FROM origem").fetchone()
+        finally:
+            conn.close()
+    except sqlite3.DatabaseError:
+        return False
+    return row is not None and tuple(row) == _assinatura(spans_path)
+
+
+def abrir_indice(destino: Path) -> sqlite3.Connection:
+    """Conexão somente leitura, compartilhável entre as threads do Streamlit."""
+    return sqlite3.connect(f"file:{destino}?mode=ro", uri=True, check_same_thread=False)
+
+
+def montar_consulta(q: str) -> str:
+    """
+    Converte a busca do usuário em consulta FTS5: "frases entre aspas" viram
+    frases, termo* vira prefixo, OR é mantido; os demais termos são exigidos
+    todos (AND). Caracteres especiais do FTS5 são neutralizados.
+    """
+    partes: List[str] = []
+    for m in RE_CONSULTA.finditer(q or ""):
+        frase, termo = m.group(1), m.group(2)
+        if frase is not None:
+            frase = frase.strip()
+            if frase:
+                partes.append('"' + frase.replace('"', "") + '"')
+            continue
+        if termo == "OR":
+            if partes and partes[-1] != "OR":
+                partes.append("OR")
+            continue
+        prefixo = termo.endswith("*")
+        limpo = termo.rstrip("*").replace('"', "")
+        if limpo:
+            partes.append('"' + limpo + '"' + ("*" if prefixo else ""))
+    while partes and partes[-1] == "OR":
+        partes.pop()
+    return " ".join(partes)
+
+
+def buscar_spans(conn: sqlite3.Connection, q: str, limite: int = -1) -> np.ndarray:
+    """Posições (rowid) dos spans que casam com `q`, da mais para a menos relevante (bm25)."""
+    consulta = montar_consulta(q)
+    if not consulta:
+        return np.empty(0, dtype=np.int64)
+    cur = conn.execute(
+        "SELECT rowid FROM spans_fts WHERE spans_fts MATCH ? ORDER BY rank LIMIT ?", (consulta, limite)
+    )
+    return np.fromiter((r[0] for r in cur), dtype=np.int64)
+
+
+def buscar_discursos(conn: sqlite3.Connection, q: str, limite: int = -1) -> np.ndarray:
+    """CodigoPronunciamento dos discursos que casam com `q`, por relevância (bm25)."""
+    consulta = montar_consulta(q)
+    if not consulta:
+        return np.empty(0, dtype=np.int64)
+    cur = conn.execute(
+        "SELECT rowid FROM discursos_fts WHERE discursos_fts MATCH ? ORDER BY rank LIMIT ?", (consulta, limite)
+    )
+    return np.fromiter((r[0] for r in cur), dtype=np.int64)
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Constrói o índice FTS5 de spans e discursos.")
+    ap.add_argument("--spans", default="data/spans_long.parquet", help="Parquet de spans")
+    ap.add_argument("--db", default="Amostra_1.sqlite", help="SQLite com os discursos (TextoIntegral)")
+    ap.add_argument("--table", default="DiscursosAmostra", help="Tabela com TextoIntegral")
+    ap.add_argument("--out", default=None, help="Arquivo do índice (padrão: {stem}.fts.sqlite ao lado do Parquet)")
+    args = ap.parse_args()
+
+    textos = None
+    db = Path(args.db)
+    if db.exists():
+        conn = sqlite3.connect(str(db))
+        textos = conn.execute(f"SELECT CodigoPronunciamento, TextoIntegral FROM {args.table}")
+    construir_indice(Path(args.spans), textos, Path(args.out) if args.out else None)
+
+
+if __name__ == "__main__":
+    main()
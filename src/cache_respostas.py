@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+"""
+Cache local (SQLite) das respostas do modelo, endereçado pelo conteúdo da
+requisição: a chave é o hash do body (modelo, prompt do desenvolvedor, schema,
+parâmetros e texto do discurso). Guarda o output_text (JSON com os spans).
+
+Quando o cache passa de `max_bytes`, as entradas acessadas há mais tempo são
+removidas até voltar a 90% do limite.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import sqlite3
+import time
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+PATH_CACHE = Path("data/cache_respostas.sqlite")
+CACHE_MAX_BYTES = 2 * 1024 ** 3  # 2 GiB
+
+
+def chave_requisicao(body: Dict[str, Any]) -> str:
+    """
+    Hash do body canônico. `store` não altera a resposta e fica de fora;
+    qualquer outra mudança (modelo, prompt, schema, esforço, texto) gera outra chave.
+    """
+    canon = {k: v for k, v in body.items() if k != "store"}
+    raw = json.dumps(canon, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def abrir_cache(path: Path = PATH_CACHE) -> sqlite3.Connection:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(str(path))
+    conn.execute("PRAGMA journal_mode=WAL;")
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS respostas (
+            chave TEXT PRIMARY KEY,
+            model TEXT,
+            resposta TEXT NOT NULL,
+            n_bytes INTEGER NOT NULL,
+            criado_em REAL NOT NULL,
+            acessado_em REAL NOT NULL
+        )
+        """
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_respostas_acesso ON respostas(acessado_em);")
+    conn.commit()
+    return conn
+
+
+def obter(conn: sqlite3.Connection, chave: str) -> Optional[str]:
+    """Retorna o output_text em cache (ou None) e marca o acesso."""
+    row = conn.execute("SELECT resposta FROM respostas WHERE chave = ?", (chave,)).fetchone()
+    if row is None:
+        return None
+    conn.execute("UPDATE respostas SET acessado_em = ? WHERE chave = ?", (time.time(), chave))
+    conn.commit()
+    return row[0]
+
+
+def gravar(
+    conn: sqlite3.Connection,
+    chave: str,
+    resposta: str,
+    model: Optional[str] = None,
+    max_bytes: int = CACHE_MAX_BYTES,
+    commit: bool = True,
+) -> None:
+    agora = time.time()
+    conn.execute(
+        """
+        INSERT INTO respostas (chave, model, resposta, n_bytes, criado_em, acessado_em)
+        VALUES (?, ?, ?, ?, ?, ?)
+        ON CONFLICT (chave) DO UPDATE SET
+            resposta = excluded.resposta,
+            n_bytes = excluded.n_bytes,
+            acessado_em = excluded.acessado_em
+        """,
+        (chave, model, resposta, len(resposta.encode("utf-8")), agora, agora),
+    )
+    if commit:
+        conn.commit()
+        despejar(conn, max_bytes)
+
+
+def tamanho(conn: sqlite3.Connection) -> int:
+    return int(conn.execute("SELECT COALESCE(SUM(n_bytes), 0) FROM respostas").fetchone()[0])
+
+
+def despejar(conn: sqlite3.Connection, max_bytes: int = CACHE_MAX_BYTES) -> int:
+    """
+    Remove as entradas menos recentemente acessadas enquanto o total passar
+    de `max_bytes`, até ficar em 90% do limite. Retorna quantas removeu.
+    """
+    total = tamanho(conn)
+    if total <= max_bytes:
+        return 0
+    alvo = int(max_bytes * 0.9)
+    removidas = []
+    cur = conn.execute("SELECT chave, n_bytes FROM respostas ORDER BY acessado_em ASC")
+    for chave, n_bytes in cur:
+        if total <= alvo:
+            break
+        removidas.append((chave,))
+        total -= n_bytes
+    conn.executemany("DELETE FROM respostas WHERE chave = ?", removidas)
+    conn.commit()
+    return len(removidas)
@@ -0,0 +1,203 @@
+# -*- coding: utf-8 -*-
+"""
+Calibração empírica de tokens de saída e de tempo a partir de batches já
+baixados.
+
+Fontes (em data/batch_figuras e nos diretórios de run):
+- {batch_id}_output.jsonl: o campo `usage` de cada resposta (input_tokens,
+  cached_tokens, output_tokens, reasoning_tokens);
+- {batch_id}_batch.json: o objeto do batch gravado no download, com os
+  timestamps in_progress_at / completed_at.
+
+Modelos ajustados:
+- saída por faixa de tamanho da entrada (FAIXAS_ENTRADA, em tokens de
+  entrada): média, p50 e p90 de output_tokens (o reasoning já está incluído),
+  fração média de reasoning e de entrada em cache;
+- tempo de batch: duracao_s = overhead_s + tokens_saida * s_por_token_saida,
+  ajustado por mínimos quadrados sobre os batches com timestamps (com menos
+  de 3 batches, só a razão total, sem overhead). Os timestamps são por batch,
+  então o modelo de tempo é um só para todas as faixas.
+
+O resultado fica em data/batch_figuras/calibracao.json e é usado por
+src/orcamento.sample_discursos_by_year (calibration=...) e pelo
+empacotamento do batch_figuras (--calibracao) para prever custo e duração.
+
+Uso:
+    python -m src.calibracao --dir data/batch_figuras
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional
+
+import numpy as np
+import pandas as pd
+
+FAIXAS_ENTRADA = [0, 1_000, 2_000, 4_000, 8_000, 16_000, 32_000]
+PATH_CALIBRACAO = Path("data/batch_figuras/calibracao.json")
+MIN_AMOSTRAS_FAIXA = 20  # abaixo disso a faixa usa a média geral
+
+
+def _usage(obj: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    body = ((obj.get("response") or {}).get("body")) or {}
+    usage = body.get("usage")
+    if not usage:
+        return None
+    return {
+        "custom_id": obj.get("custom_id"),
+        "input_tokens": int(usage.get("input_tokens") or 0),
+        "cached_tokens": int((usage.get("input_tokens_details") or {}).get("cached_tokens") or 0),
+        "output_tokens": int(usage.get("output_tokens") or 0),
+        "reasoning_tokens": int((usage.get("output_tokens_details") or {}).get("reasoning_tokens") or 0),
+    }
+
+
+def ler_usos(output_jsonl: Path) -> pd.DataFrame:
+    """Uma linha por resposta com `usage` (respostas do cache e erros não têm)."""
+    linhas = []
+    with Path(output_jsonl).open("r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                u = _usage(json.loads(line))
+            except json.JSONDecodeError:
+                continue
+            if u is not None:
+                linhas.append(u)
+    df = pd.DataFrame(linhas, columns=["custom_id", "input_tokens", "cached_tokens", "output_tokens", "reasoning_tokens"])
+    df["batch_id"] = Path(output_jsonl).name.removesuffix("_output.jsonl")
+    return df
+
+
+def ler_batch(meta_json: Path) -> Optional[Dict[str, Any]]:
+    """id e duração (s) de um batch concluído; None sem timestamps."""
+    b = json.loads(Path(meta_json).read_text(encoding="utf-8"))
+    inicio = b.get("in_progress_at") or b.get("created_at")
+    fim = b.get("completed_at")
+    if b.get("status") != "completed" or not inicio or not fim:
+        return None
+    return {"batch_id": b["id"], "duracao_s": float(fim - inicio)}
+
+
+def _outputs(dirs: Iterable[Path]) -> List[Path]:
+    paths = []
+    for d in dirs:
+        paths += [p for p in Path(d).rglob("*_output.jsonl") if not p.name.endswith("_cache_output.jsonl")]
+    return sorted(set(paths))
+
+
+def faixa(tokens_entrada) -> np.ndarray:
+    """Índice da faixa de FAIXAS_ENTRADA de cada valor."""
+    return np.searchsorted(FAIXAS_ENTRADA, np.asarray(tokens_entrada), side="right") - 1
+
+
+def calibrar(dirs: Iterable[Path]) -> Dict[str, Any]:
+    """Lê os outputs/batches em `dirs` (recursivamente) e ajusta os modelos."""
+    dirs = list(dirs)
+    outputs = _outputs(dirs)
+    if not outputs:
+        raise FileNotFoundError(f"Nenhum *_output.jsonl em {', '.join(map(str, dirs))}")
+    usos = pd.concat([ler_usos(p) for p in outputs], ignore_index=True)
+    if usos.empty:
+        raise ValueError("Os outputs não trazem o campo usage.")
+
+    usos["faixa"] = faixa(usos["input_tokens"])
+    media_geral = float(usos["output_tokens"].mean())
+    faixas = []
+    for k, ini in enumerate(FAIXAS_ENTRADA):
+        g = usos.loc[usos["faixa"] == k]
+        fim = FAIXAS_ENTRADA[k + 1] if k + 1 < len(FAIXAS_ENTRADA) else None
+        item: Dict[str, Any] = {"entrada_min": ini, "entrada_max": fim, "n": int(len(g))}
+        if len(g):
+            item.update(
+                saida_media=float(g["output_tokens"].mean()),
+                saida_p50=float(g["output_tokens"].quantile(0.5)),
+                saida_p90=float(g["output_tokens"].quantile(0.9)),
+                fracao_reasoning=float(g["reasoning_tokens"].sum() / max(g["output_tokens"].sum(), 1)),
+                fracao_cache=float(g["cached_tokens"].sum() / max(g["input_tokens"].sum(), 1)),
+            )
+        faixas.append(item)
+
+    # tempo: uma observação por batch com timestamps
+    metas = []
+    for d in dirs:
+        metas += [m for m in (ler_batch(p) for p in Path(d).rglob("*_batch.json")) if m is not None]
+    por_batch = usos.groupby("batch_id").agg(tokens_saida=("output_tokens", "sum"), tokens_entrada=("input_tokens", "sum"))
+    tempos = pd.DataFrame(metas, columns=["batch_id", "duracao_s"]).drop_duplicates("batch_id")
+    tempos = tempos.join(por_batch, on="batch_id", how="inner")
+    tempo: Dict[str, Any] = {"n_batches": int(len(tempos))}
+    if len(tempos):
+        x, y = tempos["tokens_saida"].to_numpy(float), tempos["duracao_s"].to_numpy(float)
+        overhead, inclinacao = 0.0, float(y.sum() / max(x.sum(), 1.0))
+        if len(tempos) >= 3 and np.ptp(x) > 0:
+            b, a = np.polyfit(x, y, 1)
+            if b > 0 and a >= 0:
+                overhead, inclinacao = float(a), float(b)
+        tempo.update(overhead_s=overhead, s_por_token_saida=inclinacao)
+
+    return {
+        "n_respostas": int(len(usos)),
+        "n_outputs": len(outputs),
+        "saida_media_geral": media_geral,
+        "faixas": faixas,
+        "tempo": tempo,
+    }
+
+
+def gravar(cal: Dict[str, Any], destino: Path = PATH_CALIBRACAO) -> Path:
+    destino = Path(destino)
+    destino.parent.mkdir(parents=True, exist_ok=True)
+    destino.write_text(json.dumps(cal, ensure_ascii=False, indent=2), encoding="utf-8")
+    return destino
+
+
+def carregar(cal) -> Dict[str, Any]:
+    """Aceita o dict da calibração ou o caminho do JSON."""
+    if isinstance(cal, dict):
+        return cal
+    return json.loads(Path(cal).read_text(encoding="utf-8"))
+
+
+def prever_saida(cal: Dict[str, Any], tokens_entrada, estatistica: str = "saida_media") -> np.ndarray:
+    """
+    Tokens de saída previstos para cada requisição, pela faixa do seu tamanho
+    de entrada. Faixas com menos de MIN_AMOSTRAS_FAIXA respostas usam a média
+    geral. `estatistica`: saida_media, saida_p50 ou saida_p90 (reserva).
+    """
+    tabela = np.array([
+        f[estatistica] if f["n"] >= MIN_AMOSTRAS_FAIXA and estatistica in f else cal["saida_media_geral"]
+        for f in cal["faixas"]
+    ])
+    return np.rint(tabela[faixa(tokens_entrada)]).astype(np.int64)
+
+
+def prever_duracao(cal: Dict[str, Any], tokens_saida: float) -> Optional[float]:
+    """Duração prevista (s) de um batch com `tokens_saida` tokens de saída."""
+    tempo = cal.get("tempo") or {}
+    if "s_por_token_saida" not in tempo:
+        return None
+    return tempo["overhead_s"] + tempo["s_por_token_saida"] * float(tokens_saida)
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Calibra tokens de saída e tempo a partir de batches baixados.")
+    ap.add_argument("--dir", action="append", default=None, help="Diretório com *_output.jsonl e *_batch.json (repetível)")
+    ap.add_argument("--out", default=str(PATH_CALIBRACAO), help="JSON da calibração")
+    args = ap.parse_args()
+
+    cal = calibrar([Path(d) for d in (args.dir or ["data/batch_figuras"])])
+    destino = gravar(cal, Path(args.out))
+    for f in cal["faixas"]:
+        if f["n"]:
+            fim = f["entrada_max"] if f["entrada_max"] is not None else "∞"
+            print(f"[INFO] entrada {f['entrada_min']}–{fim}: n={f['n']}, saída média {f['saida_media']:.0f}, p90 {f['saida_p90']:.0f}")
+    t = cal["tempo"]
+    if "s_por_token_saida" in t:
+        print(f"[INFO] tempo: {t['overhead_s']:.0f}s + {t['s_por_token_saida'] * 1000:.2f}s/1000 tokens de saída ({t['n_batches']} batches)")
+    print(f"[OK] Calibração ({cal['n_respostas']} respostas) -> {destino}")
+
+
+if __name__ == "__main__":
+    main()
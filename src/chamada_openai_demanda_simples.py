@@ -1,42 +1,44 @@
 from src.login_openai import login
-from src.structured_outputs import schema
+from src.requisicao import build_request_body
+from src import cache_respostas as cr
 import json
+from types import SimpleNamespace
 
-client = login()
-
-def analisar_figuras(discurso):
-    response = client.responses.create(
-      model="gpt-5",
-      input=[
-        {
-          "role": "developer",
-          "content": [
-            {
-              "type": "input_text",
-              "text": "Você é um linguista que analisa figuras de linguagem em discursos no Senado."
-            }
-          ]
-        },
-        {
-          "role": "user",
-          "content": [
-            {
-              "type": "input_text",
-              "text": f"Analise a seguinte fala:\n\n{discurso}"
-            }
-          ]
-        }
-      ],
-      text={
-        "format": schema,
-        "verbosity": "medium"
-      },
-      reasoning={
-        "effort": "medium"
-      },
-      tools=[],
-      store=True
-    )
+_client = None
+
+def get_client():
+    """Cria o client na primeira chamada (importar o módulo não exige API key)."""
+    global _client
+    if _client is None:
+        _client = login()
+    return _client
+
+def analisar_figuras(discurso, model="gpt-5", usar_cache=True):
+    """
+    Analisa um discurso com a Responses API.
+    Consulta antes o cache local (src/cache_respostas.py); em caso de acerto,
+    devolve um objeto com `output_text` (e `cached=True`) sem chamar a API.
+    """
+    body = build_request_body(model=model, discurso=discurso)
+    chave = cr.chave_requisicao(body)
+
+    if usar_cache:
+        conn = cr.abrir_cache()
+        try:
+            cached = cr.obter(conn, chave)
+        finally:
+            conn.close()
+        if cached is not None:
+            return SimpleNamespace(output_text=cached, cached=True)
+
+    response = get_client().responses.create(**body)
+
+    if usar_cache and response.status == "completed":
+        conn = cr.abrir_cache()
+        try:
+            cr.gravar(conn, chave, response.output_text, model=model)
+        finally:
+            conn.close()
 
     return response
 
@@ -45,4 +47,4 @@ def obter_resposta(response) -> list:
   raw = response.output_text
   data = json.loads(raw)  # dict em Python
   spans = data["spans"]
-  return spans
\ No newline at end of file
+  return spans
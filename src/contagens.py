@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+"""
+Contagens por discurso (palavras, caracteres e tokens) calculadas uma vez e
+guardadas numa tabela lateral indexada, no próprio SQLite dos discursos:
+
+    ContagensDiscursos(CodigoPronunciamento PK, n_palavras, n_chars, n_tokens)
+    índice (n_palavras, CodigoPronunciamento)
+
+- n_palavras é exata: len(texto.split()), o mesmo critério do resto do
+  projeto (espaços, quebras de linha e tabulações repetidos não contam).
+- A atualização é incremental: só são contados os discursos sem linha na
+  tabela lateral (anti-join pela chave primária, sem ler o TextoIntegral); os
+  tokens (tiktoken) são opcionais e podem ser preenchidos depois.
+- Um gatilho na tabela dos discursos apaga a linha de contagem de todo
+  discurso cujo TextoIntegral é alterado (ou que é removido), então os textos
+  reescritos pela limpeza (src/limpar_textos.py) voltam ao anti-join e são
+  recontados na próxima atualização. Alterações feitas antes de o gatilho
+  existir exigem --recontar.
+- Com a tabela pronta, "discursos com mais de N palavras" vira uma varredura
+  de intervalo no índice, sem tocar no TextoIntegral.
+
+Uso:
+    python -m src.contagens --db data/Discursos.sqlite
+"""
+
+from __future__ import annotations
+
+import argparse
+import sqlite3
+from pathlib import Path
+from typing import Iterable, List, Optional, Tuple
+
+TBL_CONTAGENS = "ContagensDiscursos"
+LOTE = 2_000
+
+
+def garantir_tabela(conn: sqlite3.Connection, table: Optional[str] = None) -> None:
+    """Cria a tabela lateral e, com `table`, os gatilhos que invalidam as contagens de textos alterados."""
+    conn.execute(
+        f"""
+        CREATE TABLE IF NOT EXISTS {TBL_CONTAGENS} (
+            CodigoPronunciamento INTEGER PRIMARY KEY,
+            n_palavras INTEGER NOT NULL,
+            n_chars INTEGER NOT NULL,
+            n_tokens INTEGER
+        )
+        """
+    )
+    conn.execute(
+        f"CREATE INDEX IF NOT EXISTS idx_contagens_palavras ON {TBL_CONTAGENS}(n_palavras, CodigoPronunciamento);"
+    )
+    if table is not None:
+        conn.execute(
+            f"""
+            CREATE TRIGGER IF NOT EXISTS trg_contagens_{table}_update
+            AFTER UPDATE OF TextoIntegral, CodigoPronunciamento ON {table}
+            BEGIN
+                DELETE FROM {TBL_CONTAGENS}
+                WHERE CodigoPronunciamento IN (OLD.CodigoPronunciamento, NEW.CodigoPronunciamento);
+            END
+            """
+        )
+        conn.execute(
+            f"""
+            CREATE TRIGGER IF NOT EXISTS trg_contagens_{table}_delete
+            AFTER DELETE ON {table}
+            BEGIN
+                DELETE FROM {TBL_CONTAGENS} WHERE CodigoPronunciamento = OLD.CodigoPronunciamento;
+            END
+            """
+        )
+    conn.commit()
+
+
+def contar(texto: Optional[str]) -> Tuple[int, int]:
+    """(palavras, caracteres) de um texto."""
+    texto = texto or ""
+    return len(texto.split()), len(texto)
+
+
+def _encoding(model: str):
+    # tiktoken só é necessário quando os tokens são contados
+    from src.orcamento import _get_encoding
+
+    return _get_encoding(model)
+
+
+def _contar_lote(linhas: List[Tuple[int, Optional[str]]], enc) -> List[Tuple[int, int, int, Optional[int]]]:
+    textos = [t or "" for _, t in linhas]
+    tokens: Iterable[Optional[int]]
+    if enc is not None:
+        tokens = [len(ids) for ids in enc.encode_ordinary_batch(textos)]
+    else:
+        tokens = [None] * len(textos)
+    return [
+        (cod, *contar(texto), n_tok)
+        for (cod, _), texto, n_tok in zip(linhas, textos, tokens)
+    ]
+
+
+def atualizar_contagens(
+    conn: sqlite3.Connection,
+    table: str = "Discursos",
+    lote: int = LOTE,
+    recontar: bool = False,
+    com_tokens: bool = True,
+    model: str = "gpt-5",
+) -> int:
+    """
+    Conta os discursos de `table` que ainda não estão em ContagensDiscursos
+    (todos, com recontar=True; com com_tokens=True, também os contados antes
+    sem tokens) e remove as linhas de discursos que sumiram. Os textos
+    alterados entram aqui porque o gatilho de garantir_tabela apagou a
+    contagem deles.
+    Retorna quantos discursos foram contados.
+    """
+    garantir_tabela(conn, table)
+    if recontar:
+        conn.execute(f"DELETE FROM {TBL_CONTAGENS}")
+    conn.execute(
+        f"DELETE FROM {TBL_CONTAGENS} WHERE CodigoPronunciamento NOT IN"
+        f" (SELECT CodigoPronunciamento FROM {table})"
+    )
+    faltando = [
+        r[0]
+        for r in conn.execute(
+            f"""
+            SELECT d.CodigoPronunciamento
+            FROM {table} d
+            LEFT JOIN {TBL_CONTAGENS} c ON c.CodigoPronunciamento = d.CodigoPronunciamento
+            WHERE d.CodigoPronunciamento IS NOT NULL
+              AND (
+                c.CodigoPronunciamento IS NULL
+                OR (? AND c.n_tokens IS NULL)
+              )
+            """,
+            (int(com_tokens),),
+        )
+    ]
+    if not faltando:
+        conn.commit()
+        return 0
+
+    enc = _encoding(model) if com_tokens else None
+    n = 0
+    for i in range(0, len(faltando), lote):
+        parte = faltando[i : i + lote]
+        ph = ",".join("?" for _ in parte)
+        linhas = conn.execute(
+            f"SELECT CodigoPronunciamento, TextoIntegral FROM {table} WHERE CodigoPronunciamento IN ({ph})",
+            parte,
+        ).fetchall()
+        conn.executemany(
+            f"INSERT OR REPLACE INTO {TBL_CONTAGENS} VALUES (?, ?, ?, ?)",
+            _contar_lote(linhas, enc),
+        )
+        conn.commit()
+        n += len(linhas)
+        print(f"[INFO] Contagens: {n:,}/{len(faltando):,} discursos")
+    print(f"[OK] Contagens atualizadas em {TBL_CONTAGENS}: {n:,} discursos")
+    return n
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Calcula (incrementalmente) palavras/caracteres/tokens por discurso.")
+    ap.add_argument("--db", default="data/Discursos.sqlite", help="SQLite com os discursos")
+    ap.add_argument("--table", default="Discursos", help="Tabela com TextoIntegral")
+    ap.add_argument("--recontar", action="store_true", help="Recalcula tudo (textos alterados antes do gatilho)")
+    ap.add_argument("--sem-tokens", action="store_true", help="Não conta tokens (dispensa tiktoken)")
+    ap.add_argument("--model", default="gpt-5", help="Modelo cujo encoding conta os tokens")
+    args = ap.parse_args()
+
+    conn = sqlite3.connect(str(Path(args.db)))
+    try:
+        atualizar_contagens(conn, args.table, recontar=args.recontar, com_tokens=not args.sem_tokens, model=args.model)
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
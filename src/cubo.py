@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+"""
+Cubo de densidade pré-agregado para os gráficos do dashboard.
+
+Grão: dia (Data) × label × partido × orador × faixa de confiança (conf_bin,
+passos de 0,05 como o slider de "Confiança mínima"), com as medidas:
+- n_spans: quantidade de spans;
+- peso: soma de 1000/tamanho_discurso_palavras (spans por 1000 palavras);
+- palavras: soma de tamanho_discurso_palavras dos discursos distintos da
+  célula (não é aditiva entre labels/faixas: um discurso aparece em várias).
+
+Os filtros de label/orador/partido/período/confiança são respondidos
+filtrando e somando o cubo (`rolar`), cujo tamanho depende do número de
+combinações distintas, não do número de spans. A busca textual não cabe no
+cubo: com `q` o dashboard agrega os spans filtrados.
+
+O cubo fica ao lado do Parquet de spans ({stem}.cubo.parquet), com tamanho e
+mtime do Parquet de origem nos metadados do arquivo.
+
+Uso:
+    python -m src.cubo --spans data/spans_long.parquet --db Amostra_1.sqlite
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import sqlite3
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+PASSOS_CONFIANCA = 20  # faixas de 0,05
+DIMENSOES = ["Data", "ano_mes", "label", "SiglaPartidoParlamentarNaData", "NomeParlamentar", "conf_bin"]
+CHAVE_ORIGEM = b"origem"
+
+
+def caminho_cubo(spans_path: Path) -> Path:
+    spans_path = Path(spans_path)
+    return spans_path.with_name(f"{spans_path.stem}.cubo.parquet")
+
+
+def _assinatura(spans_path: Path) -> Dict[str, int]:
+    st = Path(spans_path).stat()
+    return {"n_bytes": st.st_size, "mtime_ns": st.st_mtime_ns}
+
+
+def faixa_confianca(conf: pd.Series) -> pd.Series:
+    """Índice da faixa de 0,05 (0..20); -1 sem confiança."""
+    c = pd.to_numeric(conf, errors="coerce").to_numpy(dtype="float64")
+    faixa = np.floor(np.clip(c, 0.0, 1.0) * PASSOS_CONFIANCA + 1e-9)
+    return pd.Series(np.where(np.isnan(c), -1, faixa).astype("int8"), index=conf.index)
+
+
+def construir_cubo(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Agrega o DataFrame de spans já juntado aos metadados (Data, orador,
+    partido, tamanho_discurso_palavras) no grão do cubo.
+    """
+    df = df.copy()
+    df["Data"] = pd.to_datetime(df.get("Data")).dt.normalize()
+    df["ano_mes"] = df["Data"].dt.to_period("M").astype(str)
+    for col in ("label", "SiglaPartidoParlamentarNaData", "NomeParlamentar"):
+        if col not in df:
+            df[col] = None
+    # mesmo peso de utils.to_density (sem metadados -> NaN, ignorado nas somas)
+    palavras = pd.to_numeric(df.get("tamanho_discurso_palavras", 1), errors="coerce").clip(lower=1)
+    df["palavras"] = palavras
+    df["peso"] = 1000 / palavras
+    df["conf_bin"] = faixa_confianca(df.get("confidence", pd.Series(np.nan, index=df.index)))
+
+    grupos = df.groupby(DIMENSOES, observed=True, dropna=False, sort=False)
+    cubo = grupos.agg(n_spans=("peso", "size"), peso=("peso", "sum"))
+    distintos = df.drop_duplicates(DIMENSOES + ["CodigoPronunciamento"])
+    cubo["palavras"] = distintos.groupby(DIMENSOES, observed=True, dropna=False, sort=False)["palavras"].sum()
+    cubo = cubo.reset_index()
+    for col in ("ano_mes", "label", "SiglaPartidoParlamentarNaData", "NomeParlamentar"):
+        cubo[col] = cubo[col].astype("category")
+    cubo["n_spans"] = cubo["n_spans"].astype("int32")
+    cubo["peso"] = cubo["peso"].astype("float64")
+    cubo["palavras"] = cubo["palavras"].fillna(0).astype("int64")
+    return cubo
+
+
+def metadados_sqlite(db_path: Path, table: str, codigos: Iterable[int], lote: int = 500) -> pd.DataFrame:
+    """Data, orador, partido e tamanho em palavras dos discursos pedidos."""
+    codigos = list(codigos)
+    conn = sqlite3.connect(str(db_path))
+    partes = []
+    try:
+        for i in range(0, len(codigos), lote):
+            parte = codigos[i : i + lote]
+            ph = ",".join("?" for _ in parte)
+            cur = conn.execute(
+                "SELECT CodigoPronunciamento, DataPronunciamento, NomeParlamentar,"
+                f" SiglaPartidoParlamentarNaData, TextoIntegral FROM {table}"
+                f" WHERE CodigoPronunciamento IN ({ph})",
+                parte,
+            )
+            partes.extend(
+                (c, d, n, s, len((t or "").split())) for c, d, n, s, t in cur
+            )
+    finally:
+        conn.close()
+    return pd.DataFrame(
+        partes,
+        columns=["CodigoPronunciamento", "Data", "NomeParlamentar", "SiglaPartidoParlamentarNaData", "tamanho_discurso_palavras"],
+    )
+
+
+def gravar_cubo(cubo: pd.DataFrame, spans_path: Path, destino: Optional[Path] = None) -> Path:
+    """Grava o cubo com a assinatura do Parquet de spans de origem."""
+    destino = Path(destino or caminho_cubo(spans_path))
+    tabela = pa.Table.from_pandas(cubo, preserve_index=False)
+    meta = dict(tabela.schema.metadata or {})
+    meta[CHAVE_ORIGEM] = json.dumps(_assinatura(spans_path)).encode()
+    tmp = destino.with_name(destino.name + ".tmp")
+    pq.write_table(tabela.replace_schema_metadata(meta), tmp)
+    tmp.replace(destino)
+    print(f"[OK] Cubo de densidade: {len(cubo)} células -> {destino}")
+    return destino
+
+
+def cubo_atualizado(spans_path: Path, destino: Optional[Path] = None) -> bool:
+    """True se o cubo existe e foi gerado a partir do Parquet de spans atual."""
+    spans_path = Path(spans_path)
+    destino = Path(destino or caminho_cubo(spans_path))
+    if not destino.exists() or not spans_path.exists():
+        return False
+    meta = pq.read_schema(destino).metadata or {}
+    try:
+        return json.loads(meta.get(CHAVE_ORIGEM, b"{}")) == _assinatura(spans_path)
+    except ValueError:
+        return False
+
+
+def atende(f: Dict[str, Any]) -> bool:
+    """O cubo responde ao filtro? (sem busca textual e confiança em passos de 0,05)"""
+    if f.get("q"):
+        return False
+    passos = float(f.get("conf_min") or 0.0) * PASSOS_CONFIANCA
+    return abs(passos - round(passos)) < 1e-6
+
+
+def rolar(cubo: pd.DataFrame, f: Dict[str, Any], dims: List[str]) -> pd.DataFrame:
+    """Filtra o cubo como apply_filters e soma as medidas por `dims`."""
+    mask = np.ones(len(cubo), dtype=bool)
+    for chave, col in (("labels", "label"), ("oradores", "NomeParlamentar"), ("partidos", "SiglaPartidoParlamentarNaData")):
+        if f.get(chave):
+            mask &= cubo[col].isin(f[chave]).to_numpy()
+    if f.get("conf_min") is not None:
+        mask &= cubo["conf_bin"].to_numpy() >= round(float(f["conf_min"]) * PASSOS_CONFIANCA)
+    if f.get("data_ini") and f.get("data_fim"):
+        datas = cubo["Data"]
+        mask &= ((datas >= pd.Timestamp(f["data_ini"])) & (datas <= pd.Timestamp(f["data_fim"]))).to_numpy()
+    return cubo.loc[mask].groupby(dims, as_index=False, observed=True)[["n_spans", "peso"]].sum()
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Constrói o cubo de densidade a partir do Parquet de spans.")
+    ap.add_argument("--spans", default="data/spans_long.parquet", help="Parquet de spans")
+    ap.add_argument("--db", default="Amostra_1.sqlite", help="SQLite com os metadados dos discursos")
+    ap.add_argument("--table", default="DiscursosAmostra", help="Tabela dos discursos")
+    ap.add_argument("--out", default=None, help="Parquet do cubo (padrão: {stem}.cubo.parquet ao lado dos spans)")
+    args = ap.parse_args()
+
+    spans = pd.read_parquet(args.spans, columns=["CodigoPronunciamento", "label", "confidence"])
+    codigos = sorted(int(c) for c in spans["CodigoPronunciamento"].dropna().unique())
+    meta = metadados_sqlite(Path(args.db), args.table, codigos)
+    df = spans.merge(meta, on="CodigoPronunciamento", how="left")
+    gravar_cubo(construir_cubo(df), Path(args.spans), Path(args.out) if args.out else None)
+
+
+if __name__ == "__main__":
+    main()
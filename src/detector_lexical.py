@@ -0,0 +1,293 @@
+# -*- coding: utf-8 -*-
+"""
+Detector local (sem modelo) das figuras que dependem sobretudo da superfície
+do texto:
+
+- anafora: 3+ frases/orações seguidas começando pela mesma palavra (ou pelas
+  mesmas duas, quando a primeira é artigo/preposição/conjunção);
+- pergunta_retórica: frases interrogativas (mais confiança em séries de
+  perguntas);
+- aliteracao: 4+ palavras de conteúdo seguidas (3+ diferentes), na mesma
+  frase, com o mesmo fonema consonantal inicial (ch/x, c/qu/k, ce/ci/s,
+  ge/gi/j...);
+- assonancia: 7+ palavras de conteúdo seguidas, na mesma frase, com a mesma
+  vogal tônica (acento gráfico ou regra de paroxítona/oxítona).
+
+Os spans saem no formato do schema (label, start_char, end_char, text,
+rationale, cues, confidence) com offsets exatos no TextoIntegral. Os
+discursos são processados num pool de processos, lote a lote.
+
+No batch_figuras (--pre-detector) essas figuras saem do enum do schema
+enviado ao modelo (menos tokens de saída) e os spans locais entram na
+consolidação; com --pular-sem-achados, discursos sem nenhum achado local não
+são enviados.
+
+Uso:
+    python -m src.detector_lexical --db Amostra_1.sqlite --out data/batch_figuras/lexical_spans.parquet
+"""
+
+from __future__ import annotations
+
+import argparse
+import re
+import sqlite3
+import unicodedata
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+import numpy as np
+import pandas as pd
+
+LABELS_LOCAIS = ("anafora", "aliteracao", "assonancia", "pergunta_retórica")
+MIN_ANAFORA = 3
+MIN_ALITERACAO = 4
+MIN_ASSONANCIA = 7
+MIN_DISTINTAS = 3  # palavras diferentes numa corrida de aliteração/assonância
+LOTE = 2_000
+PATH_SPANS_LEXICAIS = Path("data/batch_figuras/lexical_spans.parquet")
+
+RE_FRASE = re.compile(r"[^.!?;:\n]+[.!?;:]*")
+RE_PALAVRA = re.compile(r"[^\W\d_]+", re.UNICODE)
+FUNCIONAIS = frozenset(
+    "o a os as um uma uns umas e ou mas de do da dos das em no na nos nas ao aos à às por pelo pela pelos pelas "
+    "para com sem que se não nem como mais já há é foi ser ter está isso isto esse essa este esta seu sua "
+    "seus suas meu minha nosso nossa lhe lhes eles elas ele ela".split()
+)
+ACENTOS = {"á": "a", "â": "a", "à": "a", "ã": "ã", "é": "e", "ê": "e", "í": "i", "ó": "o", "ô": "o", "õ": "õ", "ú": "u"}
+OXITONAS = ("r", "l", "z", "x", "i", "u", "im", "um", "is", "us", "ins", "uns")
+
+
+def _sem_acento(w: str) -> str:
+    return "".join(c for c in unicodedata.normalize("NFD", w) if unicodedata.category(c) != "Mn")
+
+
+@lru_cache(maxsize=65_536)
+def fonema_inicial(w: str) -> Optional[str]:
+    """Fonema consonantal inicial aproximado; None para vogal/h ou palavras curtas/funcionais."""
+    if len(w) < 3 or w in FUNCIONAIS:
+        return None
+    if w[0] == "ç":
+        return "s"
+    w = _sem_acento(w)
+    if w.startswith("ch"):
+        return "x"
+    if w.startswith(("qu", "k")):
+        return "k"
+    if w[0] == "c":
+        return "s" if w[1:2] in ("e", "i") else "k"
+    if w[0] == "g":
+        return "j" if w[1:2] in ("e", "i") else "g"
+    if w.startswith("ph"):
+        return "f"
+    if w[0] == "w":
+        return "v"
+    if w[0] in "aeiouhy":
+        return None
+    return w[0]
+
+
+@lru_cache(maxsize=65_536)
+def vogal_tonica(w: str) -> Optional[str]:
+    """Vogal tônica aproximada (ã/õ nasais à parte); None para palavras curtas/funcionais."""
+    if len(w) < 3 or w in FUNCIONAIS:
+        return None
+    for c in reversed(w):
+        if c in ACENTOS:
+            return ACENTOS[c]
+    w = re.sub(r"(?<=[qg])u(?=[ei])", "", _sem_acento(w))
+    nucleos = re.findall(r"[aeiou]+", w)
+    if not nucleos:
+        return None
+    if w.endswith(("am", "em", "ens")) and len(nucleos) == 1:
+        return nucleos[-1][0]
+    nucleo = nucleos[-1] if w.endswith(OXITONAS) or len(nucleos) == 1 else nucleos[-2]
+    return nucleo[0]
+
+
+def _frases(texto: str) -> List[Tuple[int, int]]:
+    """Intervalos [ini, fim) de frases/orações, sem espaços nas pontas."""
+    out = []
+    for m in RE_FRASE.finditer(texto):
+        ini, fim = m.start(), m.end()
+        while ini < fim and texto[ini].isspace():
+            ini += 1
+        while fim > ini and texto[fim - 1].isspace():
+            fim -= 1
+        if fim > ini:
+            out.append((ini, fim))
+    return out
+
+
+def _span(texto: str, label: str, ini: int, fim: int, rationale: str, cues: List[str], conf: float) -> Dict[str, Any]:
+    return {
+        "label": label,
+        "start_char": int(ini),
+        "end_char": int(fim),
+        "text": texto[ini:fim],
+        "rationale": f"Detector lexical: {rationale}",
+        "cues": cues,
+        "confidence": float(conf),
+    }
+
+
+def _corridas(chaves: np.ndarray, grupo: np.ndarray, minimo: int) -> Iterable[Tuple[int, int]]:
+    """Corridas [i, j) de chaves iguais e não vazias (>= 0) dentro do mesmo grupo, com tamanho >= minimo."""
+    n = len(chaves)
+    if n == 0:
+        return []
+    quebra = np.ones(n, dtype=bool)
+    quebra[1:] = (chaves[1:] != chaves[:-1]) | (grupo[1:] != grupo[:-1])
+    inicios = np.flatnonzero(quebra)
+    fins = np.append(inicios[1:], n)
+    ok = (fins - inicios >= minimo) & (chaves[inicios] >= 0)
+    return zip(inicios[ok], fins[ok])
+
+
+def detectar(texto: str) -> List[Dict[str, Any]]:
+    """Spans locais de um discurso."""
+    texto = texto or ""
+    spans: List[Dict[str, Any]] = []
+    frases = _frases(texto)
+
+    # anáfora: chave = primeira palavra (ou duas, se a primeira é funcional)
+    chaves_frase = []
+    for ini, fim in frases:
+        palavras = [p.lower() for p in RE_PALAVRA.findall(texto, ini, min(fim, ini + 80))[:2]]
+        if not palavras:
+            chaves_frase.append(None)
+        elif palavras[0] in FUNCIONAIS:
+            chaves_frase.append(" ".join(palavras) if len(palavras) == 2 and palavras[1] not in FUNCIONAIS else None)
+        else:
+            chaves_frase.append(palavras[0])
+    ids = {c: i for i, c in enumerate(dict.fromkeys(c for c in chaves_frase if c))}
+    codigos = np.array([ids[c] if c else -1 for c in chaves_frase], dtype=np.int64)
+    for i, j in _corridas(codigos, np.zeros(len(codigos), dtype=np.int64), MIN_ANAFORA):
+        n = j - i
+        spans.append(_span(
+            texto, "anafora", frases[i][0], frases[j - 1][1],
+            f"{n} frases seguidas iniciadas por '{chaves_frase[i]}'", [chaves_frase[i]], min(0.95, 0.6 + 0.1 * (n - 2)),
+        ))
+
+    # pergunta retórica: frases terminadas em '?', com 3+ palavras
+    perguntas = [k for k, (ini, fim) in enumerate(frases) if texto[fim - 1] == "?" and len(RE_PALAVRA.findall(texto, ini, fim)) >= 3]
+    em_serie = {k for k in perguntas if (k - 1 in perguntas) or (k + 1 in perguntas)}
+    for k in perguntas:
+        ini, fim = frases[k]
+        serie = k in em_serie
+        spans.append(_span(
+            texto, "pergunta_retórica", ini, fim,
+            "interrogativa em série" if serie else "frase interrogativa", ["?"], 0.75 if serie else 0.6,
+        ))
+
+    # aliteração e assonância: corridas de palavras de conteúdo dentro da mesma frase
+    palavras = [(m.start(), m.end(), m.group().lower()) for m in RE_PALAVRA.finditer(texto)]
+    conteudo = [(a, b, w) for a, b, w in palavras if len(w) >= 3 and w not in FUNCIONAIS]
+    if conteudo and frases:
+        inicios = np.array([a for a, _, _ in conteudo])
+        frase_de = np.searchsorted(np.array([f[0] for f in frases]), inicios, side="right")
+        for label, funcao, minimo, nome in (
+            ("aliteracao", fonema_inicial, MIN_ALITERACAO, "fonema inicial"),
+            ("assonancia", vogal_tonica, MIN_ASSONANCIA, "vogal tônica"),
+        ):
+            valores = [funcao(w) for _, _, w in conteudo]
+            ids = {v: i for i, v in enumerate(dict.fromkeys(v for v in valores if v))}
+            chaves = np.array([ids[v] if v else -1 for v in valores], dtype=np.int64)
+            for i, j in _corridas(chaves, frase_de, minimo):
+                n = j - i
+                if len({w for _, _, w in conteudo[i:j]}) < MIN_DISTINTAS:
+                    continue  # repetição da mesma palavra não é aliteração/assonância
+                spans.append(_span(
+                    texto, label, conteudo[i][0], conteudo[j - 1][1],
+                    f"{n} palavras seguidas com {nome} '{valores[i]}'",
+                    [w for _, _, w in conteudo[i:j]],
+                    min(0.9, (0.55 if label == "aliteracao" else 0.45) + 0.05 * (n - minimo)),
+                ))
+
+    spans.sort(key=lambda s: (s["start_char"], s["label"]))
+    return spans
+
+
+def _detectar_item(item: Tuple[int, str]) -> Tuple[int, List[Dict[str, Any]]]:
+    codigo, texto = item
+    return codigo, detectar(texto)
+
+
+def _iter_lotes(
+    conn: sqlite3.Connection,
+    table: str,
+    codigos: Optional[Iterable[int]],
+    lote: int,
+) -> Iterable[List[Tuple[int, str]]]:
+    """(codigo, texto) em lotes: a tabela inteira ou só `codigos`, buscados por IN."""
+    if codigos is None:
+        cur = conn.execute(f"SELECT CodigoPronunciamento, TextoIntegral FROM {table}")
+        while True:
+            parte = cur.fetchmany(lote)
+            if not parte:
+                return
+            yield parte
+    alvo = sorted(set(int(c) for c in codigos))
+    for i in range(0, len(alvo), lote):
+        ids = alvo[i : i + lote]
+        yield conn.execute(
+            f"SELECT CodigoPronunciamento, TextoIntegral FROM {table} "
+            f"WHERE CodigoPronunciamento IN ({','.join('?' * len(ids))})",
+            ids,
+        ).fetchall()
+
+
+def detectar_corpus(
+    db_path: Path,
+    table: str,
+    codigos: Optional[Iterable[int]] = None,
+    pular: Optional[Set[int]] = None,
+    workers: int | None = None,
+    lote: int = LOTE,
+) -> pd.DataFrame:
+    """
+    Roda o detector sobre os discursos de `table` (ou só `codigos`, menos os
+    de `pular`) e devolve os spans com as colunas do Parquet de spans do
+    batch_figuras.
+    """
+    linhas: List[Dict[str, Any]] = []
+    n = 0
+    conn = sqlite3.connect(str(db_path))
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            for parte in _iter_lotes(conn, table, codigos, lote):
+                if pular:
+                    parte = [(c, t) for c, t in parte if c not in pular]
+                for codigo, spans in pool.map(_detectar_item, parte, chunksize=32):
+                    for s in spans:
+                        linhas.append({"custom_id": f"disc-{codigo}", "CodigoPronunciamento": int(codigo), **s})
+                n += len(parte)
+                print(f"[INFO] Detector lexical: {n:,} discursos, {len(linhas):,} spans")
+    finally:
+        conn.close()
+
+    colunas = ["custom_id", "CodigoPronunciamento", "label", "start_char", "end_char", "text",
+               "rationale", "cues", "confidence", "chunk_offset", "parse_error", "raw_response"]
+    df = pd.DataFrame(linhas, columns=colunas)
+    df["confidence"] = df["confidence"].astype("float32")
+    return df
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Detecta localmente anáforas, aliterações, assonâncias e perguntas retóricas.")
+    ap.add_argument("--db", default="Amostra_1.sqlite", help="SQLite com os discursos")
+    ap.add_argument("--table", default="DiscursosAmostra", help="Tabela com TextoIntegral")
+    ap.add_argument("--out", default=str(PATH_SPANS_LEXICAIS), help="Parquet de saída")
+    ap.add_argument("--workers", type=int, default=None, help="Processos do pool")
+    args = ap.parse_args()
+
+    df = detectar_corpus(Path(args.db), args.table, workers=args.workers)
+    out = Path(args.out)
+    out.parent.mkdir(parents=True, exist_ok=True)
+    df.to_parquet(out, index=False)
+    print(f"[OK] Spans lexicais: {len(df)} em {df['CodigoPronunciamento'].nunique()} discursos -> {out}")
+
+
+if __name__ == "__main__":
+    main()
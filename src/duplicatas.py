@@ -0,0 +1,275 @@
+# -*- coding: utf-8 -*-
+"""
+Detecção de discursos quase idênticos (MinHash + LSH) para não analisar o
+mesmo texto várias vezes.
+
+- Assinatura: shingles de SHINGLE palavras (NFKC, minúsculas, só \\w+), cada
+  um com hash de 32 bits, e NUM_PERM permutações MinHash (a·x + b mod P),
+  calculadas com numpy num pool de processos, lote a lote.
+- LSH: a assinatura é cortada em BANDAS faixas; discursos que coincidem em
+  alguma faixa são candidatos, confirmados se a similaridade de Jaccard
+  estimada (fração de posições iguais) for >= LIMIAR.
+- Grupos (union-find): o representante é o discurso mais longo do grupo
+  (empate: menor código). Só ele é enviado ao modelo; os demais membros
+  recebem cópias dos spans dele (expandir_spans), que a consolidação do
+  batch_figuras realinha ao texto de cada membro (src/alinhamento.py),
+  descartando os spans que não existem no membro.
+
+O mapa {membro: representante} fica em data/batch_figuras/duplicatas.parquet,
+com a impressão digital do corpus (n.º de discursos, maior código e total de
+caracteres) nos metadados do Parquet; carregar_ou_calcular recalcula o mapa
+quando o corpus mudou (ou com recalcular=True / --recalcular no batch_figuras).
+
+Uso:
+    python -m src.duplicatas --db Amostra_1.sqlite --table DiscursosAmostra
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import re
+import sqlite3
+import unicodedata
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+SHINGLE = 5
+NUM_PERM = 128
+BANDAS = 16            # 16 faixas de 8 linhas: limiar de colisão ~0,7
+LIMIAR = 0.85
+MIN_PALAVRAS = 30      # discursos curtos não passam pela deduplicação
+LOTE = 2_000
+BLOCO_SHINGLES = 8_192
+PRIMO = np.uint64(4_294_967_311)  # primo > 2^32
+PATH_DUPLICATAS = Path("data/batch_figuras/duplicatas.parquet")
+
+RE_PALAVRA = re.compile(r"\w+")
+_rng = np.random.default_rng(20240611)
+_A = _rng.integers(1, 1 << 31, size=NUM_PERM, dtype=np.uint64)
+_B = _rng.integers(0, 1 << 31, size=NUM_PERM, dtype=np.uint64)
+
+
+def _shingles(texto: str) -> np.ndarray:
+    """Hashes (uint64 < 2^32) distintos dos shingles de palavras do texto."""
+    palavras = RE_PALAVRA.findall(unicodedata.normalize("NFKC", texto or "").casefold())
+    if len(palavras) < MIN_PALAVRAS:
+        return np.empty(0, dtype=np.uint64)
+    h = np.fromiter((zlib.crc32(p.encode("utf-8")) for p in palavras), dtype=np.uint64, count=len(palavras))
+    n = len(h) - SHINGLE + 1
+    acc = np.zeros(n, dtype=np.uint64)
+    for j in range(SHINGLE):
+        acc = (acc * np.uint64(1_000_003) + h[j : j + n]) & np.uint64(0xFFFFFFFF)
+    return np.unique(acc)
+
+
+def assinatura(texto: str) -> Optional[np.ndarray]:
+    """Assinatura MinHash (NUM_PERM valores) ou None para textos curtos."""
+    x = _shingles(texto)
+    if not len(x):
+        return None
+    sig = np.full(NUM_PERM, PRIMO, dtype=np.uint64)
+    for i in range(0, len(x), BLOCO_SHINGLES):
+        bloco = x[i : i + BLOCO_SHINGLES]
+        valores = (_A[:, None] * bloco[None, :] + _B[:, None]) % PRIMO
+        np.minimum(sig, valores.min(axis=1), out=sig)
+    return sig
+
+
+def _assinar(item: Tuple[int, str]) -> Tuple[int, int, Optional[np.ndarray]]:
+    """Tarefa do pool: (codigo, texto) -> (codigo, n_chars, assinatura)."""
+    codigo, texto = item
+    return codigo, len(texto or ""), assinatura(texto)
+
+
+def _iter_lotes(db_path: Path, table: str, lote: int) -> Iterable[List[Tuple[int, str]]]:
+    conn = sqlite3.connect(str(db_path))
+    try:
+        cur = conn.execute(f"SELECT CodigoPronunciamento, TextoIntegral FROM {table} ORDER BY CodigoPronunciamento")
+        while True:
+            linhas = cur.fetchmany(lote)
+            if not linhas:
+                break
+            yield linhas
+    finally:
+        conn.close()
+
+
+def _achar(pai: np.ndarray, i: int) -> int:
+    while pai[i] != i:
+        pai[i] = pai[pai[i]]
+        i = pai[i]
+    return i
+
+
+def agrupar(codigos: np.ndarray, n_chars: np.ndarray, sigs: np.ndarray) -> pd.DataFrame:
+    """
+    Agrupa as assinaturas por LSH + confirmação. Retorna um DataFrame
+    (CodigoPronunciamento, representante, similaridade) só com os membros
+    (o representante de cada grupo não aparece como membro).
+    """
+    n = len(codigos)
+    pai = np.arange(n)
+    linhas = NUM_PERM // BANDAS
+    for b in range(BANDAS):
+        faixa = np.ascontiguousarray(sigs[:, b * linhas : (b + 1) * linhas])
+        chaves = faixa.view(np.dtype((np.void, faixa.dtype.itemsize * linhas))).ravel()
+        _, inverso, contagem = np.unique(chaves, return_inverse=True, return_counts=True)
+        if (contagem > 1).sum() == 0:
+            continue
+        ordem = np.argsort(inverso, kind="stable")
+        fronteiras = np.cumsum(contagem)[:-1]
+        for grupo in np.split(ordem, fronteiras):
+            if len(grupo) < 2:
+                continue
+            # compara com a âncora do balde (linear mesmo em baldes grandes)
+            ancora = grupo[0]
+            sim = (sigs[grupo[1:]] == sigs[ancora]).mean(axis=1)
+            for j in grupo[1:][sim >= LIMIAR]:
+                ra, rb = _achar(pai, ancora), _achar(pai, j)
+                if ra != rb:
+                    pai[rb] = ra
+
+    raizes = np.array([_achar(pai, i) for i in range(n)])
+    df = pd.DataFrame({"i": np.arange(n), "raiz": raizes, "codigo": codigos, "n_chars": n_chars})
+    df = df.loc[df.groupby("raiz")["i"].transform("size") > 1]
+    if df.empty:
+        return pd.DataFrame(columns=["CodigoPronunciamento", "representante", "similaridade"])
+    df = df.sort_values(["raiz", "n_chars", "codigo"], ascending=[True, False, True])
+    rep = df.groupby("raiz")["i"].transform("first").to_numpy()
+    membros = df["i"].to_numpy() != rep
+    i_m, i_r = df["i"].to_numpy()[membros], rep[membros]
+    return pd.DataFrame({
+        "CodigoPronunciamento": codigos[i_m].astype("int64"),
+        "representante": codigos[i_r].astype("int64"),
+        "similaridade": (sigs[i_m] == sigs[i_r]).mean(axis=1).astype("float32"),
+    })
+
+
+def detectar(
+    db_path: Path,
+    table: str,
+    workers: int | None = None,
+    lote: int = LOTE,
+) -> pd.DataFrame:
+    """Calcula as assinaturas de todos os discursos de `table` e agrupa os quase idênticos."""
+    codigos: List[int] = []
+    tamanhos: List[int] = []
+    sigs: List[np.ndarray] = []
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for linhas in _iter_lotes(Path(db_path), table, lote):
+            for codigo, n_chars, sig in pool.map(_assinar, linhas, chunksize=64):
+                if sig is not None:
+                    codigos.append(int(codigo))
+                    tamanhos.append(n_chars)
+                    sigs.append(sig)
+            print(f"[INFO] Assinaturas MinHash: {len(sigs):,} discursos")
+    if not sigs:
+        return agrupar(np.empty(0, dtype=np.int64), np.empty(0), np.empty((0, NUM_PERM), dtype=np.uint64))
+    return agrupar(np.array(codigos), np.array(tamanhos), np.vstack(sigs))
+
+
+def impressao_corpus(db_path: Path, table: str) -> Dict[str, int]:
+    """Resumo barato do corpus para saber se o mapa gravado ainda vale."""
+    conn = sqlite3.connect(str(db_path))
+    try:
+        n, maior, chars = conn.execute(
+            f"SELECT count(*), max(CodigoPronunciamento), sum(coalesce(length(TextoIntegral), 0)) FROM {table}"
+        ).fetchone()
+    finally:
+        conn.close()
+    return {"n": int(n), "max_codigo": int(maior or 0), "chars": int(chars or 0)}
+
+
+def gravar(df: pd.DataFrame, destino: Path = PATH_DUPLICATAS, impressao: Optional[Dict[str, int]] = None) -> Path:
+    destino = Path(destino)
+    destino.parent.mkdir(parents=True, exist_ok=True)
+    tabela = pa.Table.from_pandas(df, preserve_index=False)
+    if impressao is not None:
+        meta = dict(tabela.schema.metadata or {})
+        meta[b"corpus"] = json.dumps(impressao).encode("utf-8")
+        tabela = tabela.replace_schema_metadata(meta)
+    pq.write_table(tabela, str(destino))
+    n_grupos = df["representante"].nunique()
+    print(f"[OK] Duplicatas: {len(df)} discursos em {n_grupos} grupos -> {destino}")
+    return destino
+
+
+def _impressao_gravada(destino: Path) -> Optional[Dict[str, int]]:
+    meta = pq.read_schema(str(destino)).metadata or {}
+    return json.loads(meta[b"corpus"]) if b"corpus" in meta else None
+
+
+def carregar_ou_calcular(
+    db_path: Path,
+    table: str,
+    destino: Path = PATH_DUPLICATAS,
+    recalcular: bool = False,
+) -> Dict[int, int]:
+    """
+    {membro: representante}; calcula e grava o mapa se ainda não existir, se
+    o corpus mudou desde a gravação (impressao_corpus) ou com recalcular=True.
+    """
+    destino = Path(destino)
+    impressao = impressao_corpus(db_path, table)
+    if destino.exists() and not recalcular and _impressao_gravada(destino) == impressao:
+        df = pd.read_parquet(destino)
+    else:
+        if destino.exists() and not recalcular:
+            print(f"[INFO] Corpus mudou desde {destino}; recalculando as duplicatas")
+        df = detectar(db_path, table)
+        gravar(df, destino, impressao)
+    return dict(zip(df["CodigoPronunciamento"].astype(int), df["representante"].astype(int)))
+
+
+def expandir_spans(df: pd.DataFrame, membros: Dict[int, int]) -> pd.DataFrame:
+    """
+    Copia os spans de cada representante para os membros do seu grupo que não
+    têm spans próprios. As cópias ficam com o código e o custom_id do membro e
+    a coluna `representante`; os offsets ainda são os do representante
+    (devem ser realinhados ao texto do membro).
+    """
+    if df.empty or not membros:
+        return df
+    presentes = set(int(c) for c in df["CodigoPronunciamento"].dropna().unique())
+    por_rep: Dict[int, List[int]] = {}
+    for membro, rep in membros.items():
+        if membro not in presentes and rep in presentes:
+            por_rep.setdefault(rep, []).append(membro)
+    if not por_rep:
+        return df.assign(representante=pd.array([pd.NA] * len(df), dtype="Int64"))
+
+    origem = df.loc[df["CodigoPronunciamento"].isin(list(por_rep))]
+    copias = []
+    for rep, g in origem.groupby("CodigoPronunciamento", sort=False):
+        for membro in por_rep[int(rep)]:
+            copias.append(g.assign(CodigoPronunciamento=membro, custom_id=f"disc-{membro}", representante=rep))
+    out = pd.concat([df.assign(representante=pd.NA), *copias], ignore_index=True)
+    out["representante"] = out["representante"].astype("Int64")
+    print(f"[OK] Spans copiados para {sum(len(v) for v in por_rep.values())} discursos duplicados")
+    return out
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Agrupa discursos quase idênticos (MinHash + LSH).")
+    ap.add_argument("--db", default="Amostra_1.sqlite", help="SQLite com os discursos")
+    ap.add_argument("--table", default="DiscursosAmostra", help="Tabela com TextoIntegral")
+    ap.add_argument("--out", default=str(PATH_DUPLICATAS), help="Parquet do mapa membro -> representante")
+    ap.add_argument("--workers", type=int, default=None, help="Processos para as assinaturas")
+    args = ap.parse_args()
+    gravar(
+        detectar(Path(args.db), args.table, workers=args.workers),
+        Path(args.out),
+        impressao_corpus(Path(args.db), args.table),
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+"""
+Empacotamento das requisições do batch por orçamento de tokens.
+
+Os tokens de cada requisição são contados com o tiktoken (src/orcamento, com
+cache por hash do texto):
+
+    entrada = fixos (prompt de desenvolvedor + instrução + schema, contados
+              uma vez) + discurso (ou janela)
+    saída   = reserva prevista por requisição (reasoning incluído)
+
+As requisições são distribuídas em k batches pela regra LPT (da maior para a
+menor, cada uma vai para o batch com menos tokens até então), com o menor k
+que deixa todos os batches abaixo da cota de tokens de entrada enfileirados,
+do nº de requisições e do tamanho do arquivo. Batches com totais parecidos
+terminam em tempos parecidos: alguns discursos enormes não atrasam mais um
+batch que os outros.
+
+Para cada batch o relatório traz requisições, MB, tokens de entrada/saída, o
+custo previsto (PRICES_PER_MILLION de src/orcamento) e, com calibração
+(src/calibracao.py), a duração prevista.
+"""
+
+from __future__ import annotations
+
+import heapq
+import json
+import math
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence
+
+from src.orcamento import PRICES_PER_MILLION, TOKEN_CACHE_PATH, count_tokens_cached
+from src.requisicao import INSTRUCAO_USUARIO, PROMPT_DESENVOLVEDOR, schema_com_labels
+from src.structured_outputs import schema
+
+TOKENS_ENVELOPE = 12  # papéis/marcações de mensagem que não aparecem nos textos
+
+
+def tokens_fixos(
+    model: str, cache_path: Optional[Path] = TOKEN_CACHE_PATH, labels: Optional[Sequence[str]] = None
+) -> int:
+    """Tokens de entrada comuns a todas as requisições (prompt, instrução e schema, restrito a `labels`)."""
+    formato = schema if labels is None else schema_com_labels(labels)
+    partes = [PROMPT_DESENVOLVEDOR, INSTRUCAO_USUARIO, json.dumps(formato, ensure_ascii=False)]
+    return sum(count_tokens_cached(partes, model, cache_path)) + TOKENS_ENVELOPE
+
+
+def tokens_entrada(
+    textos: Sequence[str], model: str, fixos: int, cache_path: Optional[Path] = TOKEN_CACHE_PATH
+) -> List[int]:
+    """Tokens de entrada de cada requisição: fixos + tokens do discurso/janela."""
+    return [fixos + n for n in count_tokens_cached(textos, model, cache_path)]
+
+
+def custo_previsto(tokens_entrada: int, tokens_saida: int, model: str) -> Optional[float]:
+    """Custo em USD (None se o modelo não tiver preço em PRICES_PER_MILLION)."""
+    precos = PRICES_PER_MILLION.get(model)
+    if precos is None:
+        return None
+    return (tokens_entrada * precos["input"] + tokens_saida * precos["output"]) / 1_000_000
+
+
+def empacotar(
+    tokens_entrada: Sequence[int],
+    tokens_saida: Sequence[int],
+    n_bytes: Sequence[int],
+    max_tokens: int,
+    max_requests: int,
+    max_bytes: int,
+    n_requests: Sequence[int] | None = None,
+) -> List[List[int]]:
+    """
+    Distribui os itens (índices) em batches pela regra LPT sobre os tokens
+    totais (entrada + saída), respeitando por batch max_tokens (entrada),
+    max_requests e max_bytes. Itens que sozinhos estouram um limite devem ser
+    removidos antes. Cada batch sai com os índices em ordem crescente.
+    Com `n_requests`, cada item é um grupo indivisível de requisições (ex.:
+    as janelas de um discurso) e conta como n_requests[i] no max_requests.
+    """
+    n = len(tokens_entrada)
+    if n == 0:
+        return []
+    n_requests = n_requests or [1] * n
+    peso = [e + s for e, s in zip(tokens_entrada, tokens_saida)]
+    ordem = sorted(range(n), key=lambda i: peso[i], reverse=True)
+    k = max(
+        1,
+        math.ceil(sum(tokens_entrada) / max_tokens),
+        math.ceil(sum(n_requests) / max_requests),
+        math.ceil(sum(n_bytes) / max_bytes),
+    )
+    while True:
+        # heap de (tokens totais, batch); cargas por batch em listas paralelas
+        heap = [(0, b) for b in range(k)]
+        entrada, reqs, bytes_ = [0] * k, [0] * k, [0] * k
+        batches: List[List[int]] = [[] for _ in range(k)]
+        for i in ordem:
+            adiados = []
+            while heap:
+                carga, b = heapq.heappop(heap)
+                if (
+                    entrada[b] + tokens_entrada[i] <= max_tokens
+                    and reqs[b] + n_requests[i] <= max_requests
+                    and bytes_[b] + n_bytes[i] <= max_bytes
+                ):
+                    break
+                adiados.append((carga, b))
+            else:
+                break  # nenhum batch comporta o item: tenta com k + 1
+            batches[b].append(i)
+            entrada[b] += tokens_entrada[i]
+            reqs[b] += n_requests[i]
+            bytes_[b] += n_bytes[i]
+            heapq.heappush(heap, (carga + peso[i], b))
+            for item in adiados:
+                heapq.heappush(heap, item)
+        else:
+            return [sorted(b) for b in batches if b]
+        k += 1
+
+
+def relatorio(shards: List[Dict[str, Any]]) -> None:
+    """Imprime a previsão por batch e o total."""
+    for j, s in enumerate(shards):
+        custo = s.get("custo_previsto_usd")
+        print(
+            f"[INFO] Batch {j:04d}: {s['n_requests']:,} req | {s['n_bytes'] / 1e6:,.1f} MB"
+            f" | entrada {s['est_tokens']:,} tok | saída {s.get('est_tokens_saida', 0):,} tok"
+            + (f" | US$ {custo:,.2f}" if custo is not None else "")
+            + (f" | ~{s['tempo_previsto_s'] / 3600:,.1f} h" if s.get("tempo_previsto_s") is not None else "")
+        )
+    total_in = sum(s["est_tokens"] for s in shards)
+    total_out = sum(s.get("est_tokens_saida", 0) for s in shards)
+    custos = [s.get("custo_previsto_usd") for s in shards]
+    linha = f"[OK] {len(shards)} batches | entrada {total_in:,} tok | saída {total_out:,} tok"
+    if custos and all(c is not None for c in custos):
+        linha += f" | custo previsto US$ {sum(custos):,.2f}"
+    tempos = [s["tempo_previsto_s"] for s in shards if s.get("tempo_previsto_s") is not None]
+    if tempos:
+        # os batches rodam em paralelo: o run termina com o mais lento
+        linha += f" | duração prevista ~{max(tempos) / 3600:,.1f} h"
+    print(linha)
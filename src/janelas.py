@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+"""
+Divisão de discursos longos em janelas sobrepostas e remapeamento dos spans
+de volta para offsets do discurso inteiro.
+
+- dividir_em_janelas: corta em fronteiras de frase/parágrafo, com sobreposição
+  entre janelas vizinhas para não perder figuras que caem na emenda.
+- custom_id das janelas: disc-{codigo}-j{indice}-o{offset}-n{total}; o total
+  de janelas permite ao manifesto saber quando todas foram respondidas.
+  Discursos que cabem numa janela só mantêm disc-{codigo}.
+- remapear/deduplicar: soma o offset da janela aos spans posicionados e remove
+  os spans encontrados duas vezes na sobreposição.
+"""
+
+from __future__ import annotations
+
+import re
+import unicodedata
+from typing import List, Optional, Tuple
+
+import pandas as pd
+
+JANELA_CHARS = 12_000
+SOBREPOSICAO_CHARS = 1_000
+
+RE_PARAGRAFO = re.compile(r"\n\s*")
+RE_FRASE = re.compile(r"(?<=[.!?…;:])\s+")
+
+
+def _unidades(texto: str, max_chars: int) -> List[Tuple[int, int]]:
+    """
+    Intervalos [ini, fim) que podem ser agrupados numa janela: as frases de
+    cada parágrafo (assim as janelas terminam sempre em fim de frase ou de
+    parágrafo); frases maiores que max_chars viram cortes fixos.
+    """
+    def _partes(ini: int, fim: int, regex: re.Pattern) -> List[Tuple[int, int]]:
+        partes, pos = [], ini
+        for m in regex.finditer(texto, ini, fim):
+            if m.end() > pos:
+                partes.append((pos, m.end()))
+                pos = m.end()
+        if fim > pos:
+            partes.append((pos, fim))
+        return partes
+
+    out: List[Tuple[int, int]] = []
+    for p_ini, p_fim in _partes(0, len(texto), RE_PARAGRAFO):
+        for f_ini, f_fim in _partes(p_ini, p_fim, RE_FRASE):
+            if f_fim - f_ini <= max_chars:
+                out.append((f_ini, f_fim))
+            else:
+                out.extend((i, min(i + max_chars, f_fim)) for i in range(f_ini, f_fim, max_chars))
+    return out
+
+
+def dividir_em_janelas(
+    texto: str,
+    max_chars: int = JANELA_CHARS,
+    sobreposicao: int = SOBREPOSICAO_CHARS,
+) -> List[Tuple[int, str]]:
+    """
+    Retorna [(offset, trecho), ...] cobrindo o texto inteiro. Cada janela tem
+    até max_chars e começa recuando unidades inteiras da janela anterior até
+    somar pelo menos `sobreposicao` caracteres repetidos.
+    """
+    texto = texto or ""
+    if len(texto) <= max_chars:
+        return [(0, texto)]
+
+    unidades = _unidades(texto, max_chars)
+    janelas: List[Tuple[int, str]] = []
+    i = 0
+    while i < len(unidades):
+        ini = unidades[i][0]
+        j = i
+        while j + 1 < len(unidades) and unidades[j + 1][1] - ini <= max_chars:
+            j += 1
+        fim = unidades[j][1]
+        janelas.append((ini, texto[ini:fim]))
+        if j + 1 >= len(unidades):
+            break
+        # próxima janela: recua unidades até cobrir a sobreposição, sem voltar
+        # para o início da janela atual nem repetir mais da metade dela
+        k = j + 1
+        while k - 1 > i:
+            repetido = fim - unidades[k][0] if k <= j else 0
+            if repetido >= sobreposicao or fim - unidades[k - 1][0] > max_chars // 2:
+                break
+            k -= 1
+        i = k
+    return janelas
+
+
+def custom_id_janela(codigo: int, indice: int, offset: int, n_janelas: int) -> str:
+    if n_janelas <= 1:
+        return f"disc-{codigo}"
+    return f"disc-{codigo}-j{indice}-o{offset}-n{n_janelas}"
+
+
+def parse_custom_id(custom_id: Optional[str]) -> Tuple[Optional[int], Optional[int], Optional[int]]:
+    """(CodigoPronunciamento, indice da janela, offset) a partir do custom_id."""
+    partes = str(custom_id).split("-")
+    try:
+        codigo = int(partes[1])
+    except (IndexError, ValueError):
+        return None, None, None
+    indice = offset = None
+    for p in partes[2:]:
+        if p[:1] == "j" and p[1:].isdigit():
+            indice = int(p[1:])
+        elif p[:1] == "o" and p[1:].isdigit():
+            offset = int(p[1:])
+    return codigo, indice, offset
+
+
+def _normalizar(texto: str) -> str:
+    texto = unicodedata.normalize("NFKC", texto or "").casefold()
+    return re.sub(r"\W+", " ", texto).strip()
+
+
+def deduplicar_spans(df: pd.DataFrame, min_sobreposicao: float = 0.5) -> pd.DataFrame:
+    """
+    Remove spans repetidos de um mesmo discurso vindos de janelas sobrepostas.
+    Dois spans do mesmo discurso e label são o mesmo se o texto normalizado
+    coincide ou se os intervalos (já remapeados) se sobrepõem em pelo menos
+    `min_sobreposicao` do menor. Fica o de maior confiança.
+    Só discursos efetivamente divididos (chunk_offset não nulo) são examinados.
+    """
+    if df.empty or "chunk_offset" not in df:
+        return df
+    fatiados = df["chunk_offset"].notna()
+    if not fatiados.any():
+        return df
+
+    resto = df.loc[~fatiados]
+    alvo = df.loc[fatiados].assign(_norm=lambda d: d["text"].map(_normalizar))
+    alvo = (
+        alvo.sort_values("confidence", ascending=False, kind="stable")
+        .drop_duplicates(["CodigoPronunciamento", "label", "_norm"])
+    )
+
+    manter = []
+    for _, g in alvo.groupby(["CodigoPronunciamento", "label"], sort=False, observed=True):
+        aceitos: List[Tuple[int, int]] = []
+        for idx, ini, fim in zip(g.index, g["start_char"], g["end_char"]):
+            if pd.isna(ini) or pd.isna(fim) or fim <= ini:
+                manter.append(idx)  # não posicionado: decide só pelo texto
+                continue
+            dup = False
+            for a, b in aceitos:
+                inter = min(fim, b) - max(ini, a)
+                if inter > 0 and inter >= min_sobreposicao * min(fim - ini, b - a):
+                    dup = True
+                    break
+            if not dup:
+                aceitos.append((int(ini), int(fim)))
+                manter.append(idx)
+
+    return pd.concat([resto, alvo.loc[manter].drop(columns="_norm")]).sort_index()
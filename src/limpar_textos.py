@@ -1,7 +1,10 @@
+import hashlib
+import os
 import sqlite3
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
 from pathlib import Path
 import re
-from typing import Optional
+from typing import List, Optional, Sequence, Tuple
 
 # Caminho do banco
 PATH_PRONUNCIAMENTOS_V2 = Path(__file__).resolve().parents[1] / "data" / "Discursos.sqlite"
@@ -25,6 +28,111 @@ def limpar_texto_anexos(texto: Optional[str]) -> str:
         return ""
     return REGEX_EXCLUIR_ANEXOS.sub("", texto).strip()
 
+# ------------------------------------------------------------
+# Controle incremental: versão das regras + hash por linha
+# ------------------------------------------------------------
+# Uma linha por (tabela, coluna, id) já limpa: versão das regras usada e
+# hash/tamanho do texto que ficou gravado. Além disso:
+# - marca d'água: maior rowid coberto por uma execução completa (sem filtro)
+#   com a versão atual das regras; abaixo dela todas as linhas estão limpas;
+# - linhas alteradas: um gatilho na tabela registra o id de todo texto
+#   modificado depois da limpeza.
+# Na próxima execução só são lidas as linhas acima da marca (novas) e as
+# alteradas; sem marca válida (primeira execução ou regras novas), as linhas
+# sem controle ou com versão diferente. Nenhum texto é lido só para decidir.
+TBL_CONTROLE = "LimpezaTextos"
+# Texto original das linhas alteradas pela limpeza (opcional)
+TBL_ORIGINAIS = "TextosOriginais"
+TBL_MARCAS = "LimpezaMarcas"
+TBL_ALTERADOS = "TextosAlterados"
+
+
+def versao_regras() -> str:
+    """Versão das regras de limpeza; muda sempre que REGEX_EXCLUIR_ANEXOS muda."""
+    chave = f"{REGEX_EXCLUIR_ANEXOS.pattern}|{REGEX_EXCLUIR_ANEXOS.flags}"
+    return hashlib.sha1(chave.encode("utf-8")).hexdigest()[:12]
+
+
+def _hash_texto(texto: Optional[str]) -> str:
+    return hashlib.sha1((texto or "").encode("utf-8")).hexdigest()
+
+
+def _garantir_controle(conn: sqlite3.Connection) -> None:
+    conn.execute(
+        f"""
+        CREATE TABLE IF NOT EXISTS {TBL_CONTROLE} (
+            tabela TEXT NOT NULL,
+            coluna TEXT NOT NULL,
+            id INTEGER NOT NULL,
+            versao TEXT NOT NULL,
+            hash TEXT NOT NULL,
+            n_chars INTEGER NOT NULL,
+            PRIMARY KEY (tabela, coluna, id)
+        )
+        """
+    )
+    conn.execute(
+        f"""
+        CREATE TABLE IF NOT EXISTS {TBL_ORIGINAIS} (
+            tabela TEXT NOT NULL,
+            coluna TEXT NOT NULL,
+            id INTEGER NOT NULL,
+            texto TEXT,
+            PRIMARY KEY (tabela, coluna, id)
+        )
+        """
+    )
+    conn.execute(
+        f"""
+        CREATE TABLE IF NOT EXISTS {TBL_MARCAS} (
+            tabela TEXT NOT NULL,
+            coluna TEXT NOT NULL,
+            versao TEXT NOT NULL,
+            ultimo_rowid INTEGER NOT NULL,
+            PRIMARY KEY (tabela, coluna)
+        )
+        """
+    )
+    conn.execute(
+        f"""
+        CREATE TABLE IF NOT EXISTS {TBL_ALTERADOS} (
+            tabela TEXT NOT NULL,
+            coluna TEXT NOT NULL,
+            id INTEGER NOT NULL,
+            PRIMARY KEY (tabela, coluna, id)
+        )
+        """
+    )
+    conn.commit()
+
+def _garantir_gatilho(conn: sqlite3.Connection, table: str, id_col: str, text_col: str) -> None:
+    """Registra em TextosAlterados o id de cada linha cujo texto muda (inclusive pela própria limpeza)."""
+    conn.execute(
+        f"""
+        CREATE TRIGGER IF NOT EXISTS trg_limpeza_{table}_{text_col}
+        AFTER UPDATE OF {text_col} ON {table}
+        WHEN NEW.{text_col} IS NOT OLD.{text_col}
+        BEGIN
+            INSERT OR IGNORE INTO {TBL_ALTERADOS} (tabela, coluna, id) VALUES ('{table}', '{text_col}', NEW.{id_col});
+        END
+        """
+    )
+    conn.commit()
+
+def _marca(conn: sqlite3.Connection, table: str, text_col: str, versao: str) -> int:
+    """Marca d'água válida para a versão atual das regras (0 se não houver)."""
+    row = conn.execute(
+        f"SELECT ultimo_rowid FROM {TBL_MARCAS} WHERE tabela = ? AND coluna = ? AND versao = ?",
+        (table, text_col, versao),
+    ).fetchone()
+    return int(row[0]) if row else 0
+
+def _gravar_marca(conn: sqlite3.Connection, table: str, text_col: str, versao: str, ultimo_rowid: int) -> None:
+    conn.execute(
+        f"INSERT OR REPLACE INTO {TBL_MARCAS} VALUES (?, ?, ?, ?);",
+        (table, text_col, versao, int(ultimo_rowid)),
+    )
+
 # ------------------------------------------------------------
 # Utilitários SQLite
 # ------------------------------------------------------------
@@ -33,26 +141,105 @@ def _count_rows(conn: sqlite3.Connection, table: str, where: Optional[str]) -> i
     cur = conn.execute(sql)
     return int(cur.fetchone()[0])
 
-def _yield_batches(conn: sqlite3.Connection, table: str, id_col: str, text_col: str,
-                   where: Optional[str], batch_size: int):
+def _sql_pendentes(table: str, id_col: str, text_col: str, where: Optional[str],
+                   reprocessar: bool, conferir_hash: bool, faixa: bool = False) -> str:
     """
-    Gera lotes de (id, texto) usando um cursor com fetchmany().
-    Evita usar OFFSET para não degradar em tabelas grandes.
+    SELECT de (id, texto, versão anterior, hash anterior) das linhas a limpar.
+
+    O filtro do usuário (e a faixa de rowid, no modo paralelo) é aplicado numa
+    subconsulta própria, então pode citar as colunas da tabela sem ambiguidade.
+    No modo incremental, a subconsulta só deixa passar as linhas acima da
+    marca d'água e as registradas em TextosAlterados; o filtro externo usa só
+    o controle (ids e versão), sem ler o texto.
+    Parâmetros nomeados: tabela, coluna, versao, marca[, ini, fim].
+    """
+    incremental = not reprocessar and not conferir_hash
+    alterados = f"SELECT id FROM {TBL_ALTERADOS} WHERE tabela = :tabela AND coluna = :coluna"
+    filtros = [f"({where})"] if where else []
+    if faixa:
+        filtros.append("rowid BETWEEN :ini AND :fim")
+    if incremental:
+        filtros.append(f"(rowid > :marca OR {id_col} IN ({alterados}))")
+    base = f"SELECT {id_col} AS _id, {text_col} AS _txt FROM {table}"
+    if filtros:
+        base += " WHERE " + " AND ".join(filtros)
+    sql = (
+        f"SELECT t._id, t._txt, c.versao, c.hash FROM ({base}) t"
+        f" LEFT JOIN {TBL_CONTROLE} c ON c.tabela = :tabela AND c.coluna = :coluna AND c.id = t._id"
+    )
+    if incremental:
+        sql += f" WHERE c.id IS NULL OR c.versao <> :versao OR t._id IN ({alterados})"
+    return sql
+
+def _params(table: str, text_col: str, versao: str, marca: int) -> dict:
+    return {"tabela": table, "coluna": text_col, "versao": versao, "marca": marca}
+
+def _yield_batches(conn: sqlite3.Connection, sql: str, params: Sequence, batch_size: int):
+    """
+    Gera lotes das linhas de `sql` (ver _sql_pendentes) usando um cursor com
+    fetchmany(). Evita usar OFFSET para não degradar em tabelas grandes.
     Requer que id_col seja chave única/primária.
     """
     # Podemos iterar ordenando pelo id para cursor estável
-    base_sql = f"SELECT {id_col}, {text_col} FROM {table}"
-    if where:
-        base_sql += f" WHERE {where}"
-    base_sql += f" ORDER BY {id_col} ASC"
-
-    cur = conn.execute(base_sql)
+    cur = conn.execute(sql + " ORDER BY t._id ASC", params)
     while True:
         rows = cur.fetchmany(batch_size)
         if not rows:
             break
         yield rows
 
+def _limpar_linhas(rows, table: str, text_col: str, versao: str, reprocessar: bool):
+    """
+    Limpa um lote de (id, texto, versão anterior, hash anterior).
+
+    Linhas com a mesma versão e o mesmo hash já estão limpas e são puladas.
+    Retorna (updates, controle, lidos): [(texto_novo, id)] das linhas
+    alteradas, as linhas de controle de todas as linhas limpas e os ids de
+    todas as linhas lidas (saem de TextosAlterados).
+    """
+    updates, controle = [], []
+    lidos = [r[0] for r in rows]
+    for _id, txt, versao_ant, hash_ant in rows:
+        if not reprocessar and versao_ant == versao and hash_ant == _hash_texto(txt):
+            continue
+        novo = limpar_texto_anexos(txt)
+        if (txt or "") != novo:
+            updates.append((novo, _id))
+        controle.append((table, text_col, _id, versao, _hash_texto(novo), len(novo)))
+    return updates, controle, lidos
+
+def _gravar(conn: sqlite3.Connection, table: str, id_col: str, text_col: str,
+            updates: List[Tuple[str, object]], controle: List[tuple], guardar_originais: bool,
+            lidos: Sequence = ()):
+    if updates:
+        if guardar_originais:
+            # guarda só o primeiro original: limpezas seguintes não o sobrescrevem
+            conn.executemany(
+                f"INSERT OR IGNORE INTO {TBL_ORIGINAIS} (tabela, coluna, id, texto)"
+                f" SELECT ?, ?, {id_col}, {text_col} FROM {table} WHERE {id_col} = ?;",
+                [(table, text_col, _id) for _, _id in updates],
+            )
+        conn.executemany(f"UPDATE {table} SET {text_col} = ? WHERE {id_col} = ?;", updates)
+    if controle:
+        conn.executemany(f"INSERT OR REPLACE INTO {TBL_CONTROLE} VALUES (?, ?, ?, ?, ?, ?);", controle)
+    # depois dos UPDATEs: o gatilho também registra as linhas reescritas aqui
+    ids = set(lidos) | {_id for _, _id in updates}
+    if ids:
+        conn.executemany(
+            f"DELETE FROM {TBL_ALTERADOS} WHERE tabela = ? AND coluna = ? AND id = ?;",
+            [(table, text_col, _id) for _id in ids],
+        )
+
+def _estatisticas(total: int, verificadas: int, atualizadas: int, versao: str) -> dict:
+    return {
+        "linhas_totais_filtradas": total,
+        "ja_limpas": total - verificadas,
+        "verificadas": verificadas,
+        "atualizadas": atualizadas,
+        "inalteradas": verificadas - atualizadas,
+        "versao_regras": versao,
+    }
+
 # ------------------------------------------------------------
 # Pipeline principal
 # ------------------------------------------------------------
@@ -65,11 +252,20 @@ def limpar_coluna_sqlite(
     batch_size: int = 5_000,
     commit_every: int = 20_000,
     pragmas: bool = True,
+    guardar_originais: bool = False,
+    conferir_hash: bool = False,
+    reprocessar: bool = False,
 ) -> dict:
     """
     Limpa anexos na coluna `text_col` de `table` dentro do SQLite.
     Atualiza apenas quando o texto for alterado.
 
+    A limpeza é incremental: cada linha limpa é registrada em LimpezaTextos
+    com a versão das regras e o hash/tamanho do texto gravado, e as execuções
+    seguintes só leem as linhas acima da marca d'água (novas), as alteradas
+    desde a limpeza (gatilho -> TextosAlterados) ou as limpas com regras
+    antigas. Uma execução sem `where` avança a marca d'água.
+
     Parâmetros
     ----------
     db_path : Path
@@ -85,13 +281,21 @@ def limpar_coluna_sqlite(
     batch_size : int
         Tamanho do lote de leitura.
     commit_every : int
-        Faz commit a cada N atualizações aplicadas.
+        Faz commit a cada N linhas gravadas (textos e controle).
     pragmas : bool
         Se True, ajusta PRAGMAs para melhor performance.
+    guardar_originais : bool
+        Se True, copia o texto original das linhas alteradas para
+        TextosOriginais (ver restaurar_originais).
+    conferir_hash : bool
+        Se True, lê todos os textos e compara o hash (detecta edições que não
+        mudam o tamanho); ainda pula a regex das linhas já limpas.
+    reprocessar : bool
+        Se True, ignora o controle e limpa todas as linhas filtradas.
 
     Retorna
     -------
-    dict com contagens: {'verificadas', 'atualizadas', 'inalteradas'}
+    dict com contagens: {'ja_limpas', 'verificadas', 'atualizadas', 'inalteradas'}
     """
     conn = sqlite3.connect(str(db_path))
     try:
@@ -100,59 +304,190 @@ def limpar_coluna_sqlite(
             conn.execute("PRAGMA synchronous=NORMAL;")
             conn.execute("PRAGMA temp_store=MEMORY;")
             conn.execute("PRAGMA mmap_size=134217728;")  # 128 MiB
+        _garantir_controle(conn)
+        _garantir_gatilho(conn, table, id_col, text_col)
 
+        versao = versao_regras()
         total = _count_rows(conn, table, where)
-        verificadas = atualizadas = inalteradas = 0
+        ultimo_rowid = conn.execute(f"SELECT MAX(rowid) FROM {table}").fetchone()[0]
+        verificadas = atualizadas = 0
         pendentes = 0
 
         # Recomenda-se um índice (se ainda não houver) para acelerar o ORDER BY/UPDATE:
         # conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_{id_col} ON {table}({id_col});")
 
-        for rows in _yield_batches(conn, table, id_col, text_col, where, batch_size):
-            updates = []
-            for _id, txt in rows:
-                verificadas += 1
-                novo = limpar_texto_anexos(txt)
-                if (txt or "") != novo:
-                    updates.append((novo, _id))
-                else:
-                    inalteradas += 1
-
-            if updates:
-                conn.executemany(
-                    f"UPDATE {table} SET {text_col} = ? WHERE {id_col} = ?;",
-                    updates
-                )
-                atualizadas += len(updates)
-                pendentes += len(updates)
+        sql = _sql_pendentes(table, id_col, text_col, where, reprocessar, conferir_hash)
+        params = _params(table, text_col, versao, _marca(conn, table, text_col, versao))
+        for rows in _yield_batches(conn, sql, params, batch_size):
+            updates, controle, lidos = _limpar_linhas(rows, table, text_col, versao, reprocessar)
+            _gravar(conn, table, id_col, text_col, updates, controle, guardar_originais, lidos)
+            verificadas += len(controle)
+            atualizadas += len(updates)
+            pendentes += len(controle)
 
             if pendentes >= commit_every:
                 conn.commit()
                 pendentes = 0
 
-        if pendentes:
-            conn.commit()
+        if where is None and ultimo_rowid is not None:
+            _gravar_marca(conn, table, text_col, versao, ultimo_rowid)
+        conn.commit()
+        return _estatisticas(total, verificadas, atualizadas, versao)
+    finally:
+        conn.close()
+
+def restaurar_originais(db_path: Path, table: str, id_col: str, text_col: str) -> int:
+    """
+    Devolve a `text_col` os textos guardados em TextosOriginais e apaga o
+    controle dessas linhas (a próxima limpeza volta a processá-las).
+    Retorna quantas linhas foram restauradas.
+    """
+    conn = sqlite3.connect(str(db_path))
+    try:
+        _garantir_controle(conn)
+        cur = conn.execute(
+            f"""
+            UPDATE {table} SET {text_col} = (
+                SELECT o.texto FROM {TBL_ORIGINAIS} o
+                WHERE o.tabela = ? AND o.coluna = ? AND o.id = {table}.{id_col}
+            )
+            WHERE {id_col} IN (SELECT id FROM {TBL_ORIGINAIS} WHERE tabela = ? AND coluna = ?)
+            """,
+            (table, text_col, table, text_col),
+        )
+        n = cur.rowcount
+        conn.execute(
+            f"DELETE FROM {TBL_CONTROLE} WHERE tabela = ? AND coluna = ?"
+            f" AND id IN (SELECT id FROM {TBL_ORIGINAIS} WHERE tabela = ? AND coluna = ?)",
+            (table, text_col, table, text_col),
+        )
+        conn.commit()
+        return n
+    finally:
+        conn.close()
+
+# ------------------------------------------------------------
+# Modo paralelo: faixas de rowid num pool de processos, um só escritor
+# ------------------------------------------------------------
+_CONN_LEITURA: Optional[sqlite3.Connection] = None
+
+
+def _iniciar_leitor(db_path: str):
+    """Cada processo do pool abre sua própria conexão somente leitura."""
+    global _CONN_LEITURA
+    _CONN_LEITURA = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+
 
-        return {
-            "linhas_totais_filtradas": total,
-            "verificadas": verificadas,
-            "atualizadas": atualizadas,
-            "inalteradas": inalteradas,
-        }
+def _limpar_faixa(args):
+    """
+    Tarefa do pool: lê as linhas pendentes com rowid em [ini, fim], limpa os
+    textos e devolve (updates, controle, lidos) como _limpar_linhas; só as
+    linhas alteradas levam o texto de volta ao processo principal.
+    """
+    table, text_col, sql, params, versao, reprocessar, ini, fim = args
+    rows = _CONN_LEITURA.execute(sql, {**params, "ini": ini, "fim": fim}).fetchall()
+    return _limpar_linhas(rows, table, text_col, versao, reprocessar)
+
+
+def limpar_coluna_sqlite_paralelo(
+    db_path: Path,
+    table: str,
+    id_col: str,
+    text_col: str,
+    where: Optional[str] = None,
+    workers: Optional[int] = None,
+    linhas_por_faixa: int = 5_000,
+    max_pendentes: Optional[int] = None,
+    commit_every: int = 20_000,
+    guardar_originais: bool = False,
+    conferir_hash: bool = False,
+    reprocessar: bool = False,
+) -> dict:
+    """
+    Mesma limpeza (incremental) de limpar_coluna_sqlite, com o trabalho de
+    regex distribuído entre processos.
+
+    A tabela é dividida em faixas de rowid; cada processo lê a sua faixa por
+    uma conexão própria somente leitura e devolve apenas as linhas alteradas.
+    O processo principal é o único escritor: aplica cada resultado com
+    executemany assim que chega. No máximo `max_pendentes` faixas (padrão:
+    2 por processo) ficam em andamento ou com resultado não gravado, o que
+    limita a memória usada.
+
+    O banco é colocado em WAL, necessário para os leitores trabalharem
+    enquanto o escritor grava. Requer tabela com rowid.
+
+    Retorna o mesmo dict de contagens de limpar_coluna_sqlite.
+    """
+    workers = workers or os.cpu_count() or 1
+    max_pendentes = max_pendentes or 2 * workers
+
+    conn = sqlite3.connect(str(db_path))
+    try:
+        conn.execute("PRAGMA journal_mode=WAL;")
+        conn.execute("PRAGMA synchronous=NORMAL;")
+        _garantir_controle(conn)
+        _garantir_gatilho(conn, table, id_col, text_col)
+        versao = versao_regras()
+        total = _count_rows(conn, table, where)
+        ini, fim = conn.execute(f"SELECT MIN(rowid), MAX(rowid) FROM {table}").fetchone()
+        verificadas = atualizadas = 0
+        pendentes = 0
+        if ini is None:
+            return _estatisticas(total, 0, 0, versao)
+
+        sql = _sql_pendentes(table, id_col, text_col, where, reprocessar, conferir_hash, faixa=True)
+        params = _params(table, text_col, versao, _marca(conn, table, text_col, versao))
+        faixas = (
+            (table, text_col, sql, params, versao, reprocessar, lo, min(lo + linhas_por_faixa - 1, fim))
+            for lo in range(ini, fim + 1, linhas_por_faixa)
+        )
+
+        def gravar(fut):
+            nonlocal verificadas, atualizadas, pendentes
+            updates, controle, lidos = fut.result()
+            _gravar(conn, table, id_col, text_col, updates, controle, guardar_originais, lidos)
+            verificadas += len(controle)
+            atualizadas += len(updates)
+            pendentes += len(controle)
+
+        with ProcessPoolExecutor(
+            max_workers=workers, initializer=_iniciar_leitor, initargs=(str(db_path),)
+        ) as pool:
+            em_andamento = set()
+            for faixa in faixas:
+                em_andamento.add(pool.submit(_limpar_faixa, faixa))
+                if len(em_andamento) < max_pendentes:
+                    continue
+                prontas, em_andamento = wait(em_andamento, return_when=FIRST_COMPLETED)
+                for fut in prontas:
+                    gravar(fut)
+                if pendentes >= commit_every:
+                    conn.commit()
+                    pendentes = 0
+
+            for fut in em_andamento:
+                gravar(fut)
+        if where is None:
+            _gravar_marca(conn, table, text_col, versao, fim)
+        conn.commit()
+
+        return _estatisticas(total, verificadas, atualizadas, versao)
     finally:
         conn.close()
 
+
 # ------------------------------------------------------------
 # Exemplo de uso
 # ------------------------------------------------------------
 if __name__ == "__main__":
-    stats = limpar_coluna_sqlite(
+    stats = limpar_coluna_sqlite_paralelo(
         db_path=PATH_PRONUNCIAMENTOS_V2,
         table="Discursos",            # ajuste para o nome real
         id_col="CodigoPronunciamento",# ajuste para a PK/única
         text_col="TextoIntegral",     # ajuste para a coluna de texto
         where=None,                   # ou, por exemplo: "Data BETWEEN '2007-01-01' AND '2024-12-31'"
-        batch_size=5000,
+        workers=None,                 # None = todos os núcleos; limpar_coluna_sqlite() é a versão serial
         commit_every=20000,
     )
     print(stats)
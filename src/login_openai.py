@@ -1,5 +1,5 @@
 import os
-from openai import OpenAI
+from openai import OpenAI, AsyncOpenAI
 
 def login():
     """
@@ -14,3 +14,18 @@ def login():
         print("Configure a variável de ambiente OPENAI_API_KEY")
 
     return OpenAI(api_key=api_key)
+
+def login_async(base_url=None):
+    """
+    Retorna um cliente AsyncOpenAI para o modo tempo real (src/analise_async.py).
+    Os retries ficam a cargo do chamador (max_retries=0). `base_url` permite
+    apontar para um servidor local de testes.
+
+    Returns:
+        AsyncOpenAI: Cliente assíncrono da API OpenAI.
+    """
+    api_key = os.getenv("OPENAI_API_KEY")
+    if not api_key:
+        print("Configure a variável de ambiente OPENAI_API_KEY")
+
+    return AsyncOpenAI(api_key=api_key or "sem-chave", base_url=base_url, max_retries=0)
@@ -0,0 +1,318 @@
+# -*- coding: utf-8 -*-
+"""
+Manifesto persistente dos runs em batch: um registro por discurso, modelo e
+hash do schema, com o status do processamento.
+
+Status:
+- "enviado":   discurso submetido em um batch ainda não finalizado
+- "concluido": resposta recebida com sucesso (status_code 200)
+- "falhou":    erro na resposta, batch expirado/cancelado/falho
+
+create_jsonl consulta o manifesto para enfileirar só o que falta (ausentes ou
+"falhou"); wait_and_download atualiza o manifesto conforme os resultados chegam.
+
+Discursos divididos em janelas (custom_id disc-{codigo}-j{i}-o{offset}-n{total})
+têm também o status de cada janela, na tabela manifesto_janelas. O discurso
+só passa a "concluido" quando todas as suas janelas foram concluídas (no
+batch ou vindas do cache); uma janela que falha deixa o discurso "falhou" e
+ele volta inteiro para a fila (as janelas já respondidas saem do cache).
+Na partida, os batches com discursos ainda "enviado" são consultados
+(batches_em_aberto) para que uma queda ou um batch expirado sem acompanhamento
+não deixe discursos presos.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import sqlite3
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+PATH_MANIFESTO = Path("data/batch_figuras/manifesto.sqlite")
+
+STATUS_ENVIADO = "enviado"
+STATUS_CONCLUIDO = "concluido"
+STATUS_FALHOU = "falhou"
+
+
+def schema_hash(schema: dict) -> str:
+    """Hash estável do schema (JSON canônico)."""
+    raw = json.dumps(schema, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()[:16]
+
+
+def codigo_de_custom_id(custom_id: Optional[str]) -> Optional[int]:
+    """
+    Extrai o CodigoPronunciamento de um custom_id no formato disc-{codigo}
+    (ou disc-{codigo}-j{indice}-o{offset}-n{total}, para janelas de um discurso).
+    """
+    try:
+        return int(str(custom_id).split("-")[1])
+    except (IndexError, TypeError, ValueError):
+        return None
+
+
+def janela_de_custom_id(custom_id: Optional[str]) -> Optional[Tuple[int, int]]:
+    """(indice, total de janelas) de um custom_id de janela; None para discursos inteiros."""
+    indice = total = None
+    for p in str(custom_id).split("-")[2:]:
+        if p[:1] == "j" and p[1:].isdigit():
+            indice = int(p[1:])
+        elif p[:1] == "n" and p[1:].isdigit():
+            total = int(p[1:])
+    if indice is None or total is None:
+        return None
+    return indice, total
+
+
+def abrir_manifesto(path: Path = PATH_MANIFESTO) -> sqlite3.Connection:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(str(path))
+    conn.execute("PRAGMA journal_mode=WAL;")
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS manifesto (
+            CodigoPronunciamento INTEGER NOT NULL,
+            model TEXT NOT NULL,
+            schema_hash TEXT NOT NULL,
+            status TEXT NOT NULL,
+            batch_id TEXT,
+            erro TEXT,
+            atualizado_em TEXT NOT NULL DEFAULT (datetime('now')),
+            PRIMARY KEY (CodigoPronunciamento, model, schema_hash)
+        )
+        """
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_manifesto_batch ON manifesto(batch_id, status);")
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS manifesto_janelas (
+            custom_id TEXT NOT NULL,
+            model TEXT NOT NULL,
+            schema_hash TEXT NOT NULL,
+            CodigoPronunciamento INTEGER NOT NULL,
+            indice INTEGER NOT NULL,
+            n_janelas INTEGER NOT NULL,
+            status TEXT NOT NULL,
+            batch_id TEXT,
+            erro TEXT,
+            atualizado_em TEXT NOT NULL DEFAULT (datetime('now')),
+            PRIMARY KEY (custom_id, model, schema_hash)
+        )
+        """
+    )
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_janelas_codigo ON manifesto_janelas(CodigoPronunciamento, model, schema_hash);"
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_janelas_batch ON manifesto_janelas(batch_id, status);")
+    conn.commit()
+    return conn
+
+
+def codigos_resolvidos(conn: sqlite3.Connection, model: str, shash: str) -> Set[int]:
+    """
+    Discursos que NÃO devem ser reenfileirados: já concluídos ou ainda em voo
+    (status "enviado"). Os que falharam ficam de fora e voltam para a fila.
+    """
+    cur = conn.execute(
+        "SELECT CodigoPronunciamento FROM manifesto WHERE model = ? AND schema_hash = ? AND status IN (?, ?)",
+        (model, shash, STATUS_CONCLUIDO, STATUS_ENVIADO),
+    )
+    return {row[0] for row in cur}
+
+
+def codigos_concluidos(conn: sqlite3.Connection, model: str, shash: str) -> Set[int]:
+    """Discursos com status "concluido" (resposta recebida)."""
+    cur = conn.execute(
+        "SELECT CodigoPronunciamento FROM manifesto WHERE model = ? AND schema_hash = ? AND status = ?",
+        (model, shash, STATUS_CONCLUIDO),
+    )
+    return {row[0] for row in cur}
+
+
+def batches_em_aberto(conn: sqlite3.Connection, model: str, shash: str) -> List[str]:
+    """
+    batch_ids com discursos ainda "enviado". Se o processo caiu depois da
+    submissão ou o batch terminou sem ninguém acompanhando, esses registros
+    ficariam presos; batch_figuras.reconciliar_manifesto consulta cada batch
+    na partida e baixa os resultados ou marca "falhou".
+    """
+    cur = conn.execute(
+        "SELECT DISTINCT batch_id FROM manifesto WHERE model = ? AND schema_hash = ? AND status = ? "
+        "AND batch_id IS NOT NULL",
+        (model, shash, STATUS_ENVIADO),
+    )
+    return [row[0] for row in cur]
+
+
+def marcar(
+    conn: sqlite3.Connection,
+    codigos: Iterable[int],
+    model: str,
+    shash: str,
+    status: str,
+    batch_id: Optional[str] = None,
+    erro: Optional[str] = None,
+) -> int:
+    """Upsert do status de vários discursos; retorna quantos foram gravados."""
+    linhas = [(int(c), model, shash, status, batch_id, erro) for c in codigos if c is not None]
+    return _upsert(conn, linhas)
+
+
+def _upsert(conn: sqlite3.Connection, linhas: list) -> int:
+    conn.executemany(
+        """
+        INSERT INTO manifesto (CodigoPronunciamento, model, schema_hash, status, batch_id, erro, atualizado_em)
+        VALUES (?, ?, ?, ?, ?, ?, datetime('now'))
+        ON CONFLICT (CodigoPronunciamento, model, schema_hash) DO UPDATE SET
+            status = excluded.status,
+            batch_id = COALESCE(excluded.batch_id, manifesto.batch_id),
+            erro = excluded.erro,
+            atualizado_em = excluded.atualizado_em
+        """,
+        linhas,
+    )
+    conn.commit()
+    return len(linhas)
+
+
+def _upsert_janelas(conn: sqlite3.Connection, linhas: list) -> int:
+    """linhas: (custom_id, model, schema_hash, codigo, indice, n_janelas, status, batch_id, erro)."""
+    conn.executemany(
+        """
+        INSERT INTO manifesto_janelas
+            (custom_id, model, schema_hash, CodigoPronunciamento, indice, n_janelas, status, batch_id, erro, atualizado_em)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, datetime('now'))
+        ON CONFLICT (custom_id, model, schema_hash) DO UPDATE SET
+            status = excluded.status,
+            batch_id = COALESCE(excluded.batch_id, manifesto_janelas.batch_id),
+            erro = excluded.erro,
+            atualizado_em = excluded.atualizado_em
+        """,
+        linhas,
+    )
+    conn.commit()
+    return len(linhas)
+
+
+def _janelas_completas(conn: sqlite3.Connection, model: str, shash: str, totais: Dict[int, int]) -> Set[int]:
+    """Discursos ({codigo: total de janelas}) com todas as janelas 0..total-1 concluídas."""
+    completos = set()
+    for codigo, total in totais.items():
+        (n,) = conn.execute(
+            "SELECT count(DISTINCT indice) FROM manifesto_janelas WHERE CodigoPronunciamento = ? AND model = ? "
+            "AND schema_hash = ? AND n_janelas = ? AND status = ?",
+            (codigo, model, shash, total, STATUS_CONCLUIDO),
+        ).fetchone()
+        if n >= total:
+            completos.add(codigo)
+    return completos
+
+
+def custom_ids_do_jsonl(jsonl_path: Path) -> Iterable[str]:
+    """Lê os custom_id de um JSONL de requisições ou de resultados."""
+    with Path(jsonl_path).open("r", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line).get("custom_id")
+
+
+def marcar_enviados(conn: sqlite3.Connection, jsonl_path: Path, model: str, shash: str, batch_id: str) -> int:
+    codigos, janelas = [], []
+    for cid in custom_ids_do_jsonl(jsonl_path):
+        codigo = codigo_de_custom_id(cid)
+        codigos.append(codigo)
+        jan = janela_de_custom_id(cid)
+        if jan is not None and codigo is not None:
+            janelas.append((cid, model, shash, codigo, *jan, STATUS_ENVIADO, batch_id, None))
+    _upsert_janelas(conn, janelas)
+    return marcar(conn, codigos, model, shash, STATUS_ENVIADO, batch_id=batch_id)
+
+
+def atualizar_com_resultados(
+    conn: sqlite3.Connection,
+    batch_id: str,
+    model: str,
+    shash: str,
+    output_path: Optional[Path] = None,
+    error_path: Optional[Path] = None,
+) -> dict:
+    """
+    Atualiza o manifesto com o output (e o arquivo de erros) de um batch
+    finalizado. Discursos do batch que continuam "enviado" depois disso não
+    tiveram resposta (batch expirado/cancelado) e são marcados como "falhou".
+    Respostas de janelas atualizam manifesto_janelas; o discurso vira
+    "concluido" só quando todas as suas janelas estão concluídas (neste batch,
+    em outro ou no cache) e "falhou" se alguma janela deste batch falhou.
+    """
+    ok, falhas = [], []
+    jan_ok, jan_falhas = [], []
+    for path in (output_path, error_path):
+        if path is None or not Path(path).exists():
+            continue
+        with Path(path).open("r", encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                obj = json.loads(line)
+                cid = obj.get("custom_id")
+                codigo = codigo_de_custom_id(cid)
+                if codigo is None:
+                    continue
+                jan = janela_de_custom_id(cid)
+                resp = obj.get("response") or {}
+                body = resp.get("body") or {}
+                if (
+                    not obj.get("error")
+                    and resp.get("status_code") == 200
+                    and body.get("status", "completed") == "completed"
+                ):
+                    if jan is None:
+                        ok.append(codigo)
+                    else:
+                        jan_ok.append((cid, model, shash, codigo, *jan, STATUS_CONCLUIDO, batch_id, None))
+                else:
+                    erro = obj.get("error") or body.get("error") or body.get("incomplete_details")
+                    erro = json.dumps(erro, ensure_ascii=False)[:500]
+                    if jan is None:
+                        falhas.append((codigo, erro))
+                    else:
+                        jan_falhas.append((cid, model, shash, codigo, *jan, STATUS_FALHOU, batch_id, erro))
+
+    # janelas do batch sem resposta nenhuma
+    respondidas = {j[0] for j in jan_ok + jan_falhas}
+    sem_resposta = [
+        (cid, model, shash, codigo, indice, total, STATUS_FALHOU, batch_id, "sem resposta no batch")
+        for cid, codigo, indice, total in conn.execute(
+            "SELECT custom_id, CodigoPronunciamento, indice, n_janelas FROM manifesto_janelas "
+            "WHERE batch_id = ? AND model = ? AND schema_hash = ? AND status = ?",
+            (batch_id, model, shash, STATUS_ENVIADO),
+        ).fetchall()
+        if cid not in respondidas
+    ]
+    _upsert_janelas(conn, jan_ok + jan_falhas + sem_resposta)
+    # uma janela que falhou derruba o discurso; as demais o concluem quando
+    # todas as janelas dele estão concluídas
+    totais: Dict[int, int] = {}
+    falhos: Dict[int, str] = {}
+    for _, _, _, codigo, _, total, status, _, erro in jan_ok + jan_falhas + sem_resposta:
+        totais[codigo] = total
+        if status == STATUS_FALHOU:
+            falhos.setdefault(codigo, erro)
+    completos = _janelas_completas(conn, model, shash, {c: t for c, t in totais.items() if c not in falhos})
+    ok += sorted(completos)
+    falhas += [(c, f"janela: {e}"[:500]) for c, e in falhos.items()]
+
+    marcar(conn, ok, model, shash, STATUS_CONCLUIDO, batch_id=batch_id)
+    _upsert(conn, [(c, model, shash, STATUS_FALHOU, batch_id, e) for c, e in falhas if c is not None])
+
+    # discursos ainda "enviado" neste batch: sem resposta, ou janelas que não
+    # completaram o discurso
+    cur = conn.execute(
+        "UPDATE manifesto SET status = ?, erro = ?, atualizado_em = datetime('now') "
+        "WHERE batch_id = ? AND model = ? AND schema_hash = ? AND status = ?",
+        (STATUS_FALHOU, "sem resposta no batch", batch_id, model, shash, STATUS_ENVIADO),
+    )
+    conn.commit()
+    return {"concluidos": len(ok), "falhas": len(falhas), "sem_resposta": cur.rowcount}
@@ -1,11 +1,16 @@
 # -*- coding: utf-8 -*-
 # Amostragem estratificada por ano + contagem de tokens e estimativa de custos (gpt-5)
 
+import hashlib
 import sqlite3
 from pathlib import Path
+from typing import Iterable
 import pandas as pd
 import numpy as np
 
+from src import calibracao as cb
+from src.contagens import TBL_CONTAGENS, atualizar_contagens
+
 # tiktoken para contagem de tokens
 try:
     import tiktoken
@@ -45,6 +50,111 @@ def count_tokens(text: str, enc) -> int:
     return len(enc.encode(text))
 
 
+# ---------------------------
+# CONTAGEM EM LOTE + CACHE
+# ---------------------------
+# Cache persistente de contagens: (sha1 do texto, nome do encoding) -> tokens.
+# Reestimar o orçamento com outra fração de amostra (ou empacotar requests
+# no batch_figuras) só tokeniza os textos ainda não vistos.
+TOKEN_CACHE_PATH = Path("data/tokens_cache.sqlite")
+TOKEN_CHUNK = 1_000      # textos por chamada de encode_ordinary_batch
+TOKEN_THREADS = 8        # threads do tiktoken (o encode em lote libera o GIL)
+
+
+def _as_text(text) -> str:
+    if not isinstance(text, str):
+        text = "" if text is None else str(text)
+    return text
+
+
+def _text_hash(text: str) -> str:
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+def count_tokens_batch(
+    texts: Iterable,
+    enc,
+    chunk_size: int = TOKEN_CHUNK,
+    num_threads: int = TOKEN_THREADS,
+) -> list[int]:
+    """
+    Conta tokens de vários textos com encode_ordinary_batch do tiktoken
+    (multithread), em blocos de `chunk_size` textos.
+    """
+    texts = [_as_text(t) for t in texts]
+    counts: list[int] = []
+    for i in range(0, len(texts), chunk_size):
+        ids = enc.encode_ordinary_batch(texts[i : i + chunk_size], num_threads=num_threads)
+        counts.extend(len(x) for x in ids)
+    return counts
+
+
+def _open_token_cache(cache_path: str | Path) -> sqlite3.Connection:
+    Path(cache_path).parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(str(cache_path))
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS TokensCache (
+            hash TEXT NOT NULL,
+            encoding TEXT NOT NULL,
+            n_tokens INTEGER NOT NULL,
+            PRIMARY KEY (hash, encoding)
+        ) WITHOUT ROWID
+        """
+    )
+    return conn
+
+
+def count_tokens_cached(
+    texts: Iterable,
+    model: str = "gpt-5",
+    cache_path: str | Path | None = TOKEN_CACHE_PATH,
+    chunk_size: int = TOKEN_CHUNK,
+    num_threads: int = TOKEN_THREADS,
+) -> list[int]:
+    """
+    Tokens de cada texto (na ordem recebida), consultando antes o cache em
+    `cache_path`; só os textos ausentes do cache são tokenizados (em lote) e
+    gravados. Textos repetidos são contados uma vez. cache_path=None
+    desliga o cache.
+    """
+    enc = _get_encoding(model)
+    texts = [_as_text(t) for t in texts]
+    if cache_path is None:
+        return count_tokens_batch(texts, enc, chunk_size, num_threads)
+
+    hashes = [_text_hash(t) for t in texts]
+    conn = _open_token_cache(cache_path)
+    try:
+        known: dict[str, int] = {}
+        unique = list(dict.fromkeys(hashes))
+        for i in range(0, len(unique), 500):
+            part = unique[i : i + 500]
+            ph = ",".join("?" for _ in part)
+            known.update(
+                conn.execute(
+                    f"SELECT hash, n_tokens FROM TokensCache WHERE encoding = ? AND hash IN ({ph})",
+                    [enc.name, *part],
+                )
+            )
+
+        missing: dict[str, str] = {}
+        for h, t in zip(hashes, texts):
+            if h not in known:
+                missing.setdefault(h, t)
+        pending = list(missing.items())
+        for i in range(0, len(pending), chunk_size):
+            part = pending[i : i + chunk_size]
+            counts = count_tokens_batch([t for _, t in part], enc, chunk_size, num_threads)
+            rows = [(h, enc.name, n) for (h, _), n in zip(part, counts)]
+            conn.executemany("INSERT OR REPLACE INTO TokensCache VALUES (?, ?, ?)", rows)
+            conn.commit()  # progresso preservado se a contagem for interrompida
+            known.update((h, n) for h, _, n in rows)
+    finally:
+        conn.close()
+    return [known[h] for h in hashes]
+
+
 def _ensure_fraction(value: float) -> float:
     """
     Converte percentuais >1 (ex.: 10 para 10%) em fração (0.10).
@@ -55,6 +165,43 @@ def _ensure_fraction(value: float) -> float:
     return value / 100.0 if value > 1 else value
 
 
+SAMPLE_FETCH_CHUNK = 500  # ids por consulta ao buscar os textos sorteados
+
+
+def _eligible_by_year(conn: sqlite3.Connection, table: str, min_words: int) -> pd.DataFrame:
+    """
+    (CodigoPronunciamento, Ano) dos discursos com mais de `min_words`
+    palavras. O filtro roda no SQL sobre ContagensDiscursos (índice por
+    n_palavras); o TextoIntegral não é lido.
+    """
+    df = pd.read_sql_query(
+        f"""
+        SELECT d.CodigoPronunciamento, d.Data
+        FROM {TBL_CONTAGENS} c
+        JOIN {table} d ON d.CodigoPronunciamento = c.CodigoPronunciamento
+        WHERE c.n_palavras > ?
+        """,
+        conn,
+        params=(int(min_words),),
+    )
+    datas = pd.to_datetime(df["Data"], errors="coerce", utc=True).dt.tz_convert(None)
+    df = df.loc[datas.notna(), ["CodigoPronunciamento"]]
+    df["Ano"] = datas.dropna().dt.year.astype(int)
+    return df
+
+
+def _iter_sample_chunks(conn: sqlite3.Connection, table: str, ids: list, cols: list[str], chunk_size: int):
+    """Colunas `cols` dos discursos sorteados, `chunk_size` ids por consulta."""
+    for i in range(0, len(ids), chunk_size):
+        part = ids[i : i + chunk_size]
+        ph = ",".join("?" for _ in part)
+        yield pd.read_sql_query(
+            f"SELECT {', '.join(cols)} FROM {table} WHERE CodigoPronunciamento IN ({ph})",
+            conn,
+            params=part,
+        )
+
+
 def sample_discursos_by_year(
     db_path: str | Path = "data/DiscursosV2.sqlite",
     table: str = "Discursos",
@@ -66,13 +213,18 @@ def sample_discursos_by_year(
     estimate_output_tokens_per_item: int | None = None,
     prompt_cached: bool = True,
     extra_columns: list[str] | None = None,
+    token_cache: str | Path | None = TOKEN_CACHE_PATH,
+    keep_text: bool = True,
+    update_counts: bool = True,
+    chunk_size: int = SAMPLE_FETCH_CHUNK,
+    calibration: dict | str | Path | None = None,
 ):
     """
     Amostra discursos por ano e estima custos de processamento no modelo gpt-5.
 
     Parâmetros:
     - db_path: caminho para o SQLite.
-    - table: nome da tabela (espera colunas: Data, TextoIntegral).
+    - table: nome da tabela (espera colunas: CodigoPronunciamento, Data, TextoIntegral).
     - pct_per_year: fração por ano (0.10 = 10%). Se passado como 10, será convertido para 0.10.
     - min_words: mínimo de palavras do TextoIntegral para filtrar.
     - seed: semente do sorteio.
@@ -81,6 +233,20 @@ def sample_discursos_by_year(
     - estimate_output_tokens_per_item: estimativa de tokens de saída por item (opcional).
     - prompt_cached: se True, precifica tokens do prompt como cached_input.
     - extra_columns: colunas adicionais a carregar (ex.: ['CodigoPronunciamento']).
+    - token_cache: SQLite do cache de contagens de tokens (None desliga o cache).
+    - keep_text: se False, descarta o TextoIntegral de cada bloco depois de
+      contar os tokens (memória limitada ao bloco, não à amostra).
+    - update_counts: atualiza antes a tabela ContagensDiscursos (incremental;
+      na primeira vez lê todos os textos, em lotes).
+    - chunk_size: ids por consulta ao buscar os textos sorteados.
+    - calibration: calibração de src/calibracao.py (dict ou caminho do JSON).
+      Sem estimate_output_tokens_per_item, a saída de cada item é a prevista
+      para o seu tamanho de entrada; o resumo total ganha est_batch_horas
+      (duração prevista de um batch com toda a amostra).
+
+    O sorteio usa só (CodigoPronunciamento, Data) dos discursos com mais de
+    `min_words` palavras, filtrados no SQL pela tabela ContagensDiscursos
+    (src/contagens.py); os textos são lidos depois, apenas dos sorteados.
 
     Retorna:
     - df_sample: DataFrame com amostra e colunas de tokens e custos.
@@ -98,38 +264,42 @@ def sample_discursos_by_year(
 
     conn = sqlite3.connect(str(db_path))
     try:
-        # Leitura das colunas necessárias
-        query = f"SELECT {', '.join(cols)} FROM {table}"
-        df = pd.read_sql_query(query, conn)
+        # Contagem exata de palavras numa tabela lateral indexada
+        if update_counts:
+            atualizar_contagens(conn, table, com_tokens=False)
+        df = _eligible_by_year(conn, table, min_words)
+
+        if df.empty:
+            raise ValueError("Após o filtro de palavras mínimas, não há discursos para amostrar.")
+
+        # Amostragem por ano (só ids; nenhum texto em memória)
+        rng = np.random.default_rng(seed)
+        sorteados = []
+        for _, g in df.groupby("Ano", sort=True):
+            n = max(1, int(np.floor(len(g) * pct)))
+            sorteados.extend(rng.choice(g["CodigoPronunciamento"].to_numpy(), size=n, replace=False).tolist())
+        ano_por_id = df.set_index("CodigoPronunciamento")["Ano"]
+
+        # Textos só dos sorteados, em blocos; tokens contados bloco a bloco
+        fetch_cols = cols if "CodigoPronunciamento" in cols else cols + ["CodigoPronunciamento"]
+        partes = []
+        for chunk in _iter_sample_chunks(conn, table, sorteados, fetch_cols, chunk_size):
+            chunk["n_tokens_texto"] = count_tokens_cached(chunk["TextoIntegral"], model, token_cache)
+            if not keep_text:
+                chunk = chunk.drop(columns=["TextoIntegral"])
+            partes.append(chunk)
     finally:
         conn.close()
 
-    # Parse de datas e Ano
-    df["Data"] = pd.to_datetime(df["Data"], errors="coerce", utc=True).dt.tz_convert(None)
-    df = df.dropna(subset=["Data"])
-    df["Ano"] = df["Data"].dt.year.astype(int)
-
-    # Filtro por número mínimo de palavras
-    # (contagem simples de palavras por espaços; ajuste se quiser usar regex)
-    word_counts = df["TextoIntegral"].fillna("").astype(str).str.split().map(len)
-    df = df.loc[word_counts > min_words].copy()
+    df_sample = pd.concat(partes, ignore_index=True)
+    df_sample["Data"] = pd.to_datetime(df_sample["Data"], errors="coerce", utc=True).dt.tz_convert(None)
+    df_sample["Ano"] = df_sample["CodigoPronunciamento"].map(ano_por_id).astype(int)
+    df_sample = df_sample.sort_values(["Ano", "CodigoPronunciamento"], kind="stable").reset_index(drop=True)
+    if "CodigoPronunciamento" not in cols:
+        df_sample = df_sample.drop(columns=["CodigoPronunciamento"])
 
-    if df.empty:
-        raise ValueError("Após o filtro de palavras mínimas, não há discursos para amostrar.")
-
-    # Amostragem por ano
-    rng = np.random.default_rng(seed)
-    def _sample_group(g):
-        n = max(1, int(np.floor(len(g) * pct)))
-        # amostragem estável: usa permutation do numpy sobre o índice
-        idx = rng.choice(g.index.values, size=n, replace=False)
-        return g.loc[idx]
-
-    df_sample = df.groupby("Ano", group_keys=False).apply(_sample_group).reset_index(drop=True)
-
-    # Contagem de tokens
+    # Contagem de tokens (prompt)
     enc = _get_encoding(model)
-    df_sample["n_tokens_texto"] = df_sample["TextoIntegral"].apply(lambda x: count_tokens(x, enc))
     n_tokens_prompt = count_tokens(prompt, enc)
 
     # Custos (USD por item)
@@ -163,10 +333,15 @@ def sample_discursos_by_year(
         )
 
     # Custo de output (opcional, estimado)
+    cal = cb.carregar(calibration) if calibration is not None else None
     if estimate_output_tokens_per_item is not None and estimate_output_tokens_per_item >= 0:
         cost_per_token_output = price_output / 1_000_000.0
         df_sample["est_output_tokens"] = int(estimate_output_tokens_per_item)
         df_sample["est_custo_output_usd"] = df_sample["est_output_tokens"] * cost_per_token_output
+    elif cal is not None:
+        cost_per_token_output = price_output / 1_000_000.0
+        df_sample["est_output_tokens"] = cb.prever_saida(cal, df_sample["n_tokens_input_total"])
+        df_sample["est_custo_output_usd"] = df_sample["est_output_tokens"] * cost_per_token_output
     else:
         df_sample["est_output_tokens"] = 0
         df_sample["est_custo_output_usd"] = 0.0
@@ -178,7 +353,7 @@ def sample_discursos_by_year(
     df_summary_year = (
         df_sample.groupby("Ano")
         .agg(
-            n_itens=("TextoIntegral", "size"),
+            n_itens=("n_tokens_texto", "size"),
             tokens_texto=("n_tokens_texto", "sum"),
             tokens_prompt=("n_tokens_prompt", "sum"),
             tokens_input_total=("n_tokens_input_total", "sum"),
@@ -201,6 +376,10 @@ def sample_discursos_by_year(
             "custo_total_usd": float(df_summary_year["custo_total_usd"].sum()),
         }]
     )
+    if cal is not None:
+        duracao = cb.prever_duracao(cal, float(df_sample["est_output_tokens"].sum()))
+        if duracao is not None:
+            df_summary_total["est_batch_horas"] = duracao / 3600
 
     return df_sample, df_summary_year, df_summary_total
 
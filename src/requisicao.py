@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+"""
+Corpo da requisição ao /v1/responses usado tanto na chamada avulsa
+(chamada_openai_demanda_simples) quanto no batch (batch_figuras).
+"""
+
+from __future__ import annotations
+
+import copy
+from functools import lru_cache
+from typing import Any, Dict, Iterable, Optional
+
+from src.structured_outputs import schema
+
+PROMPT_DESENVOLVEDOR = "Você é um linguista que analisa figuras de linguagem em discursos no Senado."
+INSTRUCAO_USUARIO = "Analise a seguinte fala:\n\n"
+LABELS = schema["schema"]["$defs"]["Span"]["properties"]["label"]["enum"]
+
+
+@lru_cache(maxsize=8)
+def _schema_restrito(pedidos: frozenset) -> Dict[str, Any]:
+    restrito = copy.deepcopy(schema)
+    restrito["schema"]["$defs"]["Span"]["properties"]["label"]["enum"] = [l for l in LABELS if l in pedidos]
+    return restrito
+
+
+def schema_com_labels(labels: Iterable[str]) -> Dict[str, Any]:
+    """Schema com o enum de label restrito a `labels` (na ordem original); compartilhado, não alterar."""
+    return _schema_restrito(frozenset(labels))
+
+
+def build_request_body(model: str, discurso: str, labels: Optional[Iterable[str]] = None) -> Dict[str, Any]:
+    """
+    Monta o 'body' da requisição para /v1/responses exatamente como na função analisar_figuras().
+    Com `labels`, o schema só admite essas figuras (as demais ficam a cargo
+    do detector local, src/detector_lexical.py).
+    """
+    return {
+        "model": model,
+        "input": [
+            {
+                "role": "developer",
+                "content": [
+                    {
+                        "type": "input_text",
+                        "text": PROMPT_DESENVOLVEDOR
+                    }
+                ]
+            },
+            {
+                "role": "user",
+                "content": [
+                    {
+                        "type": "input_text",
+                        "text": f"{INSTRUCAO_USUARIO}{discurso}"
+                    }
+                ]
+            }
+        ],
+        "text": {
+            "format": schema if labels is None else schema_com_labels(labels),
+            "verbosity": "medium"
+        },
+        "reasoning": {
+            "effort": "medium"
+        },
+        "tools": [],
+        "store": True
+    }
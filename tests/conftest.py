@@ -0,0 +1,7 @@
+# -*- coding: utf-8 -*-
+"""Os testes importam `src` como os scripts da raiz do repositório."""
+
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+"""
+Modo tempo real (src/analise_async.py) contra um servidor local que imita o
+/v1/responses: 200 direto, 429 seguido de 200 e 500 em todas as tentativas.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from src import analise_async
+from src.login_openai import login_async
+from src.requisicao import INSTRUCAO_USUARIO
+
+RESPOSTA_OK = {
+    "id": "resp_teste",
+    "object": "response",
+    "created_at": 0,
+    "model": "gpt-5",
+    "status": "completed",
+    "output": [{
+        "type": "message",
+        "id": "msg_teste",
+        "role": "assistant",
+        "status": "completed",
+        "content": [{"type": "output_text", "text": json.dumps({"spans": []}), "annotations": []}],
+    }],
+    "parallel_tool_calls": False,
+    "tool_choice": "auto",
+    "tools": [],
+    "usage": {
+        "input_tokens": 10,
+        "input_tokens_details": {"cached_tokens": 0},
+        "output_tokens": 5,
+        "output_tokens_details": {"reasoning_tokens": 0},
+        "total_tokens": 15,
+    },
+}
+
+
+def _roteiro(texto: str, tentativa: int) -> int:
+    """Status devolvido pelo servidor para o discurso `texto` na tentativa n (1, 2, ...)."""
+    if texto.endswith("429-uma-vez"):
+        return 429 if tentativa == 1 else 200
+    if texto.endswith("500-sempre"):
+        return 500
+    return 200
+
+
+@pytest.fixture
+def servidor():
+    tentativas = {}
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+            texto = body["input"][1]["content"][0]["text"]
+            tentativas[texto] = tentativas.get(texto, 0) + 1
+            status = _roteiro(texto, tentativas[texto])
+            payload = RESPOSTA_OK if status == 200 else {"error": {"message": f"erro {status}", "type": "teste"}}
+            raw = json.dumps(payload).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(raw)))
+            if status == 429:
+                self.send_header("retry-after", "0")
+            self.end_headers()
+            self.wfile.write(raw)
+
+        def log_message(self, *args):
+            pass
+
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield f"http://127.0.0.1:{httpd.server_address[1]}/v1", tentativas
+    finally:
+        httpd.shutdown()
+        httpd.server_close()
+
+
+def test_retries_e_linhas_de_saida(servidor, tmp_path, monkeypatch):
+    base_url, tentativas = servidor
+    adquiridas = []
+
+    class LimitadorContado(analise_async.LimitadorTaxa):
+        async def adquirir(self, n_tokens):
+            adquiridas.append(n_tokens)
+            await super().adquirir(n_tokens)
+
+    monkeypatch.setattr(analise_async, "LimitadorTaxa", LimitadorContado)
+    out = tmp_path / "realtime_output.jsonl"
+    discursos = [(1, "ok"), (2, "429-uma-vez"), (3, "500-sempre")]
+
+    stats = asyncio.run(analise_async.analisar_lote(
+        login_async(base_url=base_url),
+        discursos,
+        out,
+        rpm=10_000,
+        tpm=10_000_000,
+        max_tentativas=3,
+        backoff_base=0.01,
+        backoff_max=0.02,
+    ))
+
+    assert stats == {"ok": 2, "falhas": 1, "cache": 0}
+    assert tentativas == {
+        INSTRUCAO_USUARIO + "ok": 1, INSTRUCAO_USUARIO + "429-uma-vez": 2, INSTRUCAO_USUARIO + "500-sempre": 3,
+    }
+    # cada tentativa (inclusive as repetições) passa pelo limitador
+    assert len(adquiridas) == sum(tentativas.values())
+
+    linhas = {obj["custom_id"]: obj for obj in map(json.loads, out.read_text(encoding="utf-8").splitlines())}
+    assert set(linhas) == {"disc-1", "disc-2", "disc-3"}
+    for cid in ("disc-1", "disc-2"):
+        assert linhas[cid]["error"] is None
+        assert linhas[cid]["response"]["status_code"] == 200
+        assert linhas[cid]["response"]["body"]["status"] == "completed"
+    assert linhas["disc-3"]["response"] is None
+    assert linhas["disc-3"]["error"]["status_code"] == 500
+
+
+def test_max_tentativas_invalido(tmp_path):
+    with pytest.raises(ValueError):
+        asyncio.run(analise_async.analisar_lote(None, [], tmp_path / "x.jsonl", max_tentativas=0))
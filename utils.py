@@ -1,14 +1,35 @@
+import argparse
 import json
+import os
+import sqlite3
+import tempfile
 from pathlib import Path
-from typing import Dict, Any
+from typing import Dict, Any, Iterator, List, Optional, Tuple
 
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pacsv
+import pyarrow.parquet as pq
 import streamlit as st
 
+from src import busca, cubo
+from src.manifesto import codigo_de_custom_id
+
 # ---------------------------------------------------------------------------
 # Data loading
 # ---------------------------------------------------------------------------
 
+SPANS_PARQUET = Path("data/spans_long.parquet")
+META_PARQUET = Path("data/discursos_meta.parquet")
+SAMPLE_SQLITE = Path("Amostra_1.sqlite")
+TEXTOS_SQLITE = Path("data/textos.sqlite")
+
+# Colunas mantidas na tabela de spans do dashboard (o resto fica no Parquet)
+SPAN_COLUMNS = ["CodigoPronunciamento", "label", "text", "confidence", "start_char", "end_char"]
+CATEGORICAL_COLUMNS = ["label", "NomeParlamentar", "SiglaPartidoParlamentarNaData"]
+
+
 @st.cache_data(show_spinner=False)
 def load_spans() -> pd.DataFrame:
     """Load spans dataframe.
@@ -17,9 +38,11 @@ def load_spans() -> pd.DataFrame:
     1. data/spans_long.parquet if available (faster).
     2. Parse local ``resultados_batch.jsonl`` output file.
     """
-    parquet_path = Path("data/spans_long.parquet")
+    parquet_path = SPANS_PARQUET
     if parquet_path.exists():
-        return pd.read_parquet(parquet_path)
+        available = pq.read_schema(parquet_path).names
+        df = pd.read_parquet(parquet_path, columns=[c for c in SPAN_COLUMNS if c in available])
+        return _compact(df)
 
     jsonl_path = Path("resultados_batch.jsonl")
     if not jsonl_path.exists():
@@ -30,11 +53,7 @@ def load_spans() -> pd.DataFrame:
         for line in f:
             obj = json.loads(line)
             custom_id = obj.get("custom_id", "")
-            codigo = None
-            try:
-                codigo = int(custom_id.split("-")[-1])
-            except Exception:
-                pass
+            codigo = codigo_de_custom_id(custom_id)
             # Structured output is returned as JSON string inside text
             body = obj.get("response", {}).get("body", {})
             try:
@@ -44,52 +63,538 @@ def load_spans() -> pd.DataFrame:
                 parsed = {"spans": []}
             for span in parsed.get("spans", []):
                 span["CodigoPronunciamento"] = codigo
-                rows.append(span)
-    df = pd.DataFrame(rows)
+                rows.append({k: span.get(k) for k in SPAN_COLUMNS})
+    df = pd.DataFrame(rows, columns=SPAN_COLUMNS)
+    return _compact(df)
+
+
+def _compact(df: pd.DataFrame) -> pd.DataFrame:
+    """Categorical dtype for repeated strings (labels, names, parties)."""
+    for col in CATEGORICAL_COLUMNS:
+        if col in df and df[col].dtype != "category":
+            df[col] = df[col].astype("category")
     return df
 
 
 @st.cache_data(show_spinner=False)
 def load_meta() -> pd.DataFrame:
-    """Load discurso metadata.
+    """Load discurso metadata (without the speech text).
     Expect a Parquet file ``data/discursos_meta.parquet`` with fields
     ``CodigoPronunciamento, Data, NomeParlamentar, SiglaPartidoParlamentarNaData,
-    tamanho_discurso_palavras, TextoIntegral``.
+    tamanho_discurso_palavras``; a ``TextoIntegral`` column, if present, is not read.
     If the file is absent, fall back to ``Amostra_1.sqlite``
     and fetch the same fields from table ``DiscursosAmostra``.
-    """
-    meta_path = Path("data/discursos_meta.parquet")
-    if meta_path.exists():
-        return pd.read_parquet(meta_path)
 
-    sqlite_path = Path("Amostra_1.sqlite")
-    if sqlite_path.exists():
-        import sqlite3
+    The text is fetched on demand, per speech, by :func:`load_texto`.
+    """
+    if META_PARQUET.exists():
+        cols = [c for c in pq.read_schema(META_PARQUET).names if c != "TextoIntegral"]
+        return _compact(pd.read_parquet(META_PARQUET, columns=cols))
 
-        con = sqlite3.connect(sqlite_path)
+    if SAMPLE_SQLITE.exists():
+        con = sqlite3.connect(SAMPLE_SQLITE)
         query = (
             "SELECT CodigoPronunciamento, DataPronunciamento as Data,"
             " NomeParlamentar, SiglaPartidoParlamentarNaData, TextoIntegral"
             " FROM DiscursosAmostra"
         )
-        df = pd.read_sql_query(query, con)
+        parts = []
+        # compute speech length in words chunk by chunk and drop the text
+        for chunk in pd.read_sql_query(query, con, chunksize=2_000):
+            chunk["tamanho_discurso_palavras"] = (
+                chunk["TextoIntegral"].fillna("").str.split().str.len()
+            )
+            parts.append(chunk.drop(columns="TextoIntegral"))
         con.close()
+        if not parts:
+            return pd.DataFrame()
+        return _compact(pd.concat(parts, ignore_index=True))
+
+    return pd.DataFrame()
+
 
-        # compute speech length in words
-        df["tamanho_discurso_palavras"] = (
-            df["TextoIntegral"].fillna("").str.split().apply(len)
+@st.cache_data(show_spinner=False, max_entries=64)
+def load_texto(codigo: int) -> Optional[str]:
+    """Fetch the full text of one speech.
+
+    Looks up, in order: the indexed store ``data/textos.sqlite`` (built with
+    ``python utils.py``, see :func:`build_text_store`),
+    ``data/discursos_meta.parquet`` (row-group filtered read of one row) and
+    ``Amostra_1.sqlite``. A speech missing from one source (e.g. a store built
+    before new speeches arrived) falls through to the next.
+    """
+    codigo = int(codigo)
+    if TEXTOS_SQLITE.exists():
+        con = sqlite3.connect(TEXTOS_SQLITE)
+        try:
+            row = con.execute(
+                "SELECT TextoIntegral FROM textos WHERE CodigoPronunciamento = ?", (codigo,)
+            ).fetchone()
+        finally:
+            con.close()
+        if row:
+            return row[0]
+
+    if META_PARQUET.exists() and "TextoIntegral" in pq.read_schema(META_PARQUET).names:
+        table = pq.read_table(
+            META_PARQUET,
+            columns=["TextoIntegral"],
+            filters=[("CodigoPronunciamento", "=", codigo)],
         )
-        return df
+        if table.num_rows:
+            return table.column(0)[0].as_py()
 
-    return pd.DataFrame()
+    if SAMPLE_SQLITE.exists():
+        con = sqlite3.connect(SAMPLE_SQLITE)
+        try:
+            row = con.execute(
+                "SELECT TextoIntegral FROM DiscursosAmostra WHERE CodigoPronunciamento = ?", (codigo,)
+            ).fetchone()
+        finally:
+            con.close()
+        return row[0] if row else None
+
+    return None
+
+
+def build_text_store(dest: Path = TEXTOS_SQLITE, batch_size: int = 2_000) -> int:
+    """Build the indexed speech text store used by :func:`load_texto`.
+
+    Copies ``CodigoPronunciamento, TextoIntegral`` from
+    ``data/discursos_meta.parquet`` (or ``Amostra_1.sqlite``) into a SQLite
+    table keyed by ``CodigoPronunciamento``. Returns the number of rows.
+    Run it after (re)building the metadata: ``python utils.py``.
+    """
+    dest.parent.mkdir(parents=True, exist_ok=True)
+    con = sqlite3.connect(dest)
+    con.execute(
+        "CREATE TABLE IF NOT EXISTS textos ("
+        " CodigoPronunciamento INTEGER PRIMARY KEY, TextoIntegral TEXT)"
+    )
+    insert = "INSERT OR REPLACE INTO textos VALUES (?, ?)"
+    n = 0
+    try:
+        rows = []
+        for row in iter_textos(batch_size):
+            rows.append(row)
+            if len(rows) >= batch_size:
+                con.executemany(insert, rows)
+                n += len(rows)
+                rows = []
+        con.executemany(insert, rows)
+        n += len(rows)
+        con.commit()
+    finally:
+        con.close()
+    return n
+
+
+def iter_textos(batch_size: int = 2_000) -> Iterator[Tuple[int, str]]:
+    """Stream ``(CodigoPronunciamento, TextoIntegral)`` from the metadata
+    Parquet or, failing that, ``Amostra_1.sqlite``."""
+    if META_PARQUET.exists() and "TextoIntegral" in pq.read_schema(META_PARQUET).names:
+        pf = pq.ParquetFile(META_PARQUET)
+        for batch in pf.iter_batches(batch_size=batch_size, columns=["CodigoPronunciamento", "TextoIntegral"]):
+            yield from zip(*(batch.column(i).to_pylist() for i in range(2)))
+    elif SAMPLE_SQLITE.exists():
+        src = sqlite3.connect(SAMPLE_SQLITE)
+        try:
+            cur = src.execute("SELECT CodigoPronunciamento, TextoIntegral FROM DiscursosAmostra")
+            while rows := cur.fetchmany(batch_size):
+                yield from rows
+        finally:
+            src.close()
+
+
+@st.cache_resource(show_spinner=False)
+def load_search_index() -> Optional[sqlite3.Connection]:
+    """Read-only connection to the full-text index of ``spans_long.parquet``.
+
+    The index (``src/busca.py``) is normally built at ingestion; if it is
+    missing or older than the Parquet it is rebuilt here, once per process.
+    Returns ``None`` when the spans do not come from the Parquet (row ids
+    would not line up), in which case search falls back to a substring scan.
+    """
+    if not SPANS_PARQUET.exists():
+        return None
+    destino = busca.caminho_indice(SPANS_PARQUET)
+    if not busca.indice_atualizado(SPANS_PARQUET, destino):
+        busca.construir_indice(SPANS_PARQUET, iter_textos(), destino)
+    return busca.abrir_indice(destino)
+
+
+@st.cache_resource(show_spinner=False)
+def load_dataset() -> Tuple[pd.DataFrame, pd.DataFrame, "FilterIndex"]:
+    """Spans joined with compact metadata, plus the filter index over them.
+
+    Built once per process (``st.cache_resource``: shared, not copied on each
+    rerun), so pages must treat the returned frames as read-only.
+    """
+    spans = load_spans()
+    meta = load_meta()
+    if not meta.empty:
+        spans = spans.merge(meta, on="CodigoPronunciamento", how="left")
+    if "Data" in spans:
+        spans["Data"] = pd.to_datetime(spans["Data"])
+        spans["ano_mes"] = spans["Data"].dt.to_period("M").astype(str).astype("category")
+    if "tamanho_discurso_palavras" not in spans:
+        spans["tamanho_discurso_palavras"] = 1
+    spans = _compact(to_density(spans)).reset_index(drop=True)
+    return spans, meta, FilterIndex(spans, search=load_search_index())
+
+
+@st.cache_resource(show_spinner=False)
+def load_cube() -> pd.DataFrame:
+    """Pre-aggregated density cube (see ``src/cubo.py``) for the charts.
+
+    Read from ``spans_long.cubo.parquet`` when it matches the current spans
+    Parquet; otherwise built once from :func:`load_dataset` and, if the spans
+    come from the Parquet, written back next to it.
+    """
+    if SPANS_PARQUET.exists() and cubo.cubo_atualizado(SPANS_PARQUET):
+        return pd.read_parquet(cubo.caminho_cubo(SPANS_PARQUET))
+    spans, _, _ = load_dataset()
+    cube = cubo.construir_cubo(spans)
+    if SPANS_PARQUET.exists():
+        cubo.gravar_cubo(cube, SPANS_PARQUET)
+    return cube
+
+
+def rollup(
+    dims: List[str],
+    f: Dict[str, Any],
+    normalizado: bool,
+    cube: Optional[pd.DataFrame],
+    df_plot: pd.DataFrame,
+) -> pd.DataFrame:
+    """``peso`` summed by ``dims`` under filters ``f``.
+
+    Answered from the cube when it can express the filters (no text search);
+    otherwise aggregated from the filtered span rows ``df_plot``.
+    """
+    if cube is not None and cubo.atende(f):
+        out = cubo.rolar(cube, f, dims)
+        return out[dims].assign(peso=out["peso" if normalizado else "n_spans"])
+    return df_plot.groupby(dims, as_index=False, observed=True)["peso"].sum()
+
+
+class PandasBackend:
+    """Dashboard queries answered in memory (default backend).
+
+    Wraps :func:`load_dataset` (frames + :class:`FilterIndex`) and
+    :func:`load_cube`. ``duckdb_backend.DuckDBBackend`` exposes the same
+    methods and answers them in SQL over Parquet instead.
+    """
+
+    def __init__(self):
+        self.spans, self.meta, self.index = load_dataset()
+        self.cube = load_cube()
+        self._last: Tuple[Any, Optional[pd.DataFrame]] = (None, None)
+
+    def filtered(self, f: Dict[str, Any]) -> pd.DataFrame:
+        """Filtered span rows; the last result is reused within a rerun."""
+        key = repr(sorted(f.items()))
+        last_key, last = self._last
+        if key != last_key:
+            last = self.index.apply(f)
+            self._last = (key, last)
+        return last
+
+    def date_bounds(self) -> Tuple[pd.Timestamp, pd.Timestamp]:
+        if "Data" not in self.spans:
+            today = pd.Timestamp.today().normalize()
+            return today, today
+        return self.spans["Data"].min(), self.spans["Data"].max()
+
+    def options(self, col: str) -> List[Any]:
+        return self.index.options(col)
+
+    def summary(self, f: Dict[str, Any]) -> Dict[str, int]:
+        df = self.filtered(f)
+        return {
+            "discursos": int(df["CodigoPronunciamento"].nunique()),
+            "spans": int(len(df)),
+            "oradores": int(df.get("NomeParlamentar", pd.Series(dtype=object)).nunique()),
+            "partidos": int(df.get("SiglaPartidoParlamentarNaData", pd.Series(dtype=object)).nunique()),
+        }
+
+    def rollup(self, dims: List[str], f: Dict[str, Any], normalizado: bool) -> pd.DataFrame:
+        if any(d not in self.spans for d in dims):
+            return pd.DataFrame(columns=dims + ["peso"])
+        df = self.filtered(f)
+        return rollup(dims, f, normalizado, self.cube, df if normalizado else df.assign(peso=1))
+
+    def rows(
+        self,
+        f: Dict[str, Any],
+        columns: List[str],
+        limit: Optional[int] = None,
+        offset: int = 0,
+    ) -> pd.DataFrame:
+        df = self.filtered(f)
+        df = df[[c for c in columns if c in df.columns]]
+        return df.iloc[offset:] if limit is None else df.iloc[offset:offset + limit]
+
+    def iter_batches(self, f: Dict[str, Any], columns: List[str], batch_size: int = 50_000) -> Iterator[pa.RecordBatch]:
+        """Filtered rows as Arrow record batches with one fixed schema."""
+        df = self.rows(f, columns)
+        fields = []
+        for col, dtype in df.dtypes.items():
+            if dtype == object or isinstance(dtype, pd.CategoricalDtype):
+                fields.append(pa.field(col, pa.string()))
+            else:
+                fields.append(pa.Schema.from_pandas(df[[col]].head(0), preserve_index=False).field(col))
+        schema = pa.schema(fields)
+        for start in range(0, len(df), batch_size):
+            chunk = df.iloc[start:start + batch_size]
+            chunk = chunk.astype({c: object for c in chunk.columns if isinstance(chunk[c].dtype, pd.CategoricalDtype)})
+            yield pa.RecordBatch.from_pandas(chunk, schema=schema, preserve_index=False)
+
+    def speech(self, codigo: int) -> Tuple[pd.DataFrame, pd.DataFrame]:
+        meta_row = self.meta[self.meta["CodigoPronunciamento"] == codigo] if not self.meta.empty else self.meta
+        return meta_row, self.spans[self.spans["CodigoPronunciamento"] == codigo]
+
+
+# format -> (MIME type, file extension)
+EXPORT_FORMATS = {
+    "CSV": ("text/csv", ".csv"),
+    "Parquet": ("application/vnd.apache.parquet", ".parquet"),
+    "Arrow IPC": ("application/vnd.apache.arrow.file", ".arrow"),
+}
+# st.download_button reads the whole file into memory and keeps a copy in
+# Streamlit's media store, so only exports up to this size are offered through
+# the browser; larger ones are kept on disk under EXPORT_DIR instead.
+EXPORT_MAX_DOWNLOAD_BYTES = 100 * 1024 * 1024
+EXPORT_DIR = Path("data/exportacoes")
+
+
+def export_rows(backend, f: Dict[str, Any], columns: List[str], fmt: str, batch_size: int = 50_000) -> Path:
+    """Write the filtered rows to a temporary file, one record batch at a time.
+
+    Rows come from ``backend.iter_batches``, so neither the whole result nor
+    the encoded file is held in memory while it is generated.
+    """
+    reader = backend.iter_batches(f, columns, batch_size)
+    first = next(reader, None)
+    _, suffix = EXPORT_FORMATS[fmt]
+    fd, name = tempfile.mkstemp(prefix="spans_", suffix=suffix)
+    os.close(fd)
+    path = Path(name)
+    if first is None:
+        first = pa.RecordBatch.from_pylist([], schema=pa.schema([pa.field(c, pa.string()) for c in columns]))
+    if fmt == "CSV":
+        writer = pacsv.CSVWriter(str(path), first.schema)
+    elif fmt == "Parquet":
+        writer = pq.ParquetWriter(str(path), first.schema)
+    else:
+        writer = pa.ipc.new_file(str(path), first.schema)
+    try:
+        if first.num_rows:
+            writer.write_batch(first)
+        for batch in reader:
+            writer.write_batch(batch)
+    finally:
+        writer.close()
+    return path
+
+
+@st.cache_resource(show_spinner=False)
+def get_backend():
+    """Backend chosen by ``FIGURAS_BACKEND`` (``pandas``, default, or ``duckdb``)."""
+    if os.environ.get("FIGURAS_BACKEND", "pandas").lower() == "duckdb":
+        from duckdb_backend import DuckDBBackend
+
+        return DuckDBBackend()
+    return PandasBackend()
 
 
 # ---------------------------------------------------------------------------
 # Filtering helpers
 # ---------------------------------------------------------------------------
 
+class FilterIndex:
+    """Precomputed indexes answering :func:`apply_filters` queries.
+
+    Built once at load time:
+
+    * categorical columns (label, orador, partido): integer codes plus, per
+      value, the sorted row ids holding it;
+    * ``Data``: row ids sorted by date, for range queries via ``searchsorted``;
+    * ``confidence``: row ids sorted by confidence (same idea for ``conf_min``);
+    * ``CodigoPronunciamento``: row ids sorted by speech, to expand speech-level
+      search hits into their spans;
+    * text search (``q``): the FTS5 index of :mod:`src.busca`, over span
+      text/rationale/cues (``q_em="spans"``) or the speech text
+      (``q_em="discursos"``). Results keep the search ranking (bm25).
+
+    A query takes the most selective criterion as the candidate set and checks
+    the others only on those candidates (code lookups / comparisons on numpy
+    arrays), so only the final rows are materialised with ``take``.
+    """
+
+    CATEGORY_FILTERS = {
+        "labels": "label",
+        "oradores": "NomeParlamentar",
+        "partidos": "SiglaPartidoParlamentarNaData",
+    }
+
+    def __init__(self, df: pd.DataFrame, search: Optional[sqlite3.Connection] = None):
+        self.df = df
+        self.n = len(df)
+        self.search = search
+        self.codes: Dict[str, np.ndarray] = {}
+        self.categories: Dict[str, pd.Index] = {}
+        self.rows_by_code: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}
+        for col in self.CATEGORY_FILTERS.values():
+            if col not in df:
+                continue
+            cat = df[col].astype("category")
+            codes = cat.cat.codes.to_numpy()
+            order = np.argsort(codes, kind="stable")
+            # bounds[k]:bounds[k+1] slices `order` for code k (code -1 = NaN is skipped)
+            counts = np.bincount(codes[codes >= 0], minlength=len(cat.cat.categories))
+            bounds = np.concatenate(([0], np.cumsum(counts))) + int((codes < 0).sum())
+            self.codes[col] = codes
+            self.categories[col] = cat.cat.categories
+            self.rows_by_code[col] = (order, bounds)
+
+        self.dates = self.date_order = None
+        if "Data" in df:
+            dates = df["Data"].to_numpy(dtype="datetime64[ns]")
+            self.dates = dates
+            self.date_order = np.argsort(dates, kind="stable")  # NaT sorts last
+            self.dates_sorted = dates[self.date_order]
+            self.n_dates = int((~np.isnat(dates)).sum())
+
+        self.conf = self.conf_order = None
+        if "confidence" in df:
+            conf = df["confidence"].to_numpy(dtype="float64", na_value=np.nan)
+            self.conf = conf
+            self.conf_order = np.argsort(conf, kind="stable")  # NaN sorts last
+            self.conf_sorted = conf[self.conf_order]
+            self.n_conf = int((~np.isnan(conf)).sum())
+
+        self.speech_order = None
+        if "CodigoPronunciamento" in df:
+            speech = df["CodigoPronunciamento"].to_numpy(dtype="float64", na_value=np.nan)
+            self.speech_order = np.argsort(speech, kind="stable")
+            self.speech_sorted = speech[self.speech_order]
+
+    def options(self, col: str) -> List[Any]:
+        """Sorted distinct values of a categorical column (for the sidebar)."""
+        if col in self.categories:
+            present = np.unique(self.codes[col][self.codes[col] >= 0])
+            return sorted(self.categories[col][present])
+        return []
+
+    # -- candidate generators ---------------------------------------------
+
+    def _category_rows(self, col: str, values) -> np.ndarray:
+        order, bounds = self.rows_by_code[col]
+        wanted = np.unique(self.categories[col].get_indexer(list(values)))
+        parts = [order[bounds[k]:bounds[k + 1]] for k in wanted if k >= 0]
+        return np.sort(np.concatenate(parts)) if parts else np.empty(0, dtype=np.int64)
+
+    def _date_bounds(self, ini, fim) -> Tuple[int, int]:
+        lo = np.searchsorted(self.dates_sorted[: self.n_dates], np.datetime64(pd.Timestamp(ini), "ns"), "left")
+        hi = np.searchsorted(self.dates_sorted[: self.n_dates], np.datetime64(pd.Timestamp(fim), "ns"), "right")
+        return int(lo), int(hi)
+
+    def _conf_bounds(self, conf_min: float) -> Tuple[int, int]:
+        lo = np.searchsorted(self.conf_sorted[: self.n_conf], conf_min, "left")
+        return int(lo), self.n_conf
+
+    def _search_rows(self, q: str, scope: str) -> np.ndarray:
+        """Row ids matching ``q`` in search-rank order."""
+        if scope == "discursos":
+            codigos = busca.buscar_discursos(self.search, q)
+            if self.speech_order is None or not len(codigos):
+                return np.empty(0, dtype=np.int64)
+            lo = np.searchsorted(self.speech_sorted, codigos, "left")
+            hi = np.searchsorted(self.speech_sorted, codigos, "right")
+            nz = hi > lo
+            lo, hi = lo[nz], hi[nz]
+            if not len(lo):
+                return np.empty(0, dtype=np.int64)
+            # concatenate the ranges lo[i]:hi[i] (in rank order) via cumsum of steps
+            lengths = hi - lo
+            steps = np.ones(int(lengths.sum()), dtype=np.int64)
+            steps[0] = lo[0]
+            steps[np.cumsum(lengths)[:-1]] = lo[1:] - hi[:-1] + 1
+            return self.speech_order[np.cumsum(steps)]
+        rows = busca.buscar_spans(self.search, q)
+        return rows[rows < self.n]
+
+    # -- query ------------------------------------------------------------
+
+    def query(self, f: Dict[str, Any]) -> Optional[np.ndarray]:
+        """Row ids matching ``f`` (``None`` = no restriction), sorted, or in
+        search-rank order when ``q`` goes through the full-text index."""
+        criteria = []  # (estimated size, kind, payload)
+        for key, col in self.CATEGORY_FILTERS.items():
+            if f.get(key) and col in self.codes:
+                wanted = np.unique(self.categories[col].get_indexer(list(f[key])))
+                order, bounds = self.rows_by_code[col]
+                size = int(sum(bounds[k + 1] - bounds[k] for k in wanted if k >= 0))
+                criteria.append((size, "cat", (col, f[key], wanted[wanted >= 0])))
+        if f.get("data_ini") and f.get("data_fim") and self.dates is not None:
+            lo, hi = self._date_bounds(f["data_ini"], f["data_fim"])
+            criteria.append((hi - lo, "date", (lo, hi)))
+        if f.get("conf_min") is not None and self.conf is not None:
+            lo, hi = self._conf_bounds(float(f["conf_min"]))
+            criteria.append((hi - lo, "conf", (lo, hi)))
+
+        ranked = None
+        if f.get("q") and self.search is not None:
+            ranked = self._search_rows(f["q"], f.get("q_em") or "spans")
+            criteria.append((len(ranked), "ids", np.sort(ranked)))
+
+        if not criteria:
+            return None
+        criteria.sort(key=lambda c: c[0])
+
+        size, kind, payload = criteria[0]
+        if kind == "cat":
+            ids = self._category_rows(payload[0], payload[1])
+        elif kind == "ids":
+            ids = payload
+        elif kind == "date":
+            ids = np.sort(self.date_order[payload[0]:payload[1]])
+        else:
+            ids = np.sort(self.conf_order[payload[0]:payload[1]])
+
+        for _, kind, payload in criteria[1:]:
+            if not len(ids):
+                break
+            if kind == "cat":
+                col, _, wanted = payload
+                ids = ids[np.isin(self.codes[col][ids], wanted)]
+            elif kind == "ids":
+                ids = ids[np.isin(ids, payload, assume_unique=True)]
+            elif kind == "date":
+                d = self.dates[ids]
+                ini = np.datetime64(pd.Timestamp(f["data_ini"]), "ns")
+                fim = np.datetime64(pd.Timestamp(f["data_fim"]), "ns")
+                ids = ids[(d >= ini) & (d <= fim)]
+            else:
+                ids = ids[self.conf[ids] >= float(f["conf_min"])]
+        if ranked is not None:
+            ids = ranked[np.isin(ranked, ids, assume_unique=True)]
+        return ids
+
+    def apply(self, f: Dict[str, Any]) -> pd.DataFrame:
+        """Filtered frame. Without a search index, ``q`` falls back to the
+        substring scan of :func:`apply_filters`."""
+        ids = self.query(f)
+        out = self.df if ids is None else self.df.take(ids)
+        if f.get("q") and self.search is None:
+            out = out[out["text"].str.contains(f["q"], case=False, na=False, regex=False)]
+        return out
+
+
 def apply_filters(df: pd.DataFrame, f: Dict[str, Any]) -> pd.DataFrame:
-    out = df.copy()
+    """Unindexed filtering (boolean masks); see :class:`FilterIndex`."""
+    out = df
     if f.get("labels"):
         out = out[out["label"].isin(f["labels"])]
     if f.get("oradores"):
@@ -101,7 +606,7 @@ def apply_filters(df: pd.DataFrame, f: Dict[str, Any]) -> pd.DataFrame:
     if f.get("data_ini") and f.get("data_fim"):
         out = out[(out["Data"] >= f["data_ini"]) & (out["Data"] <= f["data_fim"])]
     if f.get("q"):
-        out = out[out["text"].str.contains(f["q"], case=False, na=False)]
+        out = out[out["text"].str.contains(f["q"], case=False, na=False, regex=False)]
     return out
 
 
@@ -118,6 +623,13 @@ def to_density(df: pd.DataFrame) -> pd.DataFrame:
 def highlight_spans(text: str, spans: pd.DataFrame) -> str:
     """Return HTML with spans highlighted by label.
 
+    One sweep over the sorted span boundaries: the text is cut at every
+    ``start_char``/``end_char`` and each piece is wrapped in a single
+    ``<mark>`` carrying the labels of all spans covering it, so overlapping
+    and nested spans never duplicate or drop text. Pieces covered by more
+    than one span get the ``overlap`` class; each span's badge is placed at
+    its end.
+
     Parameters
     ----------
     text: str
@@ -130,18 +642,77 @@ def highlight_spans(text: str, spans: pd.DataFrame) -> str:
     if spans is None or spans.empty:
         return html.escape(text)
 
-    spans = spans.sort_values("start_char")
+    n = len(text)
+    starts = pd.to_numeric(spans["start_char"], errors="coerce").to_numpy(dtype="float64")
+    ends = pd.to_numeric(spans["end_char"], errors="coerce").to_numpy(dtype="float64")
+    labels = spans["label"].astype(str).to_numpy() if "label" in spans else np.full(len(spans), "")
+    ok = ~np.isnan(starts) & ~np.isnan(ends)
+    starts = np.clip(starts[ok], 0, n).astype(np.int64)
+    ends = np.clip(ends[ok], 0, n).astype(np.int64)
+    labels = labels[ok]
+    valid = ends > starts
+    starts, ends, labels = starts[valid], ends[valid], labels[valid]
+    if not len(starts):
+        return html.escape(text)
+
+    # span ids opening / closing at each boundary
+    by_start = np.argsort(starts, kind="stable")
+    by_end = np.argsort(ends, kind="stable")
+    bounds = np.unique(np.concatenate(([0, n], starts, ends)))
     parts = []
-    last = 0
-    for _, row in spans.iterrows():
-        start = int(row["start_char"])
-        end = int(row["end_char"])
-        label = row.get("label", "")
-        parts.append(html.escape(text[last:start]))
-        snippet = html.escape(text[start:end])
-        parts.append(
-            f'<mark class="label-{label}">{snippet}<span class="badge">{label}</span></mark>'
+    active: Dict[int, str] = {}
+    i_start = i_end = 0
+    for pos, nxt in zip(bounds[:-1], bounds[1:]):
+        while i_end < len(by_end) and ends[by_end[i_end]] <= pos:
+            active.pop(int(by_end[i_end]), None)
+            i_end += 1
+        while i_start < len(by_start) and starts[by_start[i_start]] <= pos:
+            k = int(by_start[i_start])
+            if ends[k] > pos:
+                active[k] = labels[k]
+            i_start += 1
+        piece = html.escape(text[pos:nxt])
+        if not active:
+            parts.append(piece)
+            continue
+        names = list(dict.fromkeys(active.values()))
+        classes = " ".join(f"label-{name}" for name in names)
+        if len(active) > 1:
+            classes += " overlap"
+        badges = "".join(
+            f'<span class="badge">{html.escape(active[k])}</span>' for k in active if ends[k] == nxt
         )
-        last = end
-    parts.append(html.escape(text[last:]))
+        parts.append(f'<mark class="{classes}" title="{html.escape(", ".join(names))}">{piece}{badges}</mark>')
     return "".join(parts)
+
+
+def filter_speech_spans(spans_disc: pd.DataFrame, labels: Tuple[str, ...] = (), conf_min: float = 0.0) -> pd.DataFrame:
+    """Spans of one speech restricted to the sidebar label/confidence filters."""
+    if labels:
+        spans_disc = spans_disc[spans_disc["label"].isin(labels)]
+    if conf_min:
+        spans_disc = spans_disc[spans_disc["confidence"] >= conf_min]
+    return spans_disc
+
+
+@st.cache_data(show_spinner=False, max_entries=128)
+def render_speech(codigo: int, labels: Tuple[str, ...] = (), conf_min: float = 0.0) -> str:
+    """Highlighted HTML of one speech, for the spans passing the label and
+    confidence filters. Cached per (speech, filter set); least recently used
+    entries are evicted past ``max_entries``."""
+    _, spans_disc = get_backend().speech(int(codigo))
+    spans_disc = filter_speech_spans(spans_disc, labels, conf_min)
+    return highlight_spans(load_texto(codigo) or "", spans_disc)
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Build the indexed speech text store used by the dashboard.")
+    ap.add_argument("--dest", default=str(TEXTOS_SQLITE), help="SQLite file to write")
+    ap.add_argument("--batch-size", type=int, default=2_000, help="Rows per insert batch")
+    args = ap.parse_args()
+    n = build_text_store(Path(args.dest), args.batch_size)
+    print(f"[OK] Text store: {n} speeches -> {args.dest}")
+
+
+if __name__ == "__main__":
+    main()